@@ -302,10 +302,10 @@ def process(output_mat_fname,
     B-field information if *save_B*.
     """
     # gather Bx and By magnetometer measurements
-    _, data_map = parse(input_iaga2002_fname)
-    interval = int((data_map.keys()[1] - data_map.keys()[0]).total_seconds())
-    Bx = nan_interp([record.x * 1e-9 for record in data_map.itervalues()])
-    By = nan_interp([record.y * 1e-9 for record in data_map.itervalues()])
+    _, columns = parse(input_iaga2002_fname, columnar=True)
+    interval = int((columns['time'][1] - columns['time'][0]) / NP.timedelta64(1, 's'))
+    Bx = nan_interp(columns['x'] * 1e-9)
+    By = nan_interp(columns['y'] * 1e-9)
     # filter with transfer function
     Ex, Ey = apply_transfer_function(Bx,
                                      By,
@@ -313,7 +313,7 @@ def process(output_mat_fname,
                                      xml_fname)
     # save E field
     stn_name = os.path.basename(input_iaga2002_fname)[:3]
-    j2000 = map(toJ2000, data_map.iterkeys())
+    j2000 = map(toJ2000, columns['time'].tolist())
     mdict = {'Ex': Ex,
              'Ey': Ey,
              'j2000': j2000,
@@ -322,8 +322,8 @@ def process(output_mat_fname,
     if save_B:
         mdict['Bx'] = Bx
         mdict['By'] = By
-        mdict['Bx_raw'] = [x.x * 1e-9 for x in data_map.itervalues()]
-        mdict['By_raw'] = [x.y * 1e-9 for x in data_map.itervalues()]
+        mdict['Bx_raw'] = columns['x'] * 1e-9
+        mdict['By_raw'] = columns['y'] * 1e-9
     savemat(output_mat_fname, mdict)
     return output_mat_fname
 
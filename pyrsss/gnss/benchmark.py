@@ -0,0 +1,727 @@
+from __future__ import division
+
+import os
+import sys
+import json
+import math
+import time
+import logging
+import resource
+import multiprocessing
+from Queue import Empty
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+
+import numpy as NP
+
+from constants import GPS_EPOCH, F_1, F_2, LAMBDA_1, LAMBDA_2, TECU_TO_M
+from util import get_gps_week
+from observation import ObsMap
+from level import ArcMap, level_phase_to_code
+from rindump import read_rindump, GPS_KEYS
+from spp import spp
+from ..ionex.read_ionex import parser as ionex_parser, IonexCube
+from ..ionex.write_ionex import write_ionex as write_cube
+from ..ionex.cache import CACHE_ENV
+from ..util.path import SmartTempDir, touch_path
+from ..util.timer import Timer
+
+logger = logging.getLogger('pyrsss.gps.benchmark')
+
+
+"""
+Benchmarks of the GNSS TEC processing pipeline computed on
+deterministic synthetic data. RINEX dump and IONEX records are
+generated as recorded fixtures (i.e., text in the format produced by
+GPSTk RinDump and the IGS analysis centers) so that every stage runs
+offline, without teqc or GPSTk binaries.
+"""
+
+
+START_DT = datetime(2014, 1, 1)
+"""
+Default start time of the synthetic records.
+"""
+
+STN_LLH = (40.1, -88.2, 220.)
+"""
+Default synthetic receiver position ([deg], [deg], [m]).
+"""
+
+DURATION_MAP = OrderedDict([(30, 24 * 60 * 60),
+                            (1, 60 * 60)])
+"""
+Default mapping between observation interval [s] and synthetic record
+length [s].
+"""
+
+N_SATS = 32
+"""
+Default number of synthetic GPS satellites.
+"""
+
+IONEX_INTERVAL = 2 * 60 * 60
+"""
+Default time interval [s] between synthetic IONEX maps.
+"""
+
+ORBIT_PERIOD = 11 * 60 * 60 + 58 * 60
+"""
+Approximate GPS orbital period [s].
+"""
+
+ORBIT_RADIUS = 26560e3
+"""
+Approximate GPS orbital radius [m].
+"""
+
+VISIBLE_FRACTION = 0.4
+"""
+Fraction of each synthetic orbit that the satellite is above the
+horizon.
+"""
+
+WGS84_A = 6378137.
+"""
+WGS84 semi-major axis [m].
+"""
+
+WGS84_E2 = 6.69437999014e-3
+"""
+WGS84 first eccentricity squared.
+"""
+
+RE = 6371e3
+"""
+Mean Earth radius [m] used in synthetic geometry calculations.
+"""
+
+STAGE_TIMEOUT = 60 * 60
+"""
+Time [s] to wait for a benchmark stage worker process before the
+stage is abandoned.
+"""
+
+BASELINE_JSON = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'benchmark_baseline.json')
+"""
+Stored baseline results (see :func:`main`).
+"""
+
+TOLERANCE = 0.2
+"""
+Default fractional slow down, relative to the baseline, reported as a
+regression.
+"""
+
+MIN_DELTA = 0.01
+"""
+Default slow down [s], relative to the baseline, below which a stage
+is not reported as a regression (i.e., timing noise of the short
+stages).
+"""
+
+REPEATS = 3
+"""
+Default number of runs of each stage (the minimum elapsed time is
+reported).
+"""
+
+
+class Fixture(namedtuple('Fixture',
+                         'interval '
+                         'rindump_fname '
+                         'ionex_fname '
+                         'work_path '
+                         'N_obs')):
+    pass
+
+
+def llh2xyz(lat, lon, alt):
+    """
+    Convert geodetic *lat* [deg], *lon* [deg], and *alt* [m] to ECEF
+    [m] (WGS84).
+    """
+    lat_rad = NP.radians(lat)
+    lon_rad = NP.radians(lon)
+    N = WGS84_A / NP.sqrt(1 - WGS84_E2 * NP.sin(lat_rad)**2)
+    return NP.array([(N + alt) * NP.cos(lat_rad) * NP.cos(lon_rad),
+                     (N + alt) * NP.cos(lat_rad) * NP.sin(lon_rad),
+                     (N * (1 - WGS84_E2) + alt) * NP.sin(lat_rad)])
+
+
+def azel2xyz(stn_llh, az, el, rng):
+    """
+    Return the ECEF positions [m] (3 x N array) found at range *rng*
+    [m] along the lines-of-sight given by azimuth *az* [deg] and
+    elevation *el* [deg] from the receiver at *stn_llh*.
+    """
+    lat_rad = math.radians(stn_llh[0])
+    lon_rad = math.radians(stn_llh[1])
+    az_rad = NP.radians(az)
+    el_rad = NP.radians(el)
+    enu = NP.vstack((NP.cos(el_rad) * NP.sin(az_rad),
+                     NP.cos(el_rad) * NP.cos(az_rad),
+                     NP.sin(el_rad)))
+    R = NP.array([[-math.sin(lon_rad),
+                   -math.sin(lat_rad) * math.cos(lon_rad),
+                   math.cos(lat_rad) * math.cos(lon_rad)],
+                  [math.cos(lon_rad),
+                   -math.sin(lat_rad) * math.sin(lon_rad),
+                   math.cos(lat_rad) * math.sin(lon_rad)],
+                  [0,
+                   math.cos(lat_rad),
+                   math.sin(lat_rad)]])
+    return llh2xyz(*stn_llh)[:, NP.newaxis] + NP.dot(R, enu) * rng
+
+
+def synthetic_vtec(t, lat, lon):
+    """
+    Return the synthetic vertical TEC [TECU] at seconds of day *t*,
+    latitude *lat* [deg], and longitude *lon* [deg] (arguments are
+    broadcast). The model is a smooth daytime enhancement centered on
+    14 LT.
+    """
+    lt = (t / 3600 + NP.asarray(lon) / 15) % 24
+    return (5 +
+            25 * NP.cos(NP.radians(lat))**2 *
+            NP.exp(-((lt - 14) / 5)**2))
+
+
+def synthetic_obs(interval,
+                  duration,
+                  n_sats=N_SATS,
+                  stn_llh=STN_LLH,
+                  seed=0):
+    """
+    Generate a deterministic set of dual-frequency GPS observations
+    at *interval* [s] spanning *duration* [s] for *n_sats* satellites
+    observed from *stn_llh*. Use *seed* to initialize the random
+    number generator. Return a list of per satellite mappings between
+    column identifier (including `sat` and `t`, seconds since the
+    record start) and arrays of values.
+    """
+    rs = NP.random.RandomState(seed)
+    t = NP.arange(0, duration, interval, dtype=NP.float64)
+    sats = []
+    for i in range(n_sats):
+        phase = (t / ORBIT_PERIOD + i / n_sats + 0.1 * rs.rand()) % 1
+        I = phase < VISIBLE_FRACTION
+        if not NP.any(I):
+            continue
+        u = phase[I] / VISIBLE_FRACTION
+        el_max = 30 + 55 * rs.rand()
+        el = NP.maximum(el_max * NP.sin(NP.pi * u), 0.5)
+        az = (360 * rs.rand() + 180 * u) % 360
+        el_rad = NP.radians(el)
+        rng = (-RE * NP.sin(el_rad) +
+               NP.sqrt((RE * NP.sin(el_rad))**2 + ORBIT_RADIUS**2 - RE**2))
+        sat_xyz = azel2xyz(stn_llh, az, el, rng)
+        # thin shell STEC at the receiver location
+        mapping = 1 / NP.sqrt(1 - (RE * NP.cos(el_rad) / (RE + 450e3))**2)
+        stec = synthetic_vtec(t[I], stn_llh[0], stn_llh[1]) * mapping
+        I1 = stec * TECU_TO_M * F_2**2 / (F_1**2 - F_2**2)
+        I2 = I1 * (F_1 / F_2)**2
+        sigma = 0.3 / NP.sin(NP.maximum(el_rad, NP.radians(10)))
+        P1 = rng + I1 + sigma * rs.randn(len(rng))
+        P2 = rng + I2 + sigma * rs.randn(len(rng))
+        N1 = rs.randint(-10**6, 10**6)
+        N2 = rs.randint(-10**6, 10**6)
+        sats.append({'sat': 'G{:02d}'.format(i + 1),
+                     't': t[I],
+                     'GC1C': P1 + 0.1 * rs.randn(len(rng)),
+                     'GC1W': P1,
+                     'GL1C': (rng - I1) / LAMBDA_1 + N1,
+                     'GC2W': P2,
+                     'GL2W': (rng - I2) / LAMBDA_2 + N2,
+                     'ELE': el,
+                     'AZI': az,
+                     'SVX': sat_xyz[0],
+                     'SVY': sat_xyz[1],
+                     'SVZ': sat_xyz[2]})
+    return sats
+
+
+def write_rindump(rindump_fname,
+                  sats,
+                  start_dt=START_DT,
+                  stn_llh=STN_LLH,
+                  stn='synt',
+                  data_keys=GPS_KEYS):
+    """
+    Write the synthetic observations *sats* (see
+    :func:`synthetic_obs`) beginning at *start_dt* to
+    *rindump_fname* in the format of GPSTk RinDump output (with the
+    footer lines appended by :func:`pyrsss.gnss.rinex.dump_rinex`). The
+    receiver at *stn_llh* is identified as *stn*. Return the number of
+    observations written.
+    """
+    week = get_gps_week(start_dt)
+    sow0 = (start_dt - GPS_EPOCH).total_seconds() - week * 7 * 86400
+    # merge and sort all satellite records by time and then satellite
+    t = NP.hstack([x['t'] for x in sats])
+    sat_index = NP.hstack([NP.full(len(x['t']), i) for i, x in enumerate(sats)])
+    I = NP.lexsort((sat_index, t))
+    columns = NP.vstack([NP.hstack([x[key] for x in sats]) for key in data_keys]).T[I]
+    t = t[I]
+    sat_index = sat_index[I]
+    xyz = llh2xyz(*stn_llh)
+    with open(rindump_fname, 'w') as fid:
+        fid.write('# RinDump synthetic fixture generated by pyrsss.gnss.benchmark\n')
+        fid.write('# Refpos XYZ(m): {:.4f} {:.4f} {:.4f} '
+                  'LLH (ddm): {:.9f}N {:.9f}E {:.4f}\n'.format(xyz[0],
+                                                               xyz[1],
+                                                               xyz[2],
+                                                               stn_llh[0],
+                                                               stn_llh[1] % 360,
+                                                               stn_llh[2]))
+        fid.write('# wk secs sat {}\n'.format(' '.join(data_keys)))
+        line_template = '{} {:.3f} {} ' + ' '.join(['{:.3f}'] * len(data_keys)) + '\n'
+        for t_i, sat_index_i, columns_i in zip(t, sat_index, columns):
+            fid.write(line_template.format(week,
+                                           sow0 + t_i,
+                                           sats[sat_index_i]['sat'],
+                                           *columns_i))
+        fid.write('# Station ID: {}\n'.format(stn))
+        fid.write('# Receiver type: SYNTHETIC\n')
+        fid.write('# Receiver p1c1 type: 3\n')
+        for x in sats:
+            fid.write('# P1-C1 [m]: {}: {:8.3f}\n'.format(x['sat'], 0))
+    return len(t)
+
+
+def write_ionex(ionex_fname,
+                start_dt=START_DT,
+                interval=IONEX_INTERVAL,
+                n_sats=N_SATS,
+                exponent=-1,
+                lats=NP.arange(87.5, -87.5 - 2.5, -2.5),
+                lons=NP.arange(-180, 180 + 5, 5)):
+    """
+    Write a synthetic global IONEX record to *ionex_fname* with TEC
+    and RMS maps every *interval* [s] over the day beginning at
+    *start_dt*. Include GPS satellite DCBs for *n_sats*
+    satellites. Values are stored with *exponent* on the latitude grid
+    *lats* and longitude grid *lons*. Return the number of maps.
+    """
+    times = NP.arange(0, 86400 + interval, interval)
+    dts = [start_dt + timedelta(seconds=x) for x in times]
+    lat_grid, lon_grid = NP.meshgrid(lats, lons, indexing='ij')
+    vtec = NP.array([synthetic_vtec(t_i, lat_grid, lon_grid) for t_i in times])
+    rs = NP.random.RandomState(0)
+    satellite_biases = {'GPS': dict([(prn, (rs.randn() * 5, 0.01))
+                                     for prn in range(1, n_sats + 1)]),
+                        'GLONASS': {}}
+    cube = IonexCube(lons,
+                     lats,
+                     [450.],
+                     dts,
+                     # values representable with *exponent*
+                     NP.round(vtec / 10**exponent) * 10.**exponent,
+                     NP.round(0.1 * vtec / 10**exponent) * 10.**exponent,
+                     None,
+                     satellite_biases,
+                     {},
+                     {'exponent': exponent})
+    write_cube(ionex_fname,
+               cube,
+               exponent=exponent,
+               program='pyrsss.gnss.benchmark')
+    return len(dts)
+
+
+def build_fixture(work_path,
+                  interval,
+                  duration=None,
+                  n_sats=N_SATS,
+                  seed=0):
+    """
+    Generate the synthetic RinDump and IONEX fixtures for observation
+    *interval* [s] and *duration* [s] (see :data:`DURATION_MAP` for
+    the default) in *work_path*. Return the :class:`Fixture`.
+    """
+    if duration is None:
+        duration = DURATION_MAP[interval]
+    rindump_fname = os.path.join(work_path,
+                                 'synt{}s.dump'.format(interval))
+    ionex_fname = os.path.join(work_path,
+                               'synt{:%j}0.{:%y}i'.format(START_DT, START_DT))
+    logger.info('writing synthetic RinDump fixture to {}'.format(rindump_fname))
+    N_obs = write_rindump(rindump_fname,
+                          synthetic_obs(interval,
+                                        duration,
+                                        n_sats=n_sats,
+                                        seed=seed))
+    if not os.path.isfile(ionex_fname):
+        logger.info('writing synthetic IONEX fixture to {}'.format(ionex_fname))
+        write_ionex(ionex_fname, n_sats=n_sats)
+    return Fixture(interval,
+                   rindump_fname,
+                   ionex_fname,
+                   work_path,
+                   N_obs)
+
+
+def bench_read_rindump(fixture):
+    """
+    Time :func:`read_rindump`.
+    """
+    timer = Timer()
+    read_rindump(fixture.rindump_fname)
+    return timer.stop()
+
+
+def bench_obs_map_dump(fixture):
+    """
+    Time :meth:`ObsMap.dump`.
+    """
+    obs_map = read_rindump(fixture.rindump_fname)
+    h5_fname = os.path.join(fixture.work_path, 'obs_map.h5')
+    timer = Timer()
+    obs_map.dump(h5_fname)
+    return timer.stop()
+
+
+def bench_obs_map_undump(fixture):
+    """
+    Time :meth:`ObsMap.undump`.
+    """
+    h5_fname = os.path.join(fixture.work_path, 'obs_map.h5')
+    read_rindump(fixture.rindump_fname).dump(h5_fname)
+    timer = Timer()
+    ObsMap(h5_fname)
+    return timer.stop()
+
+
+def bench_level_phase_to_code(fixture):
+    """
+    Time :func:`level_phase_to_code`.
+    """
+    obs_map = read_rindump(fixture.rindump_fname)
+    timer = Timer()
+    level_phase_to_code(obs_map)
+    return timer.stop()
+
+
+def bench_arc_map_dump(fixture):
+    """
+    Time :meth:`ArcMap.dump`.
+    """
+    arc_map = level_phase_to_code(read_rindump(fixture.rindump_fname))
+    h5_fname = os.path.join(fixture.work_path, 'arc_map.h5')
+    timer = Timer()
+    arc_map.dump(h5_fname)
+    return timer.stop()
+
+
+def bench_arc_map_undump(fixture):
+    """
+    Time :meth:`ArcMap.undump`.
+    """
+    h5_fname = os.path.join(fixture.work_path, 'arc_map.h5')
+    level_phase_to_code(read_rindump(fixture.rindump_fname)).dump(h5_fname)
+    timer = Timer()
+    ArcMap(h5_fname)
+    return timer.stop()
+
+
+def bench_spp(fixture):
+    """
+    Time :func:`spp` (the synthetic pseudoranges are computed without
+    Earth rotation).
+    """
+    obs_map = read_rindump(fixture.rindump_fname)
+    timer = Timer()
+    spp(obs_map, earth_rotation=False)
+    return timer.stop()
+
+
+def bench_ionex_parser(fixture):
+    """
+    Time the IONEX parser.
+    """
+    timer = Timer()
+    ionex_parser(fixture.ionex_fname)
+    return timer.stop()
+
+
+def bench_ionex_stec_map(fixture):
+    """
+    Time :func:`pyrsss.gnss.bias.ionex_stec_map` (requires the GPSTk
+    python extension to compute IPPs).
+    """
+    from bias import AugmentedArcMap, ionex_stec_map
+    aug_arc_map = AugmentedArcMap(level_phase_to_code(read_rindump(fixture.rindump_fname)))
+    timer = Timer()
+    ionex_stec_map(fixture.ionex_fname, aug_arc_map)
+    return timer.stop()
+
+
+def bench_end_to_end(fixture):
+    """
+    Time the sequence of stages from RinDump record to modeled STEC
+    (the STEC step is skipped if the GPSTk python extension is not
+    available).
+    """
+    try:
+        from bias import AugmentedArcMap, ionex_stec_map
+    except ImportError:
+        AugmentedArcMap = None
+    h5_fname = os.path.join(fixture.work_path, 'end_to_end.h5')
+    timer = Timer()
+    obs_map = read_rindump(fixture.rindump_fname)
+    obs_map.dump(h5_fname)
+    arc_map = level_phase_to_code(ObsMap(h5_fname))
+    arc_map.dump(h5_fname)
+    if AugmentedArcMap is not None:
+        ionex_stec_map(fixture.ionex_fname,
+                       AugmentedArcMap(ArcMap(h5_fname)))
+    return timer.stop()
+
+
+STAGES = OrderedDict([('read_rindump', bench_read_rindump),
+                      ('obs_map_dump', bench_obs_map_dump),
+                      ('obs_map_undump', bench_obs_map_undump),
+                      ('level_phase_to_code', bench_level_phase_to_code),
+                      ('arc_map_dump', bench_arc_map_dump),
+                      ('arc_map_undump', bench_arc_map_undump),
+                      ('spp', bench_spp),
+                      ('ionex_parser', bench_ionex_parser),
+                      ('ionex_stec_map', bench_ionex_stec_map),
+                      ('end_to_end', bench_end_to_end)])
+"""
+Mapping between benchmark stage names and functions. Each function
+accepts a :class:`Fixture`, performs any (untimed) setup, and returns
+the time [s] spent in the stage under test.
+"""
+
+
+def peak_rss():
+    """
+    Return the peak resident set size [MB] of the calling process.
+    """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # reported in [B]
+        return maxrss / 2**20
+    # reported in [kB]
+    return maxrss / 2**10
+
+
+def stage_worker(queue, stage, fixture):
+    """
+    Run the benchmark *stage* on *fixture* and put the tuple elapsed
+    time [s], peak resident set size [MB], and error message (`None`
+    on success) to *queue*. The IONEX cache is disabled so that IONEX
+    stages measure parsing (and not cache hits from a reused work
+    path).
+    """
+    os.environ[CACHE_ENV] = 'off'
+    try:
+        elapsed = STAGES[stage](fixture)
+        queue.put((elapsed, peak_rss(), None))
+    except Exception as e:
+        queue.put((None, None, '{}: {}'.format(type(e).__name__, e)))
+
+
+def run_worker(stage, fixture, timeout=STAGE_TIMEOUT):
+    """
+    Run the benchmark *stage* on *fixture* once in a separate process
+    (so that peak memory use is measured in isolation). Return the
+    tuple elapsed time [s] and peak resident set size [MB] of the
+    worker process (which includes untimed setup). Return `None` if
+    the stage could not be run, the worker process died, or no result
+    arrived within *timeout* [s].
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=stage_worker,
+                                      args=(queue, stage, fixture))
+    process.start()
+    start = time.time()
+    while True:
+        try:
+            elapsed, rss, error = queue.get(timeout=1)
+            break
+        except Empty:
+            if not process.is_alive():
+                error = 'worker process exited with code {}'.format(process.exitcode)
+                break
+            elif time.time() - start > timeout:
+                error = 'no result after {} [s]'.format(timeout)
+                process.terminate()
+                break
+    process.join()
+    if error is not None:
+        logger.warning('stage {} failed ({}) --- skipping'.format(stage, error))
+        return None
+    return elapsed, rss
+
+
+def run_stage(stage, fixture, repeats=REPEATS, timeout=STAGE_TIMEOUT):
+    """
+    Run the benchmark *stage* on *fixture* *repeats* times (see
+    :func:`run_worker`). Return a mapping with the minimum elapsed
+    time [s] (the least disturbed run), throughput [observations /
+    s], maximum peak resident set size [MB], and maximum elapsed time
+    [s] (the spread of the runs) over the runs. Return `None` if any
+    run failed.
+    """
+    runs = []
+    for i in range(repeats):
+        run = run_worker(stage, fixture, timeout=timeout)
+        if run is None:
+            return None
+        runs.append(run)
+    elapsed = min(x[0] for x in runs)
+    rss = max(x[1] for x in runs)
+    return OrderedDict([('elapsed', elapsed),
+                        ('obs_per_s', fixture.N_obs / elapsed),
+                        ('peak_rss_mb', rss),
+                        ('N_obs', fixture.N_obs),
+                        ('elapsed_max', max(x[0] for x in runs))])
+
+
+def benchmark(intervals=DURATION_MAP.keys(),
+              stages=STAGES.keys(),
+              n_sats=N_SATS,
+              repeats=REPEATS,
+              work_path=None):
+    """
+    Run each of *stages* (*repeats* times, see :func:`run_stage`) on
+    synthetic records (with *n_sats* satellites) for each observation
+    interval in *intervals* [s]. Use
+    *work_path* to store fixtures and intermediate files (an
+    automatically cleaned up area if not specified). Return the
+    mapping between `{stage}@{interval}s` and the stage results (see
+    :func:`run_stage`).
+    """
+    results = OrderedDict()
+    with SmartTempDir(work_path) as work_path:
+        touch_path(work_path)
+        for interval in intervals:
+            fixture = build_fixture(work_path,
+                                    interval,
+                                    n_sats=n_sats)
+            for stage in stages:
+                logger.info('running {} on {} observations at {} [s] '
+                            'interval'.format(stage, fixture.N_obs, interval))
+                result = run_stage(stage, fixture, repeats=repeats)
+                if result is None:
+                    continue
+                key = '{}@{}s'.format(stage, interval)
+                results[key] = result
+                logger.info('{}: {elapsed:.3f} [s]  {obs_per_s:.0f} [obs/s]  '
+                            '{peak_rss_mb:.1f} [MB]'.format(key, **result))
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE, min_delta=MIN_DELTA):
+    """
+    Compare benchmark *results* to *baseline* (both as returned by
+    :func:`benchmark`). Return the list of `(key, elapsed,
+    baseline_elapsed)` for those stages that are more than
+    *tolerance* (fractional) and more than *min_delta* [s] slower
+    than the baseline and slower than every baseline run (i.e.,
+    outside of the spread of the baseline, if recorded).
+    """
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            logger.warning('{} not found in baseline'.format(key))
+            continue
+        baseline_elapsed = baseline[key]['elapsed']
+        threshold = max((1 + tolerance) * baseline_elapsed,
+                        baseline_elapsed + min_delta,
+                        baseline[key].get('elapsed_max', baseline_elapsed))
+        if result['elapsed'] > threshold:
+            regressions.append((key, result['elapsed'], baseline_elapsed))
+    return regressions
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    parser = ArgumentParser('Benchmark the GNSS TEC processing pipeline on synthetic data.',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--intervals',
+                        '-i',
+                        type=int,
+                        nargs='+',
+                        choices=DURATION_MAP.keys(),
+                        default=DURATION_MAP.keys(),
+                        help='observation intervals [s] to benchmark')
+    parser.add_argument('--stages',
+                        '-s',
+                        type=str,
+                        nargs='+',
+                        choices=STAGES.keys(),
+                        default=STAGES.keys(),
+                        help='stages to benchmark')
+    parser.add_argument('--sats',
+                        type=int,
+                        default=N_SATS,
+                        help='number of synthetic satellites')
+    parser.add_argument('--repeats',
+                        '-r',
+                        type=int,
+                        default=REPEATS,
+                        help='number of runs of each stage (the minimum elapsed time is reported)')
+    parser.add_argument('--work-path',
+                        '-w',
+                        type=str,
+                        default=None,
+                        help='path to store fixtures and intermediate files (use an '
+                             'automatically cleaned up area if not specified)')
+    parser.add_argument('--output',
+                        '-o',
+                        type=str,
+                        default=None,
+                        help='store results to the given JSON file (e.g., to serve as a baseline)')
+    parser.add_argument('--baseline',
+                        '-b',
+                        type=str,
+                        default=None,
+                        help='compare results to the given JSON baseline (e.g., the stored '
+                             'baseline {}) and exit with nonzero status if any stage '
+                             'regresses'.format(BASELINE_JSON))
+    parser.add_argument('--tolerance',
+                        '-t',
+                        type=float,
+                        default=TOLERANCE,
+                        help='fractional slow down relative to the baseline reported as a regression')
+    parser.add_argument('--min-delta',
+                        type=float,
+                        default=MIN_DELTA,
+                        help='slow down [s] relative to the baseline below which a stage is not reported as a regression')
+    args = parser.parse_args(argv[1:])
+
+    results = benchmark(intervals=args.intervals,
+                        stages=args.stages,
+                        n_sats=args.sats,
+                        repeats=args.repeats,
+                        work_path=args.work_path)
+
+    if args.output:
+        with open(args.output, 'w') as fid:
+            json.dump(results, fid, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as fid:
+            baseline = json.load(fid)
+        regressions = compare(results,
+                              baseline,
+                              tolerance=args.tolerance,
+                              min_delta=args.min_delta)
+        for key, elapsed, baseline_elapsed in regressions:
+            logger.error('{} regressed: {:.3f} [s] > {:.3f} [s] '
+                         '(baseline)'.format(key, elapsed, baseline_elapsed))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
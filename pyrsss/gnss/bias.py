@@ -7,7 +7,6 @@ from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 from datetime import datetime, timedelta
 
 import numpy as NP
-from scipy.interpolate import RectBivariateSpline
 from tables import open_file, IsDescription, Time64Col, Float64Col
 
 from constants import SHELL_HEIGHT, TECU_TO_NS
@@ -15,10 +14,16 @@ from level import LeveledArc, ArcMap
 from util import shell_mapping
 from ipp import ipp_from_azel
 from teqc import rinex_info
+from h5layout import (DEFAULT_LAYOUT,
+                      INDEXED_LAYOUT,
+                      get_layout,
+                      set_layout,
+                      write_arcs,
+                      read_arcs)
 from sideshow import update_sideshow_file
 from ..gpstk import PyPosition
-from ..ionex.read_ionex import interpolate2D_temporal
-from ..util.search import find_le
+from ..ionex.read_ionex import read_ionex
+from ..ionex.query import query
 from ..util.path import SmartTempDir
 from ..util.date import UNIX_EPOCH
 from ..util.angle import convert_lon
@@ -124,9 +129,10 @@ class CalibratedArcMap(ArcMap):
         ipp_lat = Float64Col()
         ipp_lon = Float64Col()
 
-    def dump(self, h5_fname):
+    def dump(self, h5_fname, layout=DEFAULT_LAYOUT):
         """ ??? """
         h5file = open_file(h5_fname, mode='w', title='pyrsss.gps.bias output')
+        set_layout(h5file, layout)
         calibrated_phase_arcs_group = h5file.create_group('/',
                                                         'calibrated_phase_arcs',
                                                         'Calibrated phase connected arcs')
@@ -140,6 +146,14 @@ class CalibratedArcMap(ArcMap):
             setattr(calibrated_phase_arcs_group._v_attrs, 'G{:02d}_rms'.format(prn), rms / TECU_TO_NS)
         for sat in sorted(self):
             assert sat[0] == 'G'
+            if layout == INDEXED_LAYOUT:
+                write_arcs(h5file,
+                           calibrated_phase_arcs_group,
+                           sat,
+                           CalibratedArcMap.Table,
+                           self[sat],
+                           title='Calibrated phase connected arcs for {}'.format(sat))
+                continue
             sat_group = h5file.create_group(calibrated_phase_arcs_group,
                                             sat,
                                             'Calibrated phase connected arcs for {}'.format(sat))
@@ -175,6 +189,11 @@ class CalibratedArcMap(ArcMap):
         calibrated_phase_arcs_group = h5file.root.calibrated_phase_arcs
         for attr in calibrated_phase_arcs_group._v_attrs._f_list():
             setattr(calibrated_arc_map, attr, getattr(calibrated_phase_arcs_group._v_attrs, attr))
+        if get_layout(h5file) == INDEXED_LAYOUT:
+            for table in calibrated_phase_arcs_group:
+                calibrated_arc_map[table.name].extend(read_arcs(table, CalibratedArc))
+            h5file.close()
+            return calibrated_arc_map
         for sat_group in calibrated_phase_arcs_group:
             sat = sat_group._v_name
             for arc_table in sat_group:
@@ -218,50 +237,45 @@ class CalibratedArcMap(ArcMap):
         return calibrated_arc_map
 
 
-def get_dt_list(arc_map):
-    """
-    """
-    dt_set = set()
-    for arc_list in arc_map.itervalues():
-        for arc in arc_list:
-            dt_set.update(arc.dt)
-    return sorted(dt_set)
-
-
 def ionex_stec_map(ionex_fname,
                    augmented_arc_map):
     """
+    Return the 2-tuple of the mapping of satellite to list of the
+    IONEX VTEC (bicubic interpolation in space, linear in time, see
+    :func:`pyrsss.ionex.query.query`) at the IPPs of each arc of
+    *augmented_arc_map* mapped to STEC and the satellite biases of
+    *ionex_fname*. All IPPs are interpolated at once.
     """
     logger.info('computing interpolated and mapped STEC from {}'.format(ionex_fname))
-    # compute temporally interpolated IONEX VTEC maps
-    dt_list = get_dt_list(augmented_arc_map)
-    (grid_lon, grid_lat, vtec,
-     _, sat_biases, _) = interpolate2D_temporal(ionex_fname,
-                                                dt_list)
-    # compute spline interpolators
-    bbox = [-180, 180, -90, 90]
-    # check that latitude grid is in decreasing order
-    assert grid_lat[1] < grid_lat[0]
-    interp_map = {dt: RectBivariateSpline(grid_lon,
-                                          grid_lat[::-1],
-                                          vtec[:, ::-1, i],
-                                          bbox=bbox) for i, dt in enumerate(dt_list)}
-    # compute interpolated stec
-    stec_map = defaultdict(list)
+    cube = read_ionex(ionex_fname)
+    keys = []
+    dt = []
+    ipp_lat = []
+    ipp_lon = []
+    el_map = []
     for key, arc_list in augmented_arc_map.iteritems():
         for arc in arc_list:
-            ionex_stec = []
-            for (dt_i, ipp_lat_i, ipp_lon_i, el_map_i) in zip(arc.dt,
-                                                              arc.ipp_lat,
-                                                              arc.ipp_lon,
-                                                              arc.el_map):
-                i, _ = find_le(dt_list, dt_i)
-                interpolator = interp_map[dt_list[i]]
-                vtec_i = float(interpolator.ev(ipp_lon_i,
-                                               ipp_lat_i))
-                ionex_stec.append(vtec_i * el_map_i)
-            stec_map[key].append(ionex_stec)
-    return stec_map, sat_biases
+            keys.append((key, len(arc.dt)))
+            dt.extend(arc.dt)
+            ipp_lat.extend(arc.ipp_lat)
+            ipp_lon.extend(arc.ipp_lon)
+            el_map.extend(arc.el_map)
+    # the IONEX latitude grid does not reach the poles --- use the
+    # edge of the grid for IPPs beyond it
+    ipp_lat = NP.clip(ipp_lat, min(cube.lats), max(cube.lats))
+    vtec = query(cube,
+                 dt,
+                 ipp_lat,
+                 ipp_lon,
+                 method='bicubic').tec
+    ionex_stec = vtec * NP.array(el_map)
+    # split into arcs
+    stec_map = defaultdict(list)
+    i = 0
+    for key, n in keys:
+        stec_map[key].append(ionex_stec[i:i + n].tolist())
+        i += n
+    return stec_map, cube.satellite_biases
 
 
 def estimate_receiver_bias(arc_map,
@@ -330,14 +344,14 @@ def fetch_sideshow_ionex(path,
     raise RuntimeError('could not download IONEX file from sideshow for {:%Y-%m-%d}'.format(date))
 
 
-def bias_process(output_h5_fname,
-                 leveled_arc_h5_fname,
-                 ionex_fname):
+def calibrate(arc_map,
+              ionex_fname):
     """
-    ???
+    Remove the satellite and receiver biases from the leveled phase
+    arcs in *arc_map* and return the resultant
+    :class:`CalibratedArcMap`. Satellite biases and the VTEC used to
+    estimate the receiver bias are taken from *ionex_fname*.
     """
-    # load arc map
-    arc_map = ArcMap(leveled_arc_h5_fname)
     # compute IPPs
     logger.info('computing IPPs')
     aug_arc_map = AugmentedArcMap(arc_map)
@@ -351,12 +365,24 @@ def bias_process(output_h5_fname,
     stn_bias, stn_bias_sigma = estimate_receiver_bias(aug_arc_map,
                                                       stec_map,
                                                       sat_biases)
+    return CalibratedArcMap.from_aug_arc_map(aug_arc_map,
+                                             sat_biases,
+                                             stn_bias,
+                                             stn_bias_sigma)
+
+
+def bias_process(output_h5_fname,
+                 leveled_arc_h5_fname,
+                 ionex_fname,
+                 layout=DEFAULT_LAYOUT):
+    """
+    ???
+    """
+    # load arc map
+    arc_map = ArcMap(leveled_arc_h5_fname)
+    calibrated_arc_map = calibrate(arc_map, ionex_fname)
     # store output
-    calibrated_arc_map = CalibratedArcMap.from_aug_arc_map(aug_arc_map,
-                                                       sat_biases,
-                                                       stn_bias,
-                                                       stn_bias_sigma)
-    calibrated_arc_map.dump(output_h5_fname)
+    calibrated_arc_map.dump(output_h5_fname, layout=layout)
     return output_h5_fname
 
 
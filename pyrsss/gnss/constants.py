@@ -73,6 +73,13 @@ F_GLO_2_DELTA = 0.4375e6
 """GLONASS carrier 1 frequency [Hz]."""
 
 
+F_GAL_1 = 154 * F_0
+"""Galileo E1 carrier frequency [Hz]."""
+
+F_GAL_5A = 115 * F_0
+"""Galileo E5a carrier frequency [Hz]."""
+
+
 def glonass_lambda(slot, dt, glonass_status=GLONASS_Status()):
     """
     """
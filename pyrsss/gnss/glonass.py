@@ -1,10 +1,12 @@
 import os
-from collections import namedtuple, OrderedDict
+from collections import namedtuple, OrderedDict, defaultdict
 from datetime import datetime
 
+import numpy as NP
 from intervals import DateTimeInterval
 
 from sideshow import update_sideshow_file
+from h5layout import times_to_seconds
 
 
 GLO_STATUS_FNAME = os.path.join(os.path.dirname(__file__),
@@ -48,6 +50,7 @@ class GLONASS_Status(dict):
             else:
                 return datetime.strptime(date + ' ' + time,
                                          '%Y-%m-%d %H:%M')
+        records = defaultdict(list)
         with open(glo_status_fname) as fid:
             for line in fid:
                 if line.startswith('#'):
@@ -60,6 +63,15 @@ class GLONASS_Status(dict):
                 interval = DateTimeInterval.closed_open(start_dt, end_dt)
                 info = StatusInfo(launch_dt, slot, freq, plane, GLONASS, cosmos)
                 self.setdefault(slot, OrderedDict())[interval] = info
+                records[slot].append((-NP.inf if start_dt is None else times_to_seconds([start_dt])[0],
+                                      NP.inf if end_dt is None else times_to_seconds([end_dt])[0],
+                                      freq))
+        # per slot (start, end, freq) arrays sorted by start time
+        self.tables = {}
+        for slot, slot_records in records.iteritems():
+            start, end, freq = map(NP.array, zip(*slot_records))
+            I = NP.argsort(start, kind='mergesort')
+            self.tables[slot] = (start[I], end[I], freq[I])
 
     def __call__(self, slot, dt):
         """
@@ -71,6 +83,31 @@ class GLONASS_Status(dict):
                 return info
         raise KeyError('no record for {} at {:%Y-%m-%d %H:%M} found'.format(slot, dt))
 
+    def channels(self, slots, dts):
+        """
+        Return the array of frequency channel numbers of the GLONASS
+        satellites with IDs *slots* at the :class:`datetime`s *dts*
+        (sequences of equal length). Unlike :meth:`__call__`, the
+        lookup is a binary search over the records of each slot
+        performed for all times at once.
+        """
+        slots = NP.asarray(slots, dtype=int)
+        t = times_to_seconds(dts)
+        k = NP.empty(len(slots), dtype=int)
+        for slot in NP.unique(slots):
+            I = NP.flatnonzero(slots == slot)
+            try:
+                start, end, freq = self.tables[slot]
+            except KeyError:
+                raise KeyError('no record for {} found'.format(slot))
+            J = NP.searchsorted(start, t[I], side='right') - 1
+            missing = (J < 0) | (t[I] >= end[NP.maximum(J, 0)])
+            if NP.any(missing):
+                raise KeyError('no record for {} at {:%Y-%m-%d %H:%M} '
+                               'found'.format(slot, dts[I[NP.argmax(missing)]]))
+            k[I] = freq[J]
+        return k
+
 
 if __name__ == '__main__':
     glonass_status = GLONASS_Status()
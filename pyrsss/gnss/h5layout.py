@@ -0,0 +1,320 @@
+from __future__ import division
+
+import sys
+import logging
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from collections import OrderedDict
+from datetime import timedelta
+
+import numpy as NP
+from tables import open_file, Filters, Int32Col, which_lib_version
+
+from ..util.date import UNIX_EPOCH
+
+logger = logging.getLogger('pyrsss.gps.h5layout')
+
+
+"""
+HDF5 layouts of the GNSS stage products (:class:`ObsMap`,
+:class:`ArcMap`, and :class:`CalibratedArcMap`).
+
+Layout 1 (legacy) stores uncompressed tables: one per satellite for
+:class:`ObsMap` and one per satellite arc for the arc products.
+
+Layout 2 stores one compressed table per satellite with an arc column
+(arc products only) and a completely sorted index on time (*dt*, in
+[s] since the UNIX epoch) so that time window queries (see
+:func:`query`) read only the matching rows. Per arc scalars (L and
+L_scatter) are stored as array attributes of the satellite table,
+indexed by arc. The layout version is stored in the root attribute
+*pyrsss_layout* (absent for layout 1).
+"""
+
+
+LEGACY_LAYOUT = 1
+"""
+Uncompressed, unindexed layout (one table per satellite arc).
+"""
+
+INDEXED_LAYOUT = 2
+"""
+Compressed layout with one time indexed table per satellite.
+"""
+
+LAYOUTS = [LEGACY_LAYOUT, INDEXED_LAYOUT]
+"""
+Supported layout versions.
+"""
+
+DEFAULT_LAYOUT = LEGACY_LAYOUT
+"""
+Layout used when not specified.
+"""
+
+FILTERS = Filters(complevel=5,
+                  complib='blosc' if which_lib_version('blosc') else 'zlib',
+                  shuffle=True)
+"""
+Compression used for layout 2 tables.
+"""
+
+ARC_SCALARS = ['L', 'L_scatter']
+"""
+Per arc scalar fields stored as table attributes.
+"""
+
+FREQUENCY_ATTRS = ['f1', 'f2']
+"""
+Per satellite carrier frequencies (in [Hz]) stored as attributes of
+the satellite table (or, for legacy arc products, the satellite
+group).
+"""
+
+
+def times_to_seconds(dts):
+    """
+    Convert the sequence of :class:`datetime` *dts* to an array of
+    seconds since the UNIX epoch.
+    """
+    return NP.fromiter(((dt - UNIX_EPOCH).total_seconds() for dt in dts),
+                       dtype=NP.float64,
+                       count=len(dts))
+
+
+def seconds_to_times(seconds):
+    """
+    Convert the array of seconds since the UNIX epoch *seconds* to a
+    list of :class:`datetime`.
+    """
+    return [UNIX_EPOCH + timedelta(seconds=x) for x in seconds.tolist()]
+
+
+def get_layout(h5file):
+    """
+    Return the layout version of the open :class:`File` *h5file*.
+    """
+    return getattr(h5file.root._v_attrs, 'pyrsss_layout', LEGACY_LAYOUT)
+
+
+def set_layout(h5file, layout):
+    """
+    Record the *layout* version in the open :class:`File` *h5file*.
+    """
+    if layout not in LAYOUTS:
+        raise ValueError('unknown layout {} (choices are {})'.format(layout,
+                                                                    LAYOUTS))
+    if layout != LEGACY_LAYOUT:
+        h5file.root._v_attrs.pyrsss_layout = layout
+
+
+def arc_description(columns):
+    """
+    Return the column description mapping *columns* (column name to
+    :class:`Col`) augmented with the integer arc identifier column.
+    """
+    columns = dict(columns)
+    columns['arc'] = Int32Col()
+    return columns
+
+
+def write_table(h5file, group, name, description, columns, title=''):
+    """
+    Create the compressed table *name* in *group* of *h5file* with
+    *description* and rows given by the mapping *columns* (column name
+    to array, including *dt*), create the completely sorted index on
+    *dt*, and return the table.
+    """
+    N = len(columns['dt'])
+    table = h5file.create_table(group,
+                                name,
+                                description,
+                                title,
+                                filters=FILTERS,
+                                expectedrows=max(N, 1))
+    rows = NP.empty(N, dtype=table.dtype)
+    for key in table.colnames:
+        rows[key] = columns[key]
+    table.append(rows)
+    table.flush()
+    table.cols.dt.create_csindex()
+    return table
+
+
+def write_arcs(h5file, group, sat, description, arcs, title=''):
+    """
+    Store the list of arcs *arcs* (namedtuples with the columns of
+    *description* and the fields :data:`ARC_SCALARS`) for satellite
+    *sat* to a single layout 2 table in *group*. Return the table.
+    """
+    names = [x for x in description.columns if x != 'dt']
+    columns = {'dt': NP.concatenate([times_to_seconds(x.dt) for x in arcs] + [NP.empty(0)]),
+               'arc': NP.concatenate([NP.repeat(i, len(x.dt)) for i, x in enumerate(arcs)] +
+                                     [NP.empty(0, dtype=NP.int64)])}
+    for name in names:
+        columns[name] = NP.concatenate([NP.asarray(getattr(x, name), dtype=NP.float64) for x in arcs] +
+                                       [NP.empty(0)])
+    table = write_table(h5file,
+                        group,
+                        sat,
+                        arc_description(description.columns),
+                        columns,
+                        title=title)
+    for name in ARC_SCALARS:
+        setattr(table.attrs, name, NP.array([getattr(x, name) for x in arcs],
+                                            dtype=NP.float64))
+    return table
+
+
+def read_arcs(table, arc_type):
+    """
+    Return the list of *arc_type* namedtuples stored in the layout 2
+    satellite *table* (see :func:`write_arcs`).
+    """
+    rows = table.read()
+    rows = rows[NP.lexsort((rows['dt'], rows['arc']))]
+    N_arcs = len(getattr(table.attrs, ARC_SCALARS[0]))
+    bounds = NP.searchsorted(rows['arc'], NP.arange(N_arcs + 1))
+    arcs = []
+    for i in range(N_arcs):
+        arc_rows = rows[bounds[i]:bounds[i + 1]]
+        fields = []
+        for name in arc_type._fields:
+            if name == 'dt':
+                fields.append(seconds_to_times(arc_rows['dt']))
+            elif name in ARC_SCALARS:
+                fields.append(getattr(table.attrs, name)[i])
+            else:
+                fields.append(arc_rows[name].tolist())
+        arcs.append(arc_type._make(fields))
+    return arcs
+
+
+def arc_number(arc_table):
+    """
+    Return the arc identifier of the legacy layout *arc_table* (named
+    arc<N>).
+    """
+    return int(arc_table._v_name[3:])
+
+
+def concatenate_arc_tables(sat_group, where=None, condvars=None):
+    """
+    Return the rows of the legacy per arc tables in *sat_group*
+    concatenated, with the arc identifier in the additional field
+    *arc*. If given, return only the rows matching the condition
+    *where* (with variables *condvars*). Return None if *sat_group*
+    contains no arcs.
+    """
+    arc_tables = sorted(sat_group, key=arc_number)
+    if len(arc_tables) == 0:
+        return None
+    dtype = NP.dtype(arc_tables[0].dtype.descr + [('arc', NP.int32)])
+    parts = []
+    for arc_table in arc_tables:
+        rows = arc_table.read_where(where, condvars=condvars) if where else arc_table.read()
+        part = NP.empty(len(rows), dtype=dtype)
+        for name in rows.dtype.names:
+            part[name] = rows[name]
+        part['arc'] = arc_number(arc_table)
+        parts.append(part)
+    return NP.concatenate(parts)
+
+
+def query(h5_fname, start, end, sats=None):
+    """
+    Return the rows of the stage product *h5_fname* (either layout)
+    with times in [*start*, *end*) (:class:`datetime`) as an
+    :class:`OrderedDict` mapping satellite to record array, sorted by
+    time. Limit the query to the satellites *sats*, if given. Layout
+    2 files are queried through the time index.
+    """
+    condvars = {'start': (start - UNIX_EPOCH).total_seconds(),
+                'end': (end - UNIX_EPOCH).total_seconds()}
+    where = '(dt >= start) & (dt < end)'
+    output = OrderedDict()
+    with open_file(h5_fname, mode='r') as h5file:
+        group = h5file.root._f_list_nodes()[0]
+        for node in group:
+            sat = node._v_name
+            if sats is not None and sat not in sats:
+                continue
+            if hasattr(node, '_v_children'):
+                # legacy arc product: one table per arc
+                rows = concatenate_arc_tables(node, where=where, condvars=condvars)
+                if rows is None:
+                    continue
+            else:
+                rows = node.read_where(where, condvars=condvars)
+            output[sat] = rows[NP.argsort(rows['dt'], kind='mergesort')]
+    return output
+
+
+def convert(output_h5_fname, input_h5_fname):
+    """
+    Migrate the stage product *input_h5_fname* (either layout) to
+    layout 2 and store the result to *output_h5_fname*. The satellite
+    carrier frequencies (:data:`FREQUENCY_ATTRS`) are carried
+    over. Satellites are processed one at a time, i.e., without loading the full
+    product into memory.
+    """
+    with open_file(input_h5_fname, mode='r') as in_h5file, \
+         open_file(output_h5_fname, mode='w', title=in_h5file.title) as out_h5file:
+        set_layout(out_h5file, INDEXED_LAYOUT)
+        in_group = in_h5file.root._f_list_nodes()[0]
+        out_group = out_h5file.create_group('/',
+                                            in_group._v_name,
+                                            in_group._v_title)
+        for attr in in_group._v_attrs._f_list():
+            setattr(out_group._v_attrs, attr, getattr(in_group._v_attrs, attr))
+        for node in in_group:
+            sat = node._v_name
+            if hasattr(node, '_v_children'):
+                # legacy arc product: one table per arc
+                arc_tables = sorted(node, key=arc_number)
+                if len(arc_tables) == 0:
+                    continue
+                description = arc_description(arc_tables[0].description._v_colobjects)
+                scalars = {x: NP.array([getattr(y.attrs, x) for y in arc_tables])
+                           for x in ARC_SCALARS}
+                rows = concatenate_arc_tables(node)
+            else:
+                description = dict(node.description._v_colobjects)
+                scalars = {x: getattr(node.attrs, x) for x in ARC_SCALARS
+                           if x in node.attrs._f_list()}
+                rows = node.read()
+            table = write_table(out_h5file,
+                                out_group,
+                                sat,
+                                description,
+                                rows,
+                                title=node._v_title)
+            for name, value in scalars.iteritems():
+                setattr(table.attrs, name, value)
+            for name in FREQUENCY_ATTRS:
+                if name in node._v_attrs._f_list():
+                    setattr(table.attrs, name, getattr(node._v_attrs, name))
+            logger.info('converted {} ({} rows)'.format(sat, len(rows)))
+    return output_h5_fname
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    parser = ArgumentParser('Migrate GNSS stage products (phase edit, level, and bias output) to the compressed, time indexed HDF5 layout.',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('output_h5_fname',
+                        type=str,
+                        help='output H5 file')
+    parser.add_argument('input_h5_fname',
+                        type=str,
+                        help='input H5 file')
+    args = parser.parse_args(argv[1:])
+
+    convert(args.output_h5_fname,
+            args.input_h5_fname)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,109 @@
+from __future__ import division
+
+import os
+import shutil
+import logging
+import tempfile
+from datetime import datetime, timedelta
+
+from observation import ObsMap, Observation, Frequencies
+from level import ArcMap, LeveledArc
+from constants import F_GLO_1, F_GLO_2, F_GLO_1_DELTA, F_GLO_2_DELTA
+from h5layout import LEGACY_LAYOUT, INDEXED_LAYOUT, convert
+
+
+GLONASS_SAT = 'R05'
+"""
+GLONASS satellite (frequency channel :data:`GLONASS_CHANNEL`) of the
+synthetic products.
+"""
+
+GLONASS_CHANNEL = -4
+"""
+Frequency channel number of :data:`GLONASS_SAT`.
+"""
+
+GLONASS_FREQUENCIES = Frequencies(F_GLO_1 + GLONASS_CHANNEL * F_GLO_1_DELTA,
+                                  F_GLO_2 + GLONASS_CHANNEL * F_GLO_2_DELTA)
+"""
+Carrier frequencies (in [Hz]) of :data:`GLONASS_SAT`.
+"""
+
+
+def synthetic_times(N=10, interval=30):
+    """
+    Return the list of *N* :class:`datetime` (every *interval* [s]).
+    """
+    return [datetime(2014, 1, 1) + timedelta(seconds=interval * i) for i in range(N)]
+
+
+def synthetic_obs_map():
+    """
+    Return an :class:`ObsMap` of one GPS and one GLONASS satellite
+    (with recorded carrier frequencies).
+    """
+    obs_map = ObsMap()
+    for k, sat in enumerate(['G01', GLONASS_SAT]):
+        for i, dt in enumerate(synthetic_times()):
+            obs_map[sat][dt] = Observation(*[float(k + i + j) for j in range(len(Observation._fields))])
+    obs_map.frequencies[GLONASS_SAT] = GLONASS_FREQUENCIES
+    return obs_map
+
+
+def synthetic_arc_map():
+    """
+    Return an :class:`ArcMap` of one GPS and one GLONASS satellite
+    (with recorded carrier frequencies), each with two arcs.
+    """
+    arc_map = ArcMap()
+    dt = synthetic_times()
+    for k, sat in enumerate(['G01', GLONASS_SAT]):
+        for arc in [dt[:5], dt[5:]]:
+            fields = [[float(k + i + j) for i in range(len(arc))] for j in range(7)]
+            arc_map[sat].append(LeveledArc(arc, *fields, L=1.5 + k, L_scatter=0.5))
+    arc_map.frequencies[GLONASS_SAT] = GLONASS_FREQUENCIES
+    return arc_map
+
+
+def check_convert(product, product_type):
+    """
+    Dump *product* to the legacy layout, convert to layout 2, reload
+    the result as *product_type*, and check the observations and
+    carrier frequencies are unchanged.
+    """
+    path = tempfile.mkdtemp()
+    try:
+        legacy_fname = product.dump(os.path.join(path, 'legacy.h5'), layout=LEGACY_LAYOUT)
+        indexed_fname = convert(os.path.join(path, 'indexed.h5'), legacy_fname)
+        converted = product_type(indexed_fname)
+        assert converted.frequencies == {GLONASS_SAT: GLONASS_FREQUENCIES}
+        assert converted.frequency(GLONASS_SAT) == GLONASS_FREQUENCIES
+        assert converted == product
+        # convert is idempotent on layout 2 products
+        reconverted = product_type(convert(os.path.join(path, 'reindexed.h5'), indexed_fname))
+        assert reconverted.frequencies == converted.frequencies
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def test_convert_obs_map():
+    """
+    Converting an :class:`ObsMap` keeps the GLONASS carrier
+    frequencies.
+    """
+    check_convert(synthetic_obs_map(), ObsMap)
+
+
+def test_convert_arc_map():
+    """
+    Converting a legacy :class:`ArcMap` (frequencies stored on the
+    satellite group) keeps the GLONASS carrier frequencies.
+    """
+    check_convert(synthetic_arc_map(), ArcMap)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    test_convert_obs_map()
+    test_convert_arc_map()
@@ -15,9 +15,15 @@ from more_itertools import peekable
 
 from ..stats.stats import weighted_avg_and_std
 from ..util.date import UNIX_EPOCH
-from constants import TECU_TO_M, M_TO_TECU
 from rms_model import RMSModel
-from observation import ObsMap, ObsTimeSeries
+from observation import (ObsMap, ObsTimeSeries, SYSTEMS, Frequencies,
+                         GPS_FREQUENCIES)
+from h5layout import (DEFAULT_LAYOUT,
+                      INDEXED_LAYOUT,
+                      get_layout,
+                      set_layout,
+                      write_arcs,
+                      read_arcs)
 
 logger = logging.getLogger('pyrsss.gps.level')
 
@@ -150,6 +156,7 @@ class ArcMap(OrderedDict):
     def __init__(self, h5_fname=None):
         """ ??? """
         super(ArcMap, self).__init__()
+        self.frequencies = {}
         if h5_fname:
             self.undump(h5_fname)
 
@@ -162,6 +169,13 @@ class ArcMap(OrderedDict):
     def flat(self):
         return ArcMapFlatIterator(self)
 
+    def frequency(self, sat):
+        """
+        Return the :class:`Frequencies` of satellite *sat* (the GPS
+        frequencies unless recorded otherwise in *frequencies*).
+        """
+        return self.frequencies.get(sat, GPS_FREQUENCIES)
+
     """ ??? """
     class Table(IsDescription):
         dt   = Time64Col()
@@ -173,9 +187,10 @@ class ArcMap(OrderedDict):
         saty = Float64Col()
         satz = Float64Col()
 
-    def dump(self, h5_fname):
+    def dump(self, h5_fname, layout=DEFAULT_LAYOUT):
         """ ??? """
         h5file = open_file(h5_fname, mode='w', title='pyrsss.gps.level output')
+        set_layout(h5file, layout)
         leveled_phase_arcs_group = h5file.create_group('/',
                                                        'leveled_phase_arcs',
                                                        'Leveled phase connected arcs')
@@ -184,15 +199,27 @@ class ArcMap(OrderedDict):
         if hasattr(self, 'llh'):
             leveled_phase_arcs_group._v_attrs.llh = self.llh
         for sat in sorted(self):
-            assert sat[0] == 'G'
+            assert sat[0] in SYSTEMS
+            if layout == INDEXED_LAYOUT:
+                table = write_arcs(h5file,
+                                   leveled_phase_arcs_group,
+                                   sat,
+                                   ArcMap.Table,
+                                   self[sat],
+                                   title='Leveled phase connected arcs for {}'.format(sat))
+                if sat in self.frequencies:
+                    table.attrs.f1, table.attrs.f2 = self.frequencies[sat]
+                continue
             sat_group = h5file.create_group(leveled_phase_arcs_group,
                                             sat,
                                             'Leveled phase connected arcs for {}'.format(sat))
+            if sat in self.frequencies:
+                sat_group._v_attrs.f1, sat_group._v_attrs.f2 = self.frequencies[sat]
             for i, leveled_arc in enumerate(self[sat]):
                 table = h5file.create_table(sat_group,
                                             'arc' + str(i),
                                             ArcMap.Table,
-                                            'GPS prn={} arc={} data'.format(sat, i))
+                                            '{} prn={} arc={} data'.format(SYSTEMS[sat[0]], sat, i))
                 table.attrs.L = leveled_arc.L
                 table.attrs.L_scatter = leveled_arc.L_scatter
                 row = table.row
@@ -222,6 +249,16 @@ class ArcMap(OrderedDict):
             self.llh = leveled_phase_arcs_group._v_attrs.llh
         except:
             logger.warning('{} does not contain LLH position'.format(h5_fname))
+        for node in leveled_phase_arcs_group:
+            attrs = node._v_attrs
+            if 'f1' in attrs._f_list():
+                self.frequencies[node._v_name] = Frequencies(attrs.f1,
+                                                             attrs.f2)
+        if get_layout(h5file) == INDEXED_LAYOUT:
+            for table in leveled_phase_arcs_group:
+                self[table.name].extend(read_arcs(table, LeveledArc))
+            h5file.close()
+            return self
         for sat_group in leveled_phase_arcs_group:
             sat = sat_group._v_name
             for arc_table in sat_group:
@@ -269,8 +306,14 @@ def level_phase_to_code(obs_map,
     arc_map = ArcMap()
     arc_map.xyz = obs_map.xyz
     arc_map.llh = obs_map.llh
+    arc_map.frequencies = dict(obs_map.frequencies)
     rms_model = RMSModel()
     for sat in sorted(obs_map):
+        # carrier frequency dependent conversions (per satellite for
+        # GLONASS)
+        frequencies = obs_map.frequency(sat)
+        tecu_to_m = frequencies.tecu_to_m
+        m_to_tecu = 1 / tecu_to_m
         # NO NO NO!!! Breaking arcs by gap length is wrong! Instead,
         # parse the log generated by DiscFix to determine the phase
         # breaks. The output of phase_edit should be phase connected
@@ -324,10 +367,10 @@ def level_phase_to_code(obs_map,
             dts, obs = zip(*dts_obs)
 
             P_I = NP.array([x.P_I for x in obs])
-            L_Im = NP.array([x.L_Im for x in obs])
+            L_Im = NP.array([x.L1 * frequencies.lambda_1 - x.L2 * frequencies.lambda_2 for x in obs])
             diff = P_I - L_Im
             modeled_var = (NP.array(map(rms_model,
-                                        [x.el for x in obs])) * TECU_TO_M)**2
+                                        [x.el for x in obs])) * tecu_to_m)**2
             # compute level, level scatter, and modeled scatter
             N = len(diff)
             L, L_scatter = weighted_avg_and_std(diff, 1/modeled_var)
@@ -341,25 +384,25 @@ def level_phase_to_code(obs_map,
                                                        config.scatter_factor,
                                                        sigma_scatter))
                 continue
-            if L_scatter / TECU_TO_M > config.scatter_threshold:
+            if L_scatter * m_to_tecu > config.scatter_threshold:
                 logger.info('rejecting sat={} arc={} --- L uncertainty (in '
                             '[TECU])={:.1f} > '
                             '{:.1f}'.format(sat,
                                             arc_index,
-                                            L_scatter * M_TO_TECU,
+                                            L_scatter * m_to_tecu,
                                             config.scatter_threshold))
                 continue
             # store information
             arc_map[sat].append(LeveledArc(dts,
-                                           (L_Im + L) * M_TO_TECU,
-                                           P_I * M_TO_TECU,
+                                           (L_Im + L) * m_to_tecu,
+                                           P_I * m_to_tecu,
                                            [x.az for x in obs],
                                            [x.el for x in obs],
                                            [x.satx for x in obs],
                                            [x.saty for x in obs],
                                            [x.satz for x in obs],
-                                           L * M_TO_TECU,
-                                           L_scatter * M_TO_TECU))
+                                           L * m_to_tecu,
+                                           L_scatter * m_to_tecu))
     return arc_map
 
 
@@ -380,20 +423,52 @@ def parse_override(config_overrides, config):
     return Config(*config_map.values())
 
 
+def level(obs_map,
+          config_overrides=[],
+          config=DEFAULT_CONFIG):
+    """
+    Level the phase connected arcs in *obs_map* to code and return
+    the resultant :class:`ArcMap`. The leveling parameters are
+    *config* updated with *config_overrides* (see
+    :func:`parse_override`).
+    """
+    logger.info('beginning level phase to code process')
+    config = parse_override(config_overrides, config)
+    logger.info('{}'.format(config))
+    return level_phase_to_code(obs_map, config=config)
+
+
+def level_gnss(gnss_obs_map,
+               config_overrides=[],
+               config=DEFAULT_CONFIG):
+    """
+    Level each satellite system of the :class:`GNSSObsMap`
+    *gnss_obs_map* (see :func:`level`) and return the mapping between
+    system identifier and :class:`ArcMap`.
+    """
+    arc_maps = OrderedDict()
+    for system, obs_map in gnss_obs_map.iteritems():
+        logger.info('leveling {} observations'.format(SYSTEMS[system]))
+        arc_maps[system] = level(obs_map,
+                                 config_overrides=config_overrides,
+                                 config=config)
+    return arc_maps
+
+
 def level_process(output_h5_fname,
                   input_h5_fname,
                   config_overrides=[],
-                  config=DEFAULT_CONFIG):
+                  config=DEFAULT_CONFIG,
+                  layout=DEFAULT_LAYOUT):
     """
     """
     logger.info('reading phase connected arcs from {}'.format(input_h5_fname))
     obs_map = ObsMap(input_h5_fname)
-    logger.info('beginning level phase to code process')
-    config = parse_override(config_overrides, config)
-    logger.info('{}'.format(config))
-    arc_map = level_phase_to_code(obs_map, config=config)
+    arc_map = level(obs_map,
+                    config_overrides=config_overrides,
+                    config=config)
     logger.info('storing leveled phase arcs to {}'.format(output_h5_fname))
-    arc_map.dump(output_h5_fname)
+    arc_map.dump(output_h5_fname, layout=layout)
     return output_h5_fname
 
 
@@ -0,0 +1,268 @@
+from __future__ import division
+
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from collections import namedtuple
+
+logger = logging.getLogger('pyrsss.gps.manifest')
+
+
+"""
+SQLite backed record of the units of work (one per RINEX file) of a
+processing campaign: inputs, per stage status and timing, and output
+checksums. The manifest allows an interrupted campaign to resume
+without repeating completed work and doubles as a throughput report.
+"""
+
+
+MANIFEST_FNAME = 'manifest.sqlite'
+"""
+Default manifest file name (stored in the output path).
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id    TEXT PRIMARY KEY,
+    inputs    TEXT NOT NULL,
+    status    TEXT NOT NULL,
+    output    TEXT,
+    checksum  TEXT,
+    error     TEXT,
+    started   REAL,
+    finished  REAL
+);
+CREATE TABLE IF NOT EXISTS stages (
+    job_id    TEXT NOT NULL,
+    stage     TEXT NOT NULL,
+    status    TEXT NOT NULL,
+    started   REAL,
+    elapsed   REAL,
+    error     TEXT,
+    PRIMARY KEY (job_id, stage)
+);
+"""
+"""
+Manifest database schema.
+"""
+
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class StageThroughput(namedtuple('StageThroughput',
+                                 'stage '
+                                 'N '
+                                 'failed '
+                                 'total '
+                                 'mean '
+                                 'per_hour')):
+    pass
+
+
+def checksum(fname, block_size=2**20):
+    """
+    Return the SHA1 hex digest of the contents of *fname*.
+    """
+    sha1 = hashlib.sha1()
+    with open(fname, 'rb') as fid:
+        for block in iter(lambda: fid.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def input_signature(fnames, **config):
+    """
+    Return a JSON string identifying the input files *fnames* (by
+    absolute path, size, and modification time) and the processing
+    configuration *config*. A change to either invalidates completed
+    work.
+    """
+    files = []
+    for fname in fnames:
+        stat = os.stat(fname)
+        files.append([os.path.abspath(fname), stat.st_size, stat.st_mtime])
+    return json.dumps({'files': files, 'config': config}, sort_keys=True)
+
+
+class Manifest(object):
+    def __init__(self, db_fname=':memory:'):
+        """
+        Open (or create) the job manifest stored in the SQLite
+        database *db_fname* (in memory, i.e., not persisted, by
+        default). Every update is committed immediately so that the
+        manifest reflects all work completed before a crash.
+        """
+        self.db_fname = db_fname
+        self.conn = sqlite3.connect(db_fname)
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def is_done(self, job_id, inputs):
+        """
+        Return `True` if job *job_id* completed with the same *inputs*
+        (see :func:`input_signature`) and its output still exists
+        with the recorded checksum.
+        """
+        row = self.conn.execute('SELECT inputs, status, output, checksum FROM jobs '
+                                'WHERE job_id = ?', (job_id,)).fetchone()
+        if row is None:
+            return False
+        stored_inputs, status, output, stored_checksum = row
+        if status != DONE or stored_inputs != inputs:
+            return False
+        if not os.path.isfile(output):
+            logger.warning('output {} of completed job {} is missing'.format(output, job_id))
+            return False
+        if checksum(output) != stored_checksum:
+            logger.warning('output {} of completed job {} has changed'.format(output, job_id))
+            return False
+        return True
+
+    def output(self, job_id):
+        """
+        Return the output file name recorded for *job_id*.
+        """
+        return self.conn.execute('SELECT output FROM jobs WHERE job_id = ?',
+                                 (job_id,)).fetchone()[0]
+
+    def start(self, job_id, inputs):
+        """
+        Record the start of job *job_id* with *inputs* (discarding any
+        previous record of the job).
+        """
+        with self.conn:
+            self.conn.execute('DELETE FROM stages WHERE job_id = ?', (job_id,))
+            self.conn.execute('INSERT OR REPLACE INTO jobs (job_id, inputs, status, started) '
+                              'VALUES (?, ?, ?, ?)', (job_id, inputs, RUNNING, time.time()))
+
+    def finish(self, job_id, output):
+        """
+        Record the successful completion of job *job_id* with output
+        file *output*.
+        """
+        with self.conn:
+            self.conn.execute('UPDATE jobs SET status = ?, output = ?, checksum = ?, finished = ? '
+                              'WHERE job_id = ?',
+                              (DONE, os.path.abspath(output), checksum(output), time.time(), job_id))
+
+    def fail(self, job_id, error):
+        """
+        Record the failure of job *job_id* with *error* message.
+        """
+        with self.conn:
+            self.conn.execute('UPDATE jobs SET status = ?, error = ?, finished = ? '
+                              'WHERE job_id = ?', (FAILED, str(error), time.time(), job_id))
+
+    def stage(self, job_id, stage):
+        """
+        Return a context manager that records the status and elapsed
+        time of *stage* of job *job_id*.
+        """
+        return StageRecord(self, job_id, stage)
+
+    def throughput(self):
+        """
+        Return the list of :class:`StageThroughput` (one per stage, in
+        order of first occurrence) summarizing the recorded stage
+        timings: number of completed and failed runs, total and mean
+        elapsed time (in [s]), and completed runs per hour.
+        """
+        rows = self.conn.execute('SELECT stage, '
+                                 'SUM(status = ?), SUM(status = ?), '
+                                 'SUM(CASE WHEN status = ? THEN elapsed ELSE 0 END), '
+                                 'MIN(started) '
+                                 'FROM stages GROUP BY stage ORDER BY MIN(started)',
+                                 (DONE, FAILED, DONE)).fetchall()
+        output = []
+        for stage, N, failed, total, _ in rows:
+            mean = total / N if N else float('nan')
+            output.append(StageThroughput(stage,
+                                          N,
+                                          failed,
+                                          total,
+                                          mean,
+                                          3600 / mean if N and mean > 0 else float('nan')))
+        return output
+
+    def counts(self):
+        """
+        Return a mapping from job status to the number of jobs.
+        """
+        return dict(self.conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status'))
+
+
+class StageRecord(object):
+    def __init__(self, manifest, job_id, stage):
+        """
+        Context manager recording the execution of *stage* of
+        *job_id* to *manifest* (see :meth:`Manifest.stage`).
+        """
+        self.manifest = manifest
+        self.job_id = job_id
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.time()
+        with self.manifest.conn:
+            self.manifest.conn.execute('INSERT OR REPLACE INTO stages (job_id, stage, status, started) '
+                                       'VALUES (?, ?, ?, ?)',
+                                       (self.job_id, self.stage, RUNNING, self.started))
+        return self
+
+    def __exit__(self, type, value, traceback):
+        elapsed = time.time() - self.started
+        status = DONE if type is None else FAILED
+        with self.manifest.conn:
+            self.manifest.conn.execute('UPDATE stages SET status = ?, elapsed = ?, error = ? '
+                                       'WHERE job_id = ? AND stage = ?',
+                                       (status,
+                                        elapsed,
+                                        None if value is None else str(value),
+                                        self.job_id,
+                                        self.stage))
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    parser = ArgumentParser('Report job status and per stage throughput from a processing manifest.',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('db_fname',
+                        type=str,
+                        help='manifest SQLite database (see pyrsss.gps.process --manifest)')
+    args = parser.parse_args(argv[1:])
+
+    with Manifest(args.db_fname) as manifest:
+        for status, N in sorted(manifest.counts().iteritems()):
+            print('{:10s} {:6d} jobs'.format(status, N))
+        print('')
+        print('{:15s} {:>6s} {:>6s} {:>12s} {:>10s} {:>10s}'.format('stage',
+                                                                 'N',
+                                                                 'failed',
+                                                                 'total [s]',
+                                                                 'mean [s]',
+                                                                 'per hour'))
+        for x in manifest.throughput():
+            print('{:15s} {:6d} {:6d} {:12.1f} {:10.2f} {:10.1f}'.format(*x))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
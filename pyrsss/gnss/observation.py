@@ -1,12 +1,21 @@
 import logging
 from datetime import timedelta
 from collections import OrderedDict, namedtuple, Iterator
+from itertools import chain
 
+import numpy as NP
 import scipy.constants as const
 from tables import open_file, IsDescription, Time64Col, Float64Col
 
 from ..util.date import UNIX_EPOCH
-from constants import F_1, F_2, LAMBDA_1, LAMBDA_2
+from constants import F_1, F_2, LAMBDA_1, LAMBDA_2, K
+from h5layout import (DEFAULT_LAYOUT,
+                      INDEXED_LAYOUT,
+                      get_layout,
+                      set_layout,
+                      write_table,
+                      times_to_seconds,
+                      seconds_to_times)
 
 logger = logging.getLogger('pyrsss.gps.observation')
 
@@ -42,6 +51,45 @@ MP_D = 2 * ALPHA / (ALPHA - 1) - 1
 ???
 """
 
+SYSTEMS = OrderedDict([('G', 'GPS'),
+                       ('R', 'GLONASS'),
+                       ('E', 'Galileo')])
+"""
+Mapping between satellite system identifier (the first character of
+a satellite identifier) and name.
+"""
+
+
+class Frequencies(namedtuple('Frequencies', 'f1 f2')):
+    @property
+    def lambda_1(self):
+        """
+        Return carrier 1 wavelength in [m].
+        """
+        return const.c / self.f1
+
+    @property
+    def lambda_2(self):
+        """
+        Return carrier 2 wavelength in [m].
+        """
+        return const.c / self.f2
+
+    @property
+    def tecu_to_m(self):
+        """
+        Return the conversion factor from [TECU] to differential
+        (carrier 2 - carrier 1) code delay in [m].
+        """
+        return K * 1e16 * (self.f1**2 - self.f2**2) / (self.f1 * self.f2)**2
+
+
+GPS_FREQUENCIES = Frequencies(F_1, F_2)
+"""
+GPS L1 and L2 carrier frequencies (used for satellites without a
+frequency record).
+"""
+
 
 class Observation(namedtuple('Observation',
                              'C1 P1 P2 L1 L2 az el satx saty satz')):
@@ -130,11 +178,34 @@ class ObsTimeSeries(OrderedDict):
         super(ObsTimeSeries, self).__setitem__(key,
                                                Observation(*value))
 
+    def arrays(self):
+        """
+        Return the tuple of observation times (in [s] since the UNIX
+        epoch) and the :class:`Observation` whose fields are arrays
+        (one element per time, NaN for missing observations). The
+        :class:`Observation` properties, e.g., MP1, then operate on
+        all observations at once.
+        """
+        t = times_to_seconds(self.keys())
+        if len(self) == 0:
+            return t, Observation(*NP.empty((len(Observation._fields), 0)))
+        N = len(Observation._fields)
+        try:
+            values = NP.fromiter(chain.from_iterable(self.itervalues()),
+                                 dtype=NP.float64,
+                                 count=N * len(self))
+        except TypeError:
+            # missing observations (None, e.g., as read by
+            # read_rindump) become NaN
+            values = NP.array(self.values(), dtype=NP.float64)
+        return t, Observation(*values.reshape((len(self), N)).T)
+
 
 class ObsMap(OrderedDict):
     def __init__(self, h5_fname=None):
         """ ??? """
         super(ObsMap, self).__init__()
+        self.frequencies = {}
         if h5_fname:
             self.undump(h5_fname)
 
@@ -146,6 +217,33 @@ class ObsMap(OrderedDict):
     def timeiter(self):
         return ObsMapFlatIterator(self)
 
+    def frequency(self, sat):
+        """
+        Return the :class:`Frequencies` of satellite *sat* (the GPS
+        frequencies unless recorded otherwise in *frequencies*).
+        """
+        return self.frequencies.get(sat, GPS_FREQUENCIES)
+
+    def arrays(self):
+        """
+        Return the observations of all satellites concatenated (sorted
+        by satellite, then time) as the tuple of satellite identifiers,
+        observation times (in [s] since the UNIX epoch), and the
+        :class:`Observation` whose fields are arrays (see
+        :meth:`ObsTimeSeries.arrays`).
+        """
+        sat = []
+        t = [NP.empty(0)]
+        columns = [[NP.empty(0)] for _ in Observation._fields]
+        for sat_i in sorted(self):
+            t_i, obs_i = self[sat_i].arrays()
+            sat.extend([sat_i] * len(t_i))
+            t.append(t_i)
+            for column, x in zip(columns, obs_i):
+                column.append(x)
+        obs = Observation(*[NP.concatenate(x) for x in columns])
+        return NP.array(sat, dtype=str), NP.concatenate(t), obs
+
     """ ??? """
     class Table(IsDescription):
         dt   = Time64Col()
@@ -160,17 +258,34 @@ class ObsMap(OrderedDict):
         saty = Float64Col()
         satz = Float64Col()
 
-    def dump(self, h5_fname, title=''):
+    def dump(self, h5_fname, title='', layout=DEFAULT_LAYOUT):
         """ ??? """
         h5file = open_file(h5_fname, mode='w', title=title)
+        set_layout(h5file, layout)
         group = h5file.create_group('/', 'phase_arcs', 'Phase connected arcs')
         if hasattr(self, 'xyz'):
             group._v_attrs.xyz = self.xyz
         if hasattr(self, 'llh'):
             group._v_attrs.llh = self.llh
         for sat in sorted(self):
-            assert sat[0] == 'G'
-            table = h5file.create_table(group, sat, ObsMap.Table, 'GPS prn={} data'.format(sat[1:]))
+            assert sat[0] in SYSTEMS
+            title = '{} prn={} data'.format(SYSTEMS[sat[0]], sat[1:])
+            if layout == INDEXED_LAYOUT:
+                t, obs = self[sat].arrays()
+                columns = obs._asdict()
+                columns['dt'] = t
+                table = write_table(h5file,
+                                    group,
+                                    sat,
+                                    ObsMap.Table,
+                                    columns,
+                                    title=title)
+                if sat in self.frequencies:
+                    table.attrs.f1, table.attrs.f2 = self.frequencies[sat]
+                continue
+            table = h5file.create_table(group, sat, ObsMap.Table, title)
+            if sat in self.frequencies:
+                table.attrs.f1, table.attrs.f2 = self.frequencies[sat]
             row = table.row
             for dt, obs in self[sat].iteritems():
                 row['dt'] = (dt - UNIX_EPOCH).total_seconds()
@@ -201,6 +316,18 @@ class ObsMap(OrderedDict):
             self.llh = group._v_attrs.llh
         except:
             logger.warning('{} does not contain LLH position'.format(h5_fname))
+        for table in group:
+            if 'f1' in table.attrs._f_list():
+                self.frequencies[table.name] = Frequencies(table.attrs.f1,
+                                                           table.attrs.f2)
+        if get_layout(h5file) == INDEXED_LAYOUT:
+            for table in group:
+                rows = table.read()
+                rows = rows[NP.argsort(rows['dt'], kind='mergesort')]
+                self[table.name] = ObsTimeSeries(zip(seconds_to_times(rows['dt']),
+                                                     zip(*[rows[x].tolist() for x in Observation._fields])))
+            h5file.close()
+            return self
         for table in group:
             sat = table.name
             for row in table.iterrows():
@@ -218,3 +345,20 @@ class ObsMap(OrderedDict):
                 self[sat][dt] = obs
         h5file.close()
         return self
+
+
+class GNSSObsMap(OrderedDict):
+    """
+    Mapping between satellite system identifier (see :data:`SYSTEMS`)
+    and the :class:`ObsMap` of that system's observations.
+    """
+    def dump(self, h5_fname_template, title='', layout=DEFAULT_LAYOUT):
+        """
+        Store each system's :class:`ObsMap` to the file name given by
+        *h5_fname_template* formatted with the system identifier. Return
+        the list of file names.
+        """
+        return [obs_map.dump(h5_fname_template.format(system),
+                             title=title,
+                             layout=layout)
+                for system, obs_map in self.iteritems()]
@@ -12,6 +12,7 @@ from ..util.path import SmartTempDir, replace_path
 from path import GPSTK_BUILD_PATH
 from rinex import read_rindump, Observation, dump_rinex
 from observation import ObsMap
+from h5layout import DEFAULT_LAYOUT
 from preprocess import normalize_rinex
 
 logger = logging.getLogger('pyrsss.gps.phase_edit')
@@ -320,13 +321,16 @@ def filter_obs_map(obs_map,
     return edited_obs_map
 
 
-def phase_edit_process(h5_fname,
-                       rinex_fname,
+def phase_edit_obs_map(rinex_fname,
                        nav_fname,
                        work_path=None,
                        preprocess=True,
                        discfix_args=[]):
-    """ ??? """
+    """
+    Apply the phase edit step to *rinex_fname* (with navigation
+    information from *nav_fname*) and return the edited
+    :class:`ObsMap`. Temporary files are stored in *work_path*.
+    """
     with SmartTempDir(work_path) as work_path:
         # preprocess
         if preprocess:
@@ -351,13 +355,30 @@ def phase_edit_process(h5_fname,
         # apply phase edit adjustments to ObsMap
         # CHANGE: OUTPUT IS ARCMAP!!!
         logger.info('applying phase edit adjustments')
-        edited_obs_map = filter_obs_map(obs_map,
-                                        time_reject_map,
-                                        phase_adjust_map)
-        # store ObsMap to file
-        # CHANGE: NO, OUTPUT IS ARCMAP!!!
-        logger.info('storing output to {}'.format(h5_fname))
-        edited_obs_map.dump(h5_fname, title='pyrsss.gps.phase_edit output')
+        return filter_obs_map(obs_map,
+                              time_reject_map,
+                              phase_adjust_map)
+
+
+def phase_edit_process(h5_fname,
+                       rinex_fname,
+                       nav_fname,
+                       work_path=None,
+                       preprocess=True,
+                       discfix_args=[],
+                       layout=DEFAULT_LAYOUT):
+    """ ??? """
+    edited_obs_map = phase_edit_obs_map(rinex_fname,
+                                        nav_fname,
+                                        work_path=work_path,
+                                        preprocess=preprocess,
+                                        discfix_args=discfix_args)
+    # store ObsMap to file
+    # CHANGE: NO, OUTPUT IS ARCMAP!!!
+    logger.info('storing output to {}'.format(h5_fname))
+    edited_obs_map.dump(h5_fname,
+                        title='pyrsss.gps.phase_edit output',
+                        layout=layout)
     return h5_fname
 
 
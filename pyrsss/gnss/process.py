@@ -1,80 +1,245 @@
+import os
 import logging
 import sys
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 
-from phase_edit import phase_edit_process
-from level import level_process
-from bias import fetch_sideshow_ionex, bias_process
+from phase_edit import phase_edit_process, phase_edit_obs_map
+from level import level_process, level
+from bias import fetch_sideshow_ionex, bias_process, calibrate
 from rinex import fname2date
-from ..util.path import SmartTempDir, replace_path
+from observation import ObsMap
+from qc import qc_screen
+from h5layout import LAYOUTS, DEFAULT_LAYOUT
+from manifest import Manifest, MANIFEST_FNAME, input_signature
+from ..util.path import SmartTempDir, AtomicOutput, replace_path
 
 logger = logging.getLogger('pyrsss.gps.process')
 
 
+INTERMEDIATES = ['phase_edit', 'level']
+"""
+Intermediate products that may be stored when processing in memory.
+"""
+
+
+def get_ionex_fname(ionex_map, work_path, rinex_fname, ionex_fname=None):
+    """
+    Return the IONEX file to use to calibrate *rinex_fname*:
+    *ionex_fname* if given or, otherwise, the JPL sideshow IONEX file
+    for the RINEX date (fetched to *work_path* on first use and
+    memoized in *ionex_map*).
+    """
+    if ionex_fname:
+        return ionex_fname
+    date = fname2date(rinex_fname)
+    if date not in ionex_map:
+        logger.info('fetching IONEX for {:%Y-%m-%d}'.format(date))
+        ionex_map[date] = fetch_sideshow_ionex(work_path, date)
+    return ionex_map[date]
+
+
+def process_in_memory(path,
+                      rinex_fname,
+                      nav_fname,
+                      ionex_fname,
+                      work_path=None,
+                      discfix_args=[],
+                      leveling_config_overrides=[],
+                      keep=[],
+                      qc=False,
+                      layout=DEFAULT_LAYOUT,
+                      manifest=None):
+    """
+    Process *rinex_fname* end-to-end passing the observation and arc
+    containers from stage to stage in memory and storing only the
+    calibrated arcs to *path*. Store the intermediate products listed
+    in *keep* (see :data:`INTERMEDIATES`) to *path* as well. Each
+    container is released once the next stage no longer requires it
+    so that at most two stages of one RINEX file are resident at a
+    time. If *qc*, reject the file when it fails the data quality
+    screen (see :func:`qc_screen`) before leveling. Store products
+    with the HDF5 *layout* (see :mod:`h5layout`). Record stage
+    timing to the :class:`Manifest` *manifest*, if given. Return the
+    file name of the calibrated output.
+    """
+    if manifest is None:
+        manifest = Manifest()
+    job_id = os.path.basename(rinex_fname)
+    logger.info('editing {}'.format(rinex_fname))
+    with manifest.stage(job_id, 'phase_edit'):
+        obs_map = phase_edit_obs_map(rinex_fname,
+                                     nav_fname,
+                                     work_path=work_path,
+                                     discfix_args=discfix_args)
+        if 'phase_edit' in keep:
+            with AtomicOutput(replace_path(path, rinex_fname + '.phase_edit.h5')) as h5_fname:
+                obs_map.dump(h5_fname,
+                             title='pyrsss.gps.phase_edit output',
+                             layout=layout)
+    if qc:
+        with manifest.stage(job_id, 'qc'):
+            qc_screen(obs_map, job_id[:4])
+    logger.info('leveling {}'.format(rinex_fname))
+    with manifest.stage(job_id, 'level'):
+        arc_map = level(obs_map,
+                        config_overrides=leveling_config_overrides)
+        del obs_map
+        if 'level' in keep:
+            with AtomicOutput(replace_path(path, rinex_fname + '.level.h5')) as h5_fname:
+                arc_map.dump(h5_fname, layout=layout)
+    logger.info('calibrating {}'.format(rinex_fname))
+    with manifest.stage(job_id, 'bias'):
+        calibrated_arc_map = calibrate(arc_map, ionex_fname)
+        del arc_map
+        output_h5_fname = replace_path(path, rinex_fname + '.h5')
+        with AtomicOutput(output_h5_fname) as h5_fname:
+            calibrated_arc_map.dump(h5_fname, layout=layout)
+    return output_h5_fname
+
+
 def process(path,
             rinex_fnames,
             nav_fname,
             work_path=None,
             discfix_args=[],
             leveling_config_overrides=[],
-            ionex_fname=None):
+            ionex_fname=None,
+            in_memory=False,
+            keep=[],
+            qc=False,
+            layout=DEFAULT_LAYOUT,
+            manifest_fname=None,
+            resume=False):
     """
     ???
+
+    If *in_memory*, do not pass data between stages through
+    intermediate HDF5 files (see :func:`process_in_memory`). If *qc*,
+    skip RINEX files that fail the data quality screen (see
+    :func:`qc_screen`) prior to leveling. Store intermediate and
+    final products with the HDF5 *layout* (see :mod:`h5layout`).
+
+    Record the inputs, per stage status and timing, and output
+    checksum of each RINEX file to the job manifest *manifest_fname*
+    (:data:`MANIFEST_FNAME` in *path* if not specified). If *resume*,
+    skip RINEX files that the manifest records as completed with the
+    same inputs (including the intermediates requested in *keep*
+    when *in_memory*) and an unchanged output. Outputs are written to
+    a temporary file and renamed upon completion so that an
+    interruption never leaves a partial output behind.
     """
-    with SmartTempDir(work_path) as work_path:
+    if manifest_fname is None:
+        manifest_fname = os.path.join(path, MANIFEST_FNAME)
+    with SmartTempDir(work_path) as work_path, Manifest(manifest_fname) as manifest:
+        ionex_map = {}
+        calibrated_h5 = []
+        # determine outstanding work
+        jobs = []
+        for rinex_fname in rinex_fnames:
+            job_id = os.path.basename(rinex_fname)
+            inputs = input_signature([rinex_fname, nav_fname] + ([ionex_fname] if ionex_fname else []),
+                                     discfix_args=discfix_args,
+                                     leveling_config_overrides=leveling_config_overrides,
+                                     qc=qc,
+                                     layout=layout,
+                                     keep=sorted(keep) if in_memory else [])
+            if resume and manifest.is_done(job_id, inputs):
+                logger.info('{} already processed --- skipping'.format(rinex_fname))
+                calibrated_h5.append(manifest.output(job_id))
+                continue
+            manifest.start(job_id, inputs)
+            jobs.append((job_id, rinex_fname))
+        if in_memory:
+            for job_id, rinex_fname in jobs:
+                try:
+                    ionex_fname_date = get_ionex_fname(ionex_map,
+                                                       work_path,
+                                                       rinex_fname,
+                                                       ionex_fname=ionex_fname)
+                    output_h5_fname = process_in_memory(path,
+                                                        rinex_fname,
+                                                        nav_fname,
+                                                        ionex_fname_date,
+                                                        work_path=work_path,
+                                                        discfix_args=discfix_args,
+                                                        leveling_config_overrides=leveling_config_overrides,
+                                                        keep=keep,
+                                                        qc=qc,
+                                                        layout=layout,
+                                                        manifest=manifest)
+                except Exception as e:
+                    logger.warning('processing failed for {} ({}) --- '
+                                   'skipping'.format(rinex_fname, e))
+                    manifest.fail(job_id, e)
+                    continue
+                manifest.finish(job_id, output_h5_fname)
+                calibrated_h5.append(output_h5_fname)
+            return calibrated_h5
         # phase edit
         phase_edit_h5 = []
-        for rinex_fname in rinex_fnames:
+        for job_id, rinex_fname in jobs:
             logger.info('editing {}'.format(rinex_fname))
             try:
-                phase_edit_h5.append(
-                    phase_edit_process(replace_path(work_path,
-                                                    rinex_fname + '.phase_edit.h5'),
-                                       rinex_fname,
-                                       nav_fname,
-                                       work_path=work_path,
-                                       discfix_args=discfix_args))
+                with manifest.stage(job_id, 'phase_edit'):
+                    phase_edit_h5.append(
+                        (job_id,
+                         rinex_fname,
+                         phase_edit_process(replace_path(work_path,
+                                                         rinex_fname + '.phase_edit.h5'),
+                                            rinex_fname,
+                                            nav_fname,
+                                            work_path=work_path,
+                                            discfix_args=discfix_args,
+                                            layout=layout)))
             except Exception as e:
                 logger.warning('phase edit step failed for {} ({}) --- '
                                'skipping'.format(rinex_fname, e))
+                manifest.fail(job_id, e)
                 continue
         # level phase to code
         level_h5 = []
-        for phase_edit_h5_i in phase_edit_h5:
+        for job_id, rinex_fname, phase_edit_h5_i in phase_edit_h5:
             logger.info('leveling {}'.format(phase_edit_h5_i))
             try:
-                level_h5.append(
-                    level_process(replace_path(work_path,
-                                               rinex_fname + '.level.h5'),
-                                  phase_edit_h5_i,
-                                  config_overrides=leveling_config_overrides))
+                if qc:
+                    with manifest.stage(job_id, 'qc'):
+                        qc_screen(ObsMap(phase_edit_h5_i), job_id[:4])
+                with manifest.stage(job_id, 'level'):
+                    level_h5.append(
+                        (job_id,
+                         rinex_fname,
+                         level_process(replace_path(work_path,
+                                                    rinex_fname + '.level.h5'),
+                                       phase_edit_h5_i,
+                                       config_overrides=leveling_config_overrides,
+                                       layout=layout)))
             except Exception as e:
                 logger.warning('level step failed for {} ({}) --- '
                                'skipping'.format(phase_edit_h5_i, e))
+                manifest.fail(job_id, e)
                 continue
         # receiver bias estimation and subtraction
-        calibrated_h5 = []
-        ionex_map = {}
-        for level_h5_i, rinex_fname in zip(level_h5, rinex_fnames):
-            date = fname2date(rinex_fname)
-            if ionex_fname:
-                ionex_fname_date = ionex_fname
-            else:
-                if date not in ionex_map:
-                    logger.info('fetching IONEX for {:%Y-%m-%d}'.format(date))
-                    ionex_map[date] = fetch_sideshow_ionex(work_path, date)
-                ionex_fname_date = ionex_map[date]
+        for job_id, rinex_fname, level_h5_i in level_h5:
             logger.info('calibrating {}'.format(level_h5_i))
+            output_h5_fname = replace_path(path, rinex_fname + '.h5')
             try:
-                calibrated_h5.append(
-                    bias_process(replace_path(path,
-                                              rinex_fname + '.h5'),
+                ionex_fname_date = get_ionex_fname(ionex_map,
+                                                   work_path,
+                                                   rinex_fname,
+                                                   ionex_fname=ionex_fname)
+                with manifest.stage(job_id, 'bias'), \
+                     AtomicOutput(output_h5_fname) as h5_fname:
+                    bias_process(h5_fname,
                                  level_h5_i,
-                                 ionex_fname_date))
+                                 ionex_fname_date,
+                                 layout=layout)
             except Exception as e:
                 logger.warning('bias calibration step failed for {} ({}) --- '
                                'skipping'.format(level_h5_i, e))
+                manifest.fail(job_id, e)
                 continue
+            manifest.finish(job_id, output_h5_fname)
+            calibrated_h5.append(output_h5_fname)
         return calibrated_h5
 
 
@@ -130,6 +295,32 @@ def main(argv=None):
                         type=str,
                         default=None,
                         help='use the specified IONEX record for satellite biases and VTEC (if not specified, download automatically from JPL sideshow)')
+    parser.add_argument('--in-memory',
+                        '-m',
+                        action='store_true',
+                        help='pass data between processing stages in memory rather than through intermediate HDF5 files')
+    parser.add_argument('--keep',
+                        '-k',
+                        type=str,
+                        nargs='+',
+                        choices=INTERMEDIATES,
+                        default=[],
+                        help='intermediate products to store to the output path when processing in memory')
+    parser.add_argument('--qc',
+                        action='store_true',
+                        help='skip RINEX files that fail the data quality screen (see pyrsss.gps.qc) prior to leveling')
+    parser.add_argument('--layout',
+                        type=int,
+                        choices=LAYOUTS,
+                        default=DEFAULT_LAYOUT,
+                        help='HDF5 layout version of the stored products (2 is compressed and time indexed, see pyrsss.gps.h5layout)')
+    parser.add_argument('--manifest',
+                        type=str,
+                        default=None,
+                        help='SQLite job manifest recording per file status, stage timing, and output checksums (use {} in the output path if not specified)'.format(MANIFEST_FNAME))
+    parser.add_argument('--resume',
+                        action='store_true',
+                        help='skip RINEX files the job manifest records as completed (with the same inputs, including --keep, and an unchanged output)')
     args = parser.parse_args(argv[1:])
 
     process(args.path,
@@ -138,7 +329,13 @@ def main(argv=None):
             work_path=args.work_path,
             discfix_args=args.discfix_options,
             leveling_config_overrides=args.leveling_config_overrides,
-            ionex_fname=args.ionex_fname)
+            ionex_fname=args.ionex_fname,
+            in_memory=args.in_memory,
+            keep=args.keep,
+            qc=args.qc,
+            layout=args.layout,
+            manifest_fname=args.manifest,
+            resume=args.resume)
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
@@ -0,0 +1,300 @@
+from __future__ import division
+
+import os
+import sys
+import logging
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from collections import namedtuple, OrderedDict
+from datetime import datetime
+
+import numpy as NP
+import pandas as PD
+
+from observation import ObsMap
+
+logger = logging.getLogger('pyrsss.gps.qc')
+
+
+"""
+Vectorized data quality metrics (multipath, cycle slips, completeness,
+and SNR) computed directly on observation arrays --- a replacement
+for the teqc +qc summary used to screen stations before the leveling
+and bias estimation stages.
+"""
+
+
+class Config(namedtuple('Config',
+                        'elevation_mask '
+                        'gap_length '
+                        'wl_slip '
+                        'ion_slip '
+                        'minimum_segment_points')):
+    pass
+
+
+ELEVATION_MASK = 10
+"""
+Observations below this elevation are excluded from all metrics (in
+[deg]).
+"""
+
+GAP_LENGTH = 10 * 60
+"""
+Time gaps longer than this value begin a new arc (in [s]).
+"""
+
+WL_SLIP = 4
+"""
+Melbourne-Wubbena wide lane ambiguity change between consecutive
+epochs that is flagged as a cycle slip (in [cycles]).
+"""
+
+ION_SLIP = 4
+"""
+Ionospheric (geometry free) phase rate that is flagged as a cycle
+slip (in [m / min], the teqc default).
+"""
+
+MINIMUM_SEGMENT_POINTS = 10
+"""
+Slip free segments with fewer points are excluded from the multipath
+RMS (in [#]).
+"""
+
+DEFAULT_CONFIG = Config(ELEVATION_MASK,
+                        GAP_LENGTH,
+                        WL_SLIP,
+                        ION_SLIP,
+                        MINIMUM_SEGMENT_POINTS)
+
+
+class Thresholds(namedtuple('Thresholds',
+                            'max_mp1 '
+                            'max_mp2 '
+                            'min_completeness '
+                            'min_obs_per_slip '
+                            'min_arcs')):
+    pass
+
+
+DEFAULT_THRESHOLDS = Thresholds(max_mp1=0.75,
+                                max_mp2=1.0,
+                                min_completeness=0.8,
+                                min_obs_per_slip=100,
+                                min_arcs=4)
+"""
+Default station-day rejection thresholds (MP RMS in [m]).
+"""
+
+
+def _group_sum(index, weights, N):
+    """
+    Return the sum of *weights* for each group label in *index*
+    (labels are 0, ..., *N* - 1).
+    """
+    return NP.bincount(index, weights=weights, minlength=N)
+
+
+def arc_qc(sat, t, obs, snr={}, config=DEFAULT_CONFIG):
+    """
+    Compute per arc quality metrics. The observations are given as
+    equal length arrays: satellite identifiers *sat*, times *t* (in
+    [s]), and the :class:`Observation` of arrays *obs* (see
+    :meth:`ObsMap.arrays`). The optional mapping *snr* associates
+    signal-to-noise observable names (e.g., S1) with arrays of the
+    same length. Return a :class:`DataFrame` with one row per arc.
+    """
+    sat = NP.asarray(sat)
+    t = NP.asarray(t, dtype=NP.float64)
+    I = NP.lexsort((t, sat))
+    sat = sat[I]
+    t = t[I]
+    obs = obs._make([NP.asarray(x, dtype=NP.float64)[I] for x in obs])
+    snr = OrderedDict([(k, NP.asarray(v, dtype=NP.float64)[I])
+                       for k, v in sorted(snr.iteritems())])
+    # elevation mask
+    J = obs.el >= config.elevation_mask
+    sat = sat[J]
+    t = t[J]
+    obs = obs._make([x[J] for x in obs])
+    snr = OrderedDict([(k, v[J]) for k, v in snr.iteritems()])
+    columns = ['sat', 'start', 'end', 'N', 'N_expected', 'completeness',
+               'slips', 'mp1_rms', 'mp2_rms', 'mp_N'] + ['{}_mean'.format(k) for k in snr]
+    if len(t) == 0:
+        return PD.DataFrame(columns=columns)
+    # nominal sampling interval
+    dt = NP.diff(t)
+    new_sat = sat[1:] != sat[:-1]
+    interval = NP.median(dt[~new_sat]) if NP.any(~new_sat) else 1.
+    # arcs
+    arc_break = NP.concatenate(([True], new_sat | (dt > config.gap_length)))
+    arc = NP.cumsum(arc_break) - 1
+    N_arc = arc[-1] + 1
+    # epochs with complete dual frequency observations
+    complete = NP.ones(len(t), dtype=bool)
+    for x in (obs.P1, obs.P2, obs.L1, obs.L2):
+        complete &= NP.isfinite(x) & (x != 0)
+    K = NP.flatnonzero(complete)
+    arc_K = arc[K]
+    t_K = t[K]
+    # cycle slips (tested between consecutive complete epochs within an arc)
+    obs_K = obs._make([x[K] for x in obs])
+    same_arc = arc_K[1:] == arc_K[:-1]
+    with NP.errstate(divide='ignore', invalid='ignore'):
+        wl_jump = NP.abs(NP.diff(obs_K.N_WL)) > config.wl_slip
+        ion_jump = NP.abs(NP.diff(obs_K.L_Im) / (NP.diff(t_K) / 60)) > config.ion_slip
+    slip = same_arc & (wl_jump | ion_jump)
+    # multipath: remove the mean of each slip free segment
+    segment = NP.cumsum(NP.concatenate(([True], ~same_arc | slip))) - 1
+    N_segment = segment[-1] + 1 if len(segment) > 0 else 0
+    segment_N = NP.bincount(segment, minlength=N_segment)
+    use = segment_N[segment] >= config.minimum_segment_points
+    mp_N = _group_sum(arc_K, use.astype(NP.float64), N_arc)
+    mp_rms = []
+    for mp in (obs_K.MP1, obs_K.MP2):
+        segment_mean = _group_sum(segment, mp, N_segment) / NP.maximum(segment_N, 1)
+        res2 = NP.where(use, (mp - segment_mean[segment])**2, 0)
+        with NP.errstate(divide='ignore', invalid='ignore'):
+            mp_rms.append(NP.sqrt(_group_sum(arc_K, res2, N_arc) / mp_N))
+    # completeness
+    first = NP.flatnonzero(arc_break)
+    last = NP.concatenate((first[1:], [len(t)])) - 1
+    N_expected = NP.round((t[last] - t[first]) / interval) + 1
+    N = NP.bincount(arc_K, minlength=N_arc)
+    data = OrderedDict([('sat', sat[first]),
+                        ('start', t[first]),
+                        ('end', t[last]),
+                        ('N', N),
+                        ('N_expected', N_expected.astype(NP.int64)),
+                        ('completeness', NP.minimum(N / N_expected, 1)),
+                        ('slips', NP.bincount(arc_K[1:][slip], minlength=N_arc)),
+                        ('mp1_rms', mp_rms[0]),
+                        ('mp2_rms', mp_rms[1]),
+                        ('mp_N', mp_N.astype(NP.int64))])
+    for k, v in snr.iteritems():
+        valid = NP.isfinite(v) & (v > 0)
+        with NP.errstate(divide='ignore', invalid='ignore'):
+            data['{}_mean'.format(k)] = (_group_sum(arc[valid], v[valid], N_arc) /
+                                         NP.bincount(arc[valid], minlength=N_arc))
+    return PD.DataFrame(data, columns=columns)
+
+
+def station_qc(arc_df, stn, date):
+    """
+    Summarize the per arc metrics *arc_df* (see :func:`arc_qc`) for
+    station *stn* on *date*. Return a single row :class:`DataFrame`
+    indexed by (stn, date). Multipath RMS values are combined
+    weighting each arc by its number of points.
+    """
+    N = arc_df.N.sum()
+    slips = arc_df.slips.sum()
+    mp_N = arc_df.mp_N.sum()
+    data = OrderedDict([('arcs', len(arc_df)),
+                        ('N', N),
+                        ('completeness', N / arc_df.N_expected.sum() if N > 0 else 0.),
+                        ('slips', slips),
+                        ('obs_per_slip', N / slips if slips > 0 else NP.inf)])
+    for key in ['mp1_rms', 'mp2_rms']:
+        valid = arc_df.mp_N > 0
+        if mp_N > 0:
+            data[key] = NP.sqrt((arc_df[key][valid]**2 * arc_df.mp_N[valid]).sum() / mp_N)
+        else:
+            data[key] = NP.nan
+    for key in [x for x in arc_df.columns if x.endswith('_mean')]:
+        valid = NP.isfinite(arc_df[key])
+        data[key] = ((arc_df[key][valid] * arc_df.N[valid]).sum() / arc_df.N[valid].sum()
+                     if valid.any() else NP.nan)
+    index = PD.MultiIndex.from_tuples([(stn, date)], names=['stn', 'date'])
+    return PD.DataFrame(data, index=index, columns=data.keys())
+
+
+def obs_map_qc(obs_map, stn, date=None, snr={}, config=DEFAULT_CONFIG):
+    """
+    Compute the per arc (see :func:`arc_qc`) and station-day (see
+    :func:`station_qc`) quality metrics for *obs_map* and return
+    both. If *date* is not given, use the date of the first
+    observation.
+    """
+    sat, t, obs = obs_map.arrays()
+    arc_df = arc_qc(sat, t, obs, snr=snr, config=config)
+    if date is None:
+        date = datetime.utcfromtimestamp(t.min()).date() if len(t) > 0 else None
+    return arc_df, station_qc(arc_df, stn, date)
+
+
+def reject(summary, thresholds=DEFAULT_THRESHOLDS):
+    """
+    Return a :class:`Series` (aligned with the station-day *summary*,
+    see :func:`station_qc`) of the reasons each station-day fails
+    *thresholds* (an empty string for station-days that pass).
+    """
+    tests = [('mp1_rms', summary.mp1_rms > thresholds.max_mp1),
+             ('mp2_rms', summary.mp2_rms > thresholds.max_mp2),
+             ('completeness', summary.completeness < thresholds.min_completeness),
+             ('obs_per_slip', summary.obs_per_slip < thresholds.min_obs_per_slip),
+             ('arcs', summary.arcs < thresholds.min_arcs)]
+    reasons = PD.Series('', index=summary.index)
+    for name, failed in tests:
+        reasons[failed] += name + ' '
+    return reasons.str.strip()
+
+
+def qc_screen(obs_map, stn, thresholds=DEFAULT_THRESHOLDS, config=DEFAULT_CONFIG):
+    """
+    Raise a :class:`RuntimeError` if *obs_map* for station *stn*
+    fails the quality *thresholds*. Return the station-day summary
+    otherwise.
+    """
+    _, summary = obs_map_qc(obs_map, stn, config=config)
+    reasons = reject(summary, thresholds=thresholds)
+    if reasons.iloc[0]:
+        raise RuntimeError('{} rejected by QC ({})'.format(stn, reasons.iloc[0]))
+    logger.info('{} passed QC (MP1={:.3f} [m] MP2={:.3f} [m] '
+                'completeness={:.3f} obs/slip={:.1f})'.format(stn,
+                                                               summary.mp1_rms.iloc[0],
+                                                               summary.mp2_rms.iloc[0],
+                                                               summary.completeness.iloc[0],
+                                                               summary.obs_per_slip.iloc[0]))
+    return summary
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    parser = ArgumentParser('Compute data quality metrics (multipath, cycle slips, completeness) for phase edit output.',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('output_fname',
+                        type=str,
+                        help='output CSV file containing one row per station-day')
+    parser.add_argument('h5_fnames',
+                        type=str,
+                        nargs='+',
+                        metavar='h5_fname',
+                        help='input H5 file generated by pyrsss.gps.phase_edit (the first 4 characters of the file name identify the station)')
+    parser.add_argument('--arc-output',
+                        '-a',
+                        type=str,
+                        default=None,
+                        help='also store the per arc metrics to this CSV file')
+    args = parser.parse_args(argv[1:])
+
+    summaries = []
+    arc_dfs = []
+    for h5_fname in args.h5_fnames:
+        logger.info('computing QC metrics for {}'.format(h5_fname))
+        stn = os.path.basename(h5_fname)[:4]
+        arc_df, summary = obs_map_qc(ObsMap(h5_fname), stn)
+        summaries.append(summary)
+        arc_df.insert(0, 'stn', stn)
+        arc_dfs.append(arc_df)
+    summary = PD.concat(summaries)
+    summary['reject'] = reject(summary)
+    summary.to_csv(args.output_fname)
+    if args.arc_output:
+        PD.concat(arc_dfs, ignore_index=True).to_csv(args.arc_output, index=False)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
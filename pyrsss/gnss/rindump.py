@@ -0,0 +1,339 @@
+from __future__ import division
+
+import logging
+from datetime import timedelta
+from collections import defaultdict
+
+from constants import (GPS_EPOCH,
+                       F_GLO_1,
+                       F_GLO_2,
+                       F_GLO_1_DELTA,
+                       F_GLO_2_DELTA,
+                       F_GAL_1,
+                       F_GAL_5A)
+from observation import (Observation,
+                         ObsTimeSeries,
+                         ObsMap,
+                         GNSSObsMap,
+                         Frequencies,
+                         GPS_FREQUENCIES,
+                         SYSTEMS)
+from ..util.path import tail
+
+logger = logging.getLogger('pyrsss.gps.rindump')
+
+
+"""
+Parsing of GPSTk RinDump output. Nothing in this module depends on
+the GPSTk build, i.e., records dumped elsewhere (or recorded
+fixtures) can be read without GPSTk.
+"""
+
+
+RINDUMP_OBS_MAP = {'GC1C': 'C1',
+                   'GC1W': 'P1',
+                   'GL1C': 'L1',
+                   'GC2W': 'P2',
+                   'GL2W': 'L2',
+                   'RC1C': 'C1',
+                   'RC1P': 'P1',
+                   'RL1C': 'L1',
+                   'RC2P': 'P2',
+                   'RL2C': 'L2',
+                   'EC1C': 'C1',
+                   'EL1C': 'L1',
+                   'EC5Q': 'P2',
+                   'EL5Q': 'L2',
+                   'ELE':  'el',
+                   'AZI':  'az',
+                   'SVX':  'satx',
+                   'SVY':  'saty',
+                   'SVZ':  'satz'}
+"""
+???
+
+Unsure why the above do not correlate with the output of RinSum (no,
+they do!).
+"""
+
+
+COMMON_KEYS = ['ELE', 'AZI', 'SVX', 'SVY', 'SVZ']
+"""
+RinDump identifiers that do not depend on the satellite system.
+"""
+
+GPS_KEYS = ['GC1C', 'GC1W', 'GL1C', 'GC2W', 'GL2W'] + COMMON_KEYS
+
+GLONASS_KEYS = ['RC1C', 'RC1P', 'RL1C', 'RC2P', 'RL2C']
+
+GALILEO_KEYS = ['EC1C', 'EL1C', 'EC5Q', 'EL5Q']
+
+GNSS_KEYS = GLONASS_KEYS + GALILEO_KEYS + GPS_KEYS
+"""
+RinDump observation identifiers for a single pass, multi-constellation
+dump (see :func:`read_rindump_gnss`). Galileo E1 and E5a take the
+place of carriers 1 and 2 (there is no P1 code --- C1 is used
+instead).
+"""
+
+OPTIONAL_FIELDS = ['P1']
+"""
+Observation fields that may be absent for a satellite system (missing
+values are replaced with C1).
+"""
+
+
+class P1C1ObsTimeSeries(ObsTimeSeries):
+    def __init__(self, receiver_type, p1c1_bias, replace_p1_with_c1=True):
+        """ ??? """
+        super(P1C1ObsTimeSeries, self).__init__()
+        self.receiver_type = receiver_type
+        self.p1c1_bias = p1c1_bias
+        self.replace_p1_with_c1 = replace_p1_with_c1
+
+    def __missing__(self, key):
+        prn = int(key[1:])
+        self[key] = ObsTimeSeries(self.receiver_p1c1_type,
+                                  self.p1c1_table[prn])
+        return self[key]
+
+    def __setitem__(self, key, value):
+        """ ??? """
+        if self.receiver_type == 1:
+            # C1 -> C1 + b
+            # P2 -> P2 + b
+            if value[0] != 0.0:
+                value[0] += self.p1c1_bias
+            if value[2] != 0.0:
+                value[2] += self.p1c1_bias
+        elif self.receiver_type == 2:
+            # C1 -> C1 + b
+            if value[0] != 0.0:
+                value[0] += self.p1c1_bias
+        elif self.receiver_type == 3:
+            pass
+        else:
+            raise ValueError('unknown receiver type {}'.format(self.receiver_type))
+        if value[1] == 0.0 and self.replace_p1_with_c1:
+            # replace P1 with C1 (with bias correction if necessary)
+            value[1] = value[0]
+        # replace empty values (==0.0) with None
+        value = [None if x == 0.0 else x for x in value]
+        super(P1C1ObsTimeSeries, self).__setitem__(key,
+                                                   Observation(*value))
+
+
+class P1C1ObsMap(ObsMap):
+    def __init__(self, receiver_type, receiver_p1c1_type, p1c1_table, h5_fname=None):
+        """ ??? """
+        super(P1C1ObsMap, self).__init__(h5_fname=h5_fname)
+        self.receiver_type = receiver_type
+        if receiver_p1c1_type not in [1, 2, 3]:
+            raise ValueError('receiver P1-C1 type {} is unknown '
+                             '(should be 1, 2, or 3 --- see the '
+                             'GPS_Receiver_Type file header)')
+        self.receiver_p1c1_type = receiver_p1c1_type
+        self.p1c1_table = p1c1_table
+
+    def __missing__(self, key):
+        prn = int(key[1:])
+        self[key] = P1C1ObsTimeSeries(self.receiver_p1c1_type,
+                                      self.p1c1_table[prn])
+        return self[key]
+
+
+def read_rindump_footer(rindump_fname):
+    """
+    Return the receiver tuple and P1-C1 bias information found at the
+    end of *rindump_fname*.
+    """
+    receiver_type = None
+    receiver_p1c1_type = None
+    p1c1_table = {}
+    with open(rindump_fname) as fid:
+        for line in tail(fid, window=100):
+            if line.startswith('# Receiver type:'):
+                receiver_type = line[17:].strip()
+            elif line.startswith('# Receiver p1c1 type:'):
+                receiver_p1c1_type = int(line[21:].strip())
+            elif line.startswith('# P1-C1 [m]:'):
+                prn = int(line[14:16])
+                p1c1_table[prn] = float(line[17:])
+            else:
+                continue
+    return receiver_type, receiver_p1c1_type, p1c1_table
+
+
+def parse_refpos(line):
+    """
+    Return the receiver position (XYZ in [m] and LLH in [deg, deg, m])
+    found on the RinDump "# Refpos" header *line*.
+    """
+    cols = line.split()
+    # [m, m, m]
+    xyz = map(float, cols[3:6])
+    lat = float(cols[8][:-1])
+    lon = float(cols[9][:-1])
+    if lon > 180:
+        lon -= 360
+    alt = float(cols[10])
+    # [deg, deg, m]
+    return xyz, [lat, lon, alt]
+
+
+def read_rindump(rindump_fname):
+    """
+    ???
+    """
+    obs_map = P1C1ObsMap(*read_rindump_footer(rindump_fname))
+    with open(rindump_fname) as fid:
+        for line in fid:
+            if line.startswith('# wk'):
+                # data header line
+                cols = line.split()
+                # only GPS observables (the dump may hold other systems,
+                # see read_rindump_gnss)
+                data_index_map = {RINDUMP_OBS_MAP[data_id]: i for i, data_id in enumerate(cols[4:])
+                                  if data_id in COMMON_KEYS or data_id[0] == 'G'}
+                column_mapping = []
+                for x in Observation._fields:
+                    try:
+                        column_mapping.append(data_index_map[x])
+                    except KeyError:
+                        raise RuntimeError('could not find {} observable in {}'.format(x, rindump_fname))
+                def reorder(l):
+                    return [l[i] for i in column_mapping]
+            elif line.startswith('# Refpos'):
+                obs_map.xyz, obs_map.llh = parse_refpos(line)
+            elif line.startswith('#'):
+                # skip other header lines
+                continue
+            else:
+                cols = line.split()
+                sat = cols[2]
+                if sat[0] != 'G':
+                    continue
+                gps_week = int(cols[0])
+                seconds = float(cols[1])
+                dt = GPS_EPOCH + timedelta(days=7 * gps_week,
+                                       seconds=seconds)
+                obs_map[sat][dt] = reorder(map(float, cols[3:]))
+    return obs_map
+
+
+def system_column_mapping(data_ids, system):
+    """
+    Return the list of indices into the RinDump columns *data_ids*
+    corresponding to each :class:`Observation` field for satellite
+    *system* (G, R, or E). Fields listed in :data:`OPTIONAL_FIELDS`
+    that are not found map to None. Return None if any other field is
+    not found, i.e., *system* was not dumped.
+    """
+    data_index_map = {RINDUMP_OBS_MAP[data_id]: i for i, data_id in enumerate(data_ids)
+                      if data_id in COMMON_KEYS or data_id[0] == system}
+    column_mapping = []
+    for x in Observation._fields:
+        if x in data_index_map:
+            column_mapping.append(data_index_map[x])
+        elif x in OPTIONAL_FIELDS:
+            column_mapping.append(None)
+        else:
+            return None
+    return column_mapping
+
+
+def set_frequencies(obs_map, system, glonass_status=None):
+    """
+    Record the carrier :class:`Frequencies` of each satellite of
+    *system* in *obs_map*. GLONASS frequency channels are found with
+    a single lookup over all observations in *glonass_status* (a
+    :class:`GLONASS_Status`, loaded if not given). Return *obs_map*.
+    """
+    if system == 'G':
+        obs_map.frequencies = {sat: GPS_FREQUENCIES for sat in obs_map}
+    elif system == 'E':
+        obs_map.frequencies = {sat: Frequencies(F_GAL_1, F_GAL_5A) for sat in obs_map}
+    elif system == 'R':
+        if glonass_status is None:
+            from glonass import GLONASS_Status
+            glonass_status = GLONASS_Status()
+        sats = sorted(obs_map)
+        slots = []
+        dts = []
+        for sat in sats:
+            slots.extend([int(sat[1:])] * len(obs_map[sat]))
+            dts.extend(obs_map[sat].iterkeys())
+        channels = glonass_status.channels(slots, dts)
+        obs_map.frequencies = {}
+        i = 0
+        for sat in sats:
+            sat_channels = channels[i:i + len(obs_map[sat])]
+            i += len(obs_map[sat])
+            k = sat_channels[0]
+            if (sat_channels != k).any():
+                logger.warning('{} changes frequency channel --- using '
+                               'channel {}'.format(sat, k))
+            obs_map.frequencies[sat] = Frequencies(F_GLO_1 + k * F_GLO_1_DELTA,
+                                                   F_GLO_2 + k * F_GLO_2_DELTA)
+    else:
+        raise ValueError('unknown satellite system {}'.format(system))
+    return obs_map
+
+
+def read_rindump_gnss(rindump_fname,
+                      systems=SYSTEMS.keys(),
+                      glonass_status=None):
+    """
+    Read *rindump_fname* (e.g., dumped with :data:`GNSS_KEYS`) in a
+    single pass and sort the observations of each of the satellite
+    *systems* into its own container. GPS observations receive the
+    same P1-C1 treatment as :func:`read_rindump`. Each container
+    records the carrier frequencies of its satellites (see
+    :func:`set_frequencies`; *glonass_status* is used for GLONASS).
+    Systems not found in the dump are omitted. Return the
+    :class:`GNSSObsMap`.
+    """
+    footer = read_rindump_footer(rindump_fname)
+    gnss_obs_map = GNSSObsMap()
+    column_mappings = {}
+    xyz = llh = None
+    with open(rindump_fname) as fid:
+        for line in fid:
+            if line.startswith('# wk'):
+                # data header line
+                data_ids = line.split()[4:]
+                for system in systems:
+                    column_mapping = system_column_mapping(data_ids, system)
+                    if column_mapping is None:
+                        logger.warning('{} observables not found in '
+                                       '{}'.format(SYSTEMS[system], rindump_fname))
+                        continue
+                    column_mappings[system] = column_mapping
+                    if system == 'G':
+                        gnss_obs_map[system] = P1C1ObsMap(*footer)
+                    else:
+                        # no P1-C1 bias correction outside of GPS
+                        gnss_obs_map[system] = P1C1ObsMap(footer[0], 3, defaultdict(float))
+            elif line.startswith('# Refpos'):
+                xyz, llh = parse_refpos(line)
+            elif line.startswith('#'):
+                # skip other header lines
+                continue
+            else:
+                cols = line.split()
+                sat = cols[2]
+                try:
+                    column_mapping = column_mappings[sat[0]]
+                except KeyError:
+                    continue
+                values = map(float, cols[3:])
+                dt = GPS_EPOCH + timedelta(days=7 * int(cols[0]),
+                                           seconds=float(cols[1]))
+                gnss_obs_map[sat[0]][sat][dt] = [0.0 if i is None else values[i]
+                                                 for i in column_mapping]
+    for system, obs_map in gnss_obs_map.iteritems():
+        if xyz is not None:
+            obs_map.xyz = xyz
+            obs_map.llh = llh
+        set_frequencies(obs_map, system, glonass_status=glonass_status)
+    return gnss_obs_map
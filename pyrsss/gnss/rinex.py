@@ -10,14 +10,21 @@ from cStringIO import StringIO
 
 import sh
 
-from constants import GPS_EPOCH
 from path import GPSTK_BUILD_PATH
 from teqc import rinex_info
 from preprocess import normalize_rinex
 from observation import Observation, ObsTimeSeries, ObsMap
+from rindump import (RINDUMP_OBS_MAP,
+                     GNSS_KEYS,
+                     P1C1ObsTimeSeries,
+                     P1C1ObsMap,
+                     read_rindump_footer,
+                     read_rindump)
 from receiver_types import ReceiverTypes
+from spp import receiver_position as spp_receiver_position
+from sp3 import read_sp3_window
 from p1c1 import P1C1Table
-from ..util.path import SmartTempDir, replace_path, tail
+from ..util.path import SmartTempDir, replace_path
 
 logger = logging.getLogger('pyrsss.gps.rinex')
 
@@ -43,32 +50,6 @@ RIN_DUMP = os.path.join(GPSTK_BUILD_PATH,
 
 
 
-RINDUMP_OBS_MAP = {'GC1C': 'C1',
-                   'GC1W': 'P1',
-                   'GL1C': 'L1',
-                   'GC2W': 'P2',
-                   'GL2W': 'L2',
-                   'RC1C': 'C1',
-                   'RC1P': 'P1',
-                   'RL1C': 'L1',
-                   'RC2P': 'P2',
-                   'RL2C': 'L2',
-                   'ELE':  'el',
-                   'AZI':  'az',
-                   'SVX':  'satx',
-                   'SVY':  'saty',
-                   'SVZ':  'satz'}
-"""
-???
-
-Unsure why the above do not correlate with the output of RinSum (no,
-they do!).
-"""
-
-
-GPS_KEYS = ['GC1C', 'GC1W', 'GL1C', 'GC2W', 'GL2W', 'ELE', 'AZI', 'SVX', 'SVY', 'SVZ']
-
-
 def fname2date(rinex_fname):
     """
     Return the :class:`datetime` associated with the RIENX file
@@ -96,6 +77,58 @@ def get_receiver_position(rinex_fname, nav_fname):
     return rinex_info(rinex_fname, nav_fname)['xyz']
 
 
+def get_header_position(rinex_fname):
+    """
+    Return the approximate receiver position (header line APPROX
+    POSITION XYZ, in [m]) found in *rinex_fname* or None if the line
+    is absent.
+    """
+    with open(rinex_fname) as fid:
+        for line in fid:
+            if line.rstrip().endswith('END OF HEADER'):
+                break
+            elif line.rstrip().endswith('APPROX POSITION XYZ'):
+                return map(float, line[:42].split())
+    return None
+
+
+def estimate_receiver_position(rinex_fname,
+                               nav_fname,
+                               work_path=None,
+                               sat_clock=None,
+                               rin_dump=RIN_DUMP):
+    """
+    Return the receiver position (in [m]) estimated by single point
+    positioning (see :func:`pyrsss.gnss.spp.receiver_position`) from
+    the pseudoranges in *rinex_fname* and satellite positions
+    computed from *nav_fname*, i.e., independent of the header
+    position. *sat_clock* provides satellite clock corrections (see
+    :func:`pyrsss.gnss.spp.spp`, e.g., :meth:`SP3.sat_clock`) and is
+    required: satellite clock errors (up to hundreds of [us]) would
+    otherwise bias the position by tens of [km]. Store the
+    intermediate dump in *work_path* (a temporary, automatically
+    cleaned up area if not specified).
+    """
+    if sat_clock is None:
+        raise ValueError('single point positioning requires satellite '
+                         'clock corrections')
+    reference_position = get_header_position(rinex_fname)
+    if reference_position is None:
+        # the reference only affects the dumped elevation and azimuth
+        reference_position = [0, 0, 0]
+    with SmartTempDir(work_path) as work_path:
+        dump_fname = replace_path(work_path, rinex_fname + '.spp.dump')
+        dump_rinex(dump_fname,
+                   rinex_fname,
+                   nav_fname,
+                   receiver_position=reference_position,
+                   rin_dump=rin_dump)
+        xyz = spp_receiver_position(read_rindump(dump_fname),
+                                    sat_clock=sat_clock)
+    logger.info('SPP receiver position: {:.3f} {:.3f} {:.3f} [m]'.format(*xyz))
+    return list(xyz)
+
+
 def get_receiver_type(rinex_fname):
     """
     Return the receiver type (header line REC # / TYPE / VERS) found
@@ -157,22 +190,38 @@ def append_p1c1_date_table(dump_fname,
 def dump_rinex(dump_fname,
                rinex_fname,
                nav_fname,
-               data_keys=GPS_KEYS,
+               data_keys=GNSS_KEYS,
                p1c1_table=P1C1_TABLE,
                receiver_position=None,
-               rin_dump=RIN_DUMP):
+               rin_dump=RIN_DUMP,
+               spp=False,
+               sat_clock=None):
     """
     ???
 
-    currently only dumps GPS observables
+    By default, dump the GPS, GLONASS, and Galileo observables in a
+    single pass (see :data:`GNSS_KEYS`). Read the GPS observations
+    with :func:`read_rindump` or all systems with
+    :func:`pyrsss.gnss.rindump.read_rindump_gnss`.
 
     receiver position in [m]
+
+    If *receiver_position* is not given, estimate it by single point
+    positioning if *spp* (see :func:`estimate_receiver_position`,
+    which receives *sat_clock*) or use the position reported by teqc
+    otherwise.
     """
     rin_dump_command = sh.Command(rin_dump)
     stderr_buffer = StringIO()
     if receiver_position is None:
-        receiver_position = get_receiver_position(rinex_fname,
-                                                  nav_fname)
+        if spp:
+            receiver_position = estimate_receiver_position(rinex_fname,
+                                                           nav_fname,
+                                                           sat_clock=sat_clock,
+                                                           rin_dump=rin_dump)
+        else:
+            receiver_position = get_receiver_position(rinex_fname,
+                                                      nav_fname)
     logger.info('dumping {} to {}'.format(rinex_fname,
                                           dump_fname))
     args = ['--nav', nav_fname,
@@ -233,143 +282,29 @@ routines.
 """
 
 
-class P1C1ObsTimeSeries(ObsTimeSeries):
-    def __init__(self, receiver_type, p1c1_bias, replace_p1_with_c1=True):
-        """ ??? """
-        super(P1C1ObsTimeSeries, self).__init__()
-        self.receiver_type = receiver_type
-        self.p1c1_bias = p1c1_bias
-        self.replace_p1_with_c1 = replace_p1_with_c1
-
-    def __missing__(self, key):
-        prn = int(key[1:])
-        self[key] = ObsTimeSeries(self.receiver_p1c1_type,
-                                  self.p1c1_table[prn])
-        return self[key]
-
-    def __setitem__(self, key, value):
-        """ ??? """
-        if self.receiver_type == 1:
-            # C1 -> C1 + b
-            # P2 -> P2 + b
-            if value[0] != 0.0:
-                value[0] += self.p1c1_bias
-            if value[2] != 0.0:
-                value[2] += self.p1c1_bias
-        elif self.receiver_type == 2:
-            # C1 -> C1 + b
-            if value[0] != 0.0:
-                value[0] += self.p1c1_bias
-        elif self.receiver_type == 3:
-            pass
-        else:
-            raise ValueError('unknown receiver type {}'.format(self.receiver_type))
-        if value[1] == 0.0 and self.replace_p1_with_c1:
-            # replace P1 with C1 (with bias correction if necessary)
-            value[1] = value[0]
-        # replace empty values (==0.0) with None
-        value = [None if x == 0.0 else x for x in value]
-        super(P1C1ObsTimeSeries, self).__setitem__(key,
-                                                   Observation(*value))
-
-
-class P1C1ObsMap(ObsMap):
-    def __init__(self, receiver_type, receiver_p1c1_type, p1c1_table, h5_fname=None):
-        """ ??? """
-        super(P1C1ObsMap, self).__init__(h5_fname=h5_fname)
-        self.receiver_type = receiver_type
-        if receiver_p1c1_type not in [1, 2, 3]:
-            raise ValueError('receiver P1-C1 type {} is unknown '
-                             '(should be 1, 2, or 3 --- see the '
-                             'GPS_Receiver_Type file header)')
-        self.receiver_p1c1_type = receiver_p1c1_type
-        self.p1c1_table = p1c1_table
-
-    def __missing__(self, key):
-        prn = int(key[1:])
-        self[key] = P1C1ObsTimeSeries(self.receiver_p1c1_type,
-                                      self.p1c1_table[prn])
-        return self[key]
-
-
-def read_rindump_footer(rindump_fname):
-    """
-    Return the receiver tuple and P1-C1 bias information found at the
-    end of *rindump_fname*.
-    """
-    receiver_type = None
-    receiver_p1c1_type = None
-    p1c1_table = {}
-    with open(rindump_fname) as fid:
-        for line in tail(fid, window=100):
-            if line.startswith('# Receiver type:'):
-                receiver_type = line[17:].strip()
-            elif line.startswith('# Receiver p1c1 type:'):
-                receiver_p1c1_type = int(line[21:].strip())
-            elif line.startswith('# P1-C1 [m]:'):
-                prn = int(line[14:16])
-                p1c1_table[prn] = float(line[17:])
-            else:
-                continue
-    return receiver_type, receiver_p1c1_type, p1c1_table
-
-
-def read_rindump(rindump_fname):
-    """
-    ???
-    """
-    obs_map = P1C1ObsMap(*read_rindump_footer(rindump_fname))
-    with open(rindump_fname) as fid:
-        for line in fid:
-            if line.startswith('# wk'):
-                # data header line
-                cols = line.split()
-                data_index_map = {RINDUMP_OBS_MAP[data_id]: i for i, data_id in enumerate(cols[4:])}
-                column_mapping = []
-                for x in Observation._fields:
-                    try:
-                        column_mapping.append(data_index_map[x])
-                    except KeyError:
-                        raise RuntimeError('could not find {} observable in {}'.format(x, rindump_fname))
-                def reorder(l):
-                    return [l[i] for i in column_mapping]
-            elif line.startswith('# Refpos'):
-                cols = line.split()
-                # [m, m, m]
-                obs_map.xyz = map(float, cols[3:6])
-                lat = float(cols[8][:-1])
-                lon = float(cols[9][:-1])
-                if lon > 180:
-                    lon -= 360
-                alt = float(cols[10])
-                # [deg, deg, m]
-                obs_map.llh = [lat, lon, alt]
-            elif line.startswith('#'):
-                # skip other header lines
-                continue
-            else:
-                cols = line.split()
-                gps_week = int(cols[0])
-                seconds = float(cols[1])
-                sat = cols[2]
-                dt = GPS_EPOCH + timedelta(days=7 * gps_week,
-                                       seconds=seconds)
-                obs_map[sat][dt] = reorder(map(float, cols[3:]))
-    return obs_map
-
-
 def dump_preprocessed_rinex(dump_fname,
                             obs_fname,
                             nav_fname,
                             work_path=None,
-                            decimate=None):
+                            decimate=None,
+                            spp=False,
+                            sp3_fnames=None):
     """
     Dump RINEX *obs_fname* and *nav_fname* to *dump_fname*. Preprocess
     the RNIEX file (i.e., normalization). Use *work_path* for
     intermediate files (use an automatically cleaned up area if not
     specified). Reduce the time interval to *decimate* [s] if
-    given. Return *dump_fname*.
+    given. Estimate the receiver position by single point positioning
+    if *spp* (see :func:`dump_rinex`) with the satellite clock
+    corrections found in the SP3 files *sp3_fnames* (required if
+    *spp*). Return *dump_fname*.
     """
+    sat_clock = None
+    if spp:
+        if not sp3_fnames:
+            raise ValueError('single point positioning requires SP3 '
+                             'files providing satellite clock corrections')
+        sat_clock = read_sp3_window(sp3_fnames).sat_clock
     with SmartTempDir(work_path) as work_path:
         output_rinex_fname = replace_path(work_path, obs_fname)
         normalize_rinex(output_rinex_fname,
@@ -377,7 +312,9 @@ def dump_preprocessed_rinex(dump_fname,
                         decimate=decimate)
         dump_rinex(dump_fname,
                    output_rinex_fname,
-                   nav_fname)
+                   nav_fname,
+                   spp=spp,
+                   sat_clock=sat_clock)
     return dump_fname
 
 
@@ -402,12 +339,25 @@ def main(argv=None):
                             type=int,
                             default=None,
                             help='decimate to time interval in [s]')
+    parser.add_argument('--spp',
+                        action='store_true',
+                        help='estimate the receiver position by single point positioning (instead of using the header position reported by teqc, requires --sp3)')
+    parser.add_argument('--sp3',
+                        type=str,
+                        nargs='+',
+                        default=[],
+                        help='SP3 files providing satellite clock corrections for --spp (e.g., the previous, current, and next day)')
     args = parser.parse_args(argv[1:])
 
+    if args.spp and not args.sp3:
+        parser.error('--spp requires satellite clock corrections (--sp3)')
+
     dump_preprocessed_rinex(args.dump_fname,
                             args.obs_fname,
                             args.nav_fname,
-                            decimate=args.decimate)
+                            decimate=args.decimate,
+                            spp=args.spp,
+                            sp3_fnames=args.sp3)
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
@@ -0,0 +1,386 @@
+from __future__ import division
+
+import os
+import re
+import sys
+import logging
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from collections import namedtuple
+
+import numpy as NP
+import pandas as PD
+from tables import open_file
+
+from h5layout import arc_number
+
+
+logger = logging.getLogger('pyrsss.gps.roti')
+
+
+"""
+Rate of TEC (ROT) and rate of TEC index (ROTI) computation on
+calibrated phase connected arcs (see :mod:`pyrsss.gnss.bias`). ROT is
+the first difference of slant TEC divided by the time between
+epochs and ROTI is the standard deviation of ROT over a trailing
+window. The windowed statistics are computed with cumulative sums, so
+the cost is linear in the number of epochs regardless of the window
+length, and :class:`StreamingROTI` carries the minimal per-arc state
+needed to process input one epoch chunk at a time.
+"""
+
+
+ROTI_WINDOW = 5 * 60
+"""
+Default ROTI (trailing) window length (in [s]).
+"""
+
+MAX_GAP = 60
+"""
+Default maximum time between consecutive epochs (in [s]) for which
+ROT is computed --- ROT across longer gaps is undefined (NaN).
+"""
+
+MIN_POINTS = 5
+"""
+Default minimum number of valid ROT values within a window required
+to compute ROTI.
+"""
+
+
+def rot(t, stec, max_gap=MAX_GAP, prev=None):
+    """
+    Compute ROT (in [TECU / min]) for the slant TEC *stec* (in
+    [TECU]) at times *t* (in [s], increasing). The output is aligned
+    with *t*: the ROT at index i is the rate between epochs i-1 and
+    i. The value is NaN for the first epoch and where the time between
+    epochs exceeds *max_gap* (in [s]). If *prev* is given, it is the
+    (time, slant TEC) pair of the epoch preceding *t[0]* and is used
+    to compute the ROT for the first epoch.
+    """
+    t = NP.asarray(t, dtype=NP.float64)
+    stec = NP.asarray(stec, dtype=NP.float64)
+    output = NP.empty_like(stec)
+    if len(t) == 0:
+        return output
+    if prev is None:
+        output[0] = NP.nan
+    else:
+        output[0] = _rate(t[0] - prev[0], stec[0] - prev[1], max_gap)
+    output[1:] = _rate(NP.diff(t), NP.diff(stec), max_gap)
+    return output
+
+
+def _rate(delta_t, delta_stec, max_gap):
+    """
+    Return the TEC rate (in [TECU / min]) given time differences
+    *delta_t* (in [s]) and slant TEC differences *delta_stec* (in
+    [TECU]). Rates across gaps longer than *max_gap* or non-positive
+    time steps are NaN.
+    """
+    delta_t = NP.asarray(delta_t, dtype=NP.float64)
+    with NP.errstate(divide='ignore', invalid='ignore'):
+        output = delta_stec / (delta_t / 60)
+    return NP.where((delta_t > 0) & (delta_t <= max_gap), output, NP.nan)
+
+
+def roti(t, rot_values, window=ROTI_WINDOW, min_points=MIN_POINTS):
+    """
+    Compute ROTI (in [TECU / min]), the standard deviation of ROT
+    *rot_values* (in [TECU / min]) at times *t* (in [s], increasing)
+    over the trailing window (t - *window*, t]. NaN ROT values are
+    excluded and ROTI is NaN where fewer than *min_points* valid ROT
+    values fall in the window.
+    """
+    t = NP.asarray(t, dtype=NP.float64)
+    rot_values = NP.asarray(rot_values, dtype=NP.float64)
+    valid = NP.isfinite(rot_values)
+    x = NP.where(valid, rot_values, 0)
+    # leading zero so that window sums are S[stop] - S[start]
+    N = NP.concatenate(([0], NP.cumsum(valid)))
+    S1 = NP.concatenate(([0], NP.cumsum(x)))
+    S2 = NP.concatenate(([0], NP.cumsum(x**2)))
+    start = NP.searchsorted(t, t - window, side='right')
+    stop = NP.arange(1, len(t) + 1)
+    n = N[stop] - N[start]
+    with NP.errstate(divide='ignore', invalid='ignore'):
+        mean = (S1[stop] - S1[start]) / n
+        var = (S2[stop] - S2[start]) / n - mean**2
+    # guard against small negative variance from round off
+    output = NP.sqrt(NP.maximum(var, 0))
+    output[n < min_points] = NP.nan
+    return output
+
+
+class ArcROTI(namedtuple('ArcROTI',
+                         'sat '
+                         'arc '
+                         't '
+                         'rot '
+                         'roti '
+                         'el '
+                         'ipp_lat '
+                         'ipp_lon')):
+    pass
+
+
+def read_calibrated_arcs(h5_fname):
+    """
+    Generate the calibrated phase connected arcs stored in
+    *h5_fname* (as written by :meth:`CalibratedArcMap.dump`, either
+    layout). Each element is the tuple (satellite, arc index, record
+    array) --- the record array has the fields of
+    :class:`CalibratedArcMap.Table` with *dt* in seconds since the
+    UNIX epoch.
+    """
+    with open_file(h5_fname, mode='r') as h5file:
+        for node in h5file.root.calibrated_phase_arcs:
+            if hasattr(node, '_v_children'):
+                # legacy layout: one table per arc
+                for arc_table in sorted(node, key=arc_number):
+                    yield node._v_name, arc_number(arc_table), arc_table.read()
+            else:
+                rows = node.read()
+                rows = rows[NP.lexsort((rows['dt'], rows['arc']))]
+                arcs, I = NP.unique(rows['arc'], return_index=True)
+                for arc, arc_rows in zip(arcs, NP.split(rows, I[1:])):
+                    yield node._v_name, int(arc), arc_rows
+
+
+def arc_roti(sat,
+             arc,
+             data,
+             window=ROTI_WINDOW,
+             max_gap=MAX_GAP,
+             min_points=MIN_POINTS):
+    """
+    Compute ROT and ROTI for the calibrated arc record array *data*
+    (see :func:`read_calibrated_arcs`) of satellite *sat* and arc
+    index *arc*. Return an :class:`ArcROTI`.
+    """
+    t = data['dt']
+    rot_values = rot(t, data['sobs'], max_gap=max_gap)
+    return ArcROTI(sat,
+                   arc,
+                   t,
+                   rot_values,
+                   roti(t, rot_values, window=window, min_points=min_points),
+                   data['el'],
+                   data['ipp_lat'],
+                   data['ipp_lon'])
+
+
+def station_roti(h5_fname,
+                 window=ROTI_WINDOW,
+                 max_gap=MAX_GAP,
+                 min_points=MIN_POINTS):
+    """
+    Compute ROT and ROTI for all arcs stored in the calibrated arc
+    file *h5_fname*. Return a :class:`DataFrame` indexed by time with
+    columns sat, arc, rot, roti, el, ipp_lat, and ipp_lon (epochs at
+    which ROTI is undefined are dropped).
+    """
+    arc_rotis = [arc_roti(sat,
+                          arc,
+                          data,
+                          window=window,
+                          max_gap=max_gap,
+                          min_points=min_points) for sat, arc, data in read_calibrated_arcs(h5_fname)]
+    return arc_rotis_to_df(arc_rotis)
+
+
+def arc_rotis_to_df(arc_rotis):
+    """
+    Concatenate the :class:`ArcROTI` in *arc_rotis* to a time indexed
+    :class:`DataFrame`, dropping epochs with undefined ROTI.
+    """
+    columns = ['sat', 'arc', 'rot', 'roti', 'el', 'ipp_lat', 'ipp_lon']
+    if len(arc_rotis) == 0:
+        return PD.DataFrame(columns=columns)
+    t = NP.concatenate([x.t for x in arc_rotis])
+    data = {'sat': NP.concatenate([NP.repeat(x.sat, len(x.t)) for x in arc_rotis]),
+            'arc': NP.concatenate([NP.repeat(x.arc, len(x.t)) for x in arc_rotis])}
+    for column in columns[2:]:
+        data[column] = NP.concatenate([getattr(x, column) for x in arc_rotis])
+    # times are seconds since the UNIX epoch
+    df = PD.DataFrame(data,
+                      index=PD.to_datetime(t, unit='s'),
+                      columns=columns)
+    df.index.name = 'dt'
+    return df[NP.isfinite(df.roti.values)].sort_index(kind='mergesort')
+
+
+def roti_map(ipp_lat,
+             ipp_lon,
+             roti_values,
+             lat_edges=NP.arange(-90, 91, 1),
+             lon_edges=NP.arange(-180, 181, 1)):
+    """
+    Bin the ROTI values *roti_values* at ionospheric pierce points
+    *ipp_lat* and *ipp_lon* (in [deg]) to the grid with cell edges
+    *lat_edges* and *lon_edges* (in [deg], increasing). Return the
+    tuple of the mean ROTI and the number of ROTI values in each cell
+    (each with shape len(*lat_edges*) - 1 by len(*lon_edges*) -
+    1). The mean is NaN for empty cells.
+    """
+    ipp_lat = NP.asarray(ipp_lat, dtype=NP.float64)
+    ipp_lon = NP.asarray(ipp_lon, dtype=NP.float64)
+    roti_values = NP.asarray(roti_values, dtype=NP.float64)
+    N_lat = len(lat_edges) - 1
+    N_lon = len(lon_edges) - 1
+    I_lat = NP.searchsorted(lat_edges, ipp_lat, side='right') - 1
+    I_lon = NP.searchsorted(lon_edges, ipp_lon, side='right') - 1
+    valid = ((I_lat >= 0) & (I_lat < N_lat) &
+             (I_lon >= 0) & (I_lon < N_lon) &
+             NP.isfinite(roti_values))
+    I = I_lat[valid] * N_lon + I_lon[valid]
+    count = NP.bincount(I, minlength=N_lat * N_lon)
+    total = NP.bincount(I, weights=roti_values[valid], minlength=N_lat * N_lon)
+    with NP.errstate(divide='ignore', invalid='ignore'):
+        mean = total / count
+    return mean.reshape((N_lat, N_lon)), count.reshape((N_lat, N_lon))
+
+
+class StreamingROTI(object):
+    def __init__(self,
+                 window=ROTI_WINDOW,
+                 max_gap=MAX_GAP,
+                 min_points=MIN_POINTS):
+        """
+        Incremental ROT / ROTI computation. Input is provided one
+        epoch chunk at a time through :meth:`update` and the
+        output for each chunk is identical to that of :func:`rot`
+        and :func:`roti` applied to the complete time series. Only
+        the samples within the trailing *window* (in [s]) are
+        retained per key (e.g., (station, satellite) pair).
+        """
+        self.window = window
+        self.max_gap = max_gap
+        self.min_points = min_points
+        self.state = {}
+
+    def __len__(self):
+        return len(self.state)
+
+    def update(self, key, t, stec):
+        """
+        Process the next chunk of slant TEC *stec* (in [TECU]) at
+        times *t* (in [s], increasing and later than any previous
+        chunk) for *key*. Return the tuple of ROT and ROTI (in [TECU /
+        min]) for the chunk.
+        """
+        t = NP.asarray(t, dtype=NP.float64)
+        stec = NP.asarray(stec, dtype=NP.float64)
+        if len(t) == 0:
+            return NP.empty(0), NP.empty(0)
+        try:
+            t_tail, stec_tail, rot_tail = self.state[key]
+        except KeyError:
+            t_tail = stec_tail = rot_tail = NP.empty(0)
+        if len(t_tail) > 0:
+            prev = t_tail[-1], stec_tail[-1]
+        else:
+            prev = None
+        rot_chunk = rot(t, stec, max_gap=self.max_gap, prev=prev)
+        t_all = NP.concatenate((t_tail, t))
+        rot_all = NP.concatenate((rot_tail, rot_chunk))
+        roti_chunk = roti(t_all,
+                          rot_all,
+                          window=self.window,
+                          min_points=self.min_points)[len(t_tail):]
+        # retain only the samples that may fall in a future window
+        I = NP.searchsorted(t_all, t_all[-1] - self.window, side='right')
+        self.state[key] = (t_all[I:],
+                           NP.concatenate((stec_tail, stec))[I:],
+                           rot_all[I:])
+        return rot_chunk, roti_chunk
+
+    def update_chunk(self, stn, sat, t, stec):
+        """
+        Process an epoch chunk containing many arcs: *stn*, *sat*,
+        *t* (in [s]) and *stec* (in [TECU]) are equal length arrays
+        with one element per observation. Observations are grouped by
+        (station, satellite) and passed to :meth:`update`. Return the
+        tuple of ROT and ROTI (in [TECU / min]) aligned with the
+        input.
+        """
+        stn = NP.asarray(stn)
+        sat = NP.asarray(sat)
+        t = NP.asarray(t, dtype=NP.float64)
+        stec = NP.asarray(stec, dtype=NP.float64)
+        rot_values = NP.empty_like(stec)
+        roti_values = NP.empty_like(stec)
+        I = NP.lexsort((t, sat, stn))
+        stn_sorted = stn[I]
+        sat_sorted = sat[I]
+        boundary = NP.flatnonzero((stn_sorted[1:] != stn_sorted[:-1]) |
+                                  (sat_sorted[1:] != sat_sorted[:-1])) + 1
+        for start, stop in zip(NP.concatenate(([0], boundary)),
+                               NP.concatenate((boundary, [len(I)]))):
+            J = I[start:stop]
+            (rot_values[J],
+             roti_values[J]) = self.update((stn_sorted[start], sat_sorted[start]),
+                                           t[J],
+                                           stec[J])
+        return rot_values, roti_values
+
+    def expire(self, t):
+        """
+        Discard the state of keys with no samples after time *t* -
+        *max_gap* (in [s]), i.e., arcs that have ended. Return the
+        number of keys discarded.
+        """
+        expired = [key for key, (t_tail, _, _) in self.state.iteritems()
+                   if len(t_tail) == 0 or t_tail[-1] < t - self.max_gap]
+        for key in expired:
+            del self.state[key]
+        return len(expired)
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    parser = ArgumentParser('Compute ROT and ROTI from calibrated phase connected arcs.',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('output_h5_fname',
+                        type=str,
+                        help='output H5 file (one table per input file)')
+    parser.add_argument('calibrated_h5_fnames',
+                        type=str,
+                        nargs='+',
+                        metavar='calibrated_h5_fname',
+                        help='input H5 file generated by pyrsss.gps.bias')
+    parser.add_argument('--window',
+                        '-w',
+                        type=float,
+                        default=ROTI_WINDOW,
+                        help='ROTI window length [s]')
+    parser.add_argument('--max-gap',
+                        '-g',
+                        type=float,
+                        default=MAX_GAP,
+                        help='maximum time between epochs for which ROT is computed [s]')
+    parser.add_argument('--min-points',
+                        '-n',
+                        type=int,
+                        default=MIN_POINTS,
+                        help='minimum number of ROT values in a window to compute ROTI')
+    args = parser.parse_args(argv[1:])
+
+    for i, calibrated_h5_fname in enumerate(args.calibrated_h5_fnames):
+        logger.info('computing ROTI for {}'.format(calibrated_h5_fname))
+        df = station_roti(calibrated_h5_fname,
+                          window=args.window,
+                          max_gap=args.max_gap,
+                          min_points=args.min_points)
+        df.to_hdf(args.output_h5_fname,
+                  re.sub(r'\W', '_', os.path.basename(calibrated_h5_fname)),
+                  mode='w' if i == 0 else 'a',
+                  format='table')
+        logger.info('stored {} ROTI values to {}'.format(len(df),
+                                                       args.output_h5_fname))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,375 @@
+from __future__ import division
+
+import sys
+import logging
+import time
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from collections import namedtuple, OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as NP
+
+from h5layout import times_to_seconds
+
+logger = logging.getLogger('pyrsss.gps.sp3')
+
+
+"""
+Reader for SP3-c and SP3-d precise orbit files and vectorized
+Lagrange interpolation of the tabulated satellite positions.
+"""
+
+
+BAD_POSITION = 0.
+"""
+SP3 value indicating a missing position component (in [km]).
+"""
+
+BAD_CLOCK = 999999.
+"""
+SP3 clock values greater than or equal to this value indicate a
+missing clock (in [us]).
+"""
+
+LAGRANGE_ORDER = 10
+"""
+Default Lagrange interpolating polynomial degree (i.e., 11 point
+interpolation).
+"""
+
+
+class SP3(namedtuple('SP3',
+                     'version '
+                     'time_system '
+                     'coord_system '
+                     'agency '
+                     'dt '
+                     'sats '
+                     'xyz '
+                     'clock')):
+    """
+    Precise orbit information. *dt* is the list of epochs (in the
+    file *time_system*), *sats* is the list of satellite identifiers
+    (e.g., G01), *xyz* is the array (epoch by satellite by 3) of
+    satellite positions (in [m]), and *clock* is the array (epoch by
+    satellite) of satellite clock corrections (in [s]). Missing
+    values are NaN.
+    """
+    @property
+    def t(self):
+        """
+        Return the epochs as an array of seconds relative to the first
+        epoch.
+        """
+        return NP.array([(x - self.dt[0]).total_seconds() for x in self.dt])
+
+    def interpolator(self, order=LAGRANGE_ORDER):
+        """
+        Return the :class:`LagrangeInterpolator` for the satellite
+        positions.
+        """
+        return LagrangeInterpolator(self.t, self.xyz, order=order)
+
+    def __call__(self, dt, order=LAGRANGE_ORDER):
+        """
+        Return the satellite positions (an array of shape len(*dt*) by
+        satellite by 3, in [m]) interpolated to the list of
+        :class:`datetime` *dt*.
+        """
+        t = NP.array([(x - self.dt[0]).total_seconds() for x in dt])
+        return self.interpolator(order=order)(t)
+
+    def sat_clock(self, sats, t):
+        """
+        Return the clock corrections (in [s]) of satellites *sats* at
+        times *t* (equal length arrays, *t* in [s] since the UNIX
+        epoch in the file time system). Clocks are linearly
+        interpolated between tabulated epochs. The correction is NaN
+        for unknown satellites and times outside the tabulated span.
+        """
+        sats = NP.asarray(sats)
+        t = NP.asarray(t, dtype=NP.float64)
+        t_sp3 = times_to_seconds(self.dt)
+        sat_index_map = {x: i for i, x in enumerate(self.sats)}
+        output = NP.full(len(t), NP.nan)
+        for sat in NP.unique(sats):
+            if sat not in sat_index_map:
+                continue
+            clock = self.clock[:, sat_index_map[sat]]
+            valid = NP.isfinite(clock)
+            if not NP.any(valid):
+                continue
+            I = sats == sat
+            output[I] = NP.interp(t[I],
+                                  t_sp3[valid],
+                                  clock[valid],
+                                  left=NP.nan,
+                                  right=NP.nan)
+        return output
+
+
+def parse_epoch(line):
+    """
+    Parse the SP3 epoch header *line* (beginning with *) and return
+    the :class:`datetime`.
+    """
+    fields = line[1:].split()
+    year, month, day, hour, minute = map(int, fields[:5])
+    seconds = float(fields[5])
+    return datetime(year, month, day, hour, minute) + timedelta(seconds=seconds)
+
+
+def read_sp3(sp3_fname):
+    """
+    Parse the SP3-c or SP3-d file *sp3_fname* and return an
+    :class:`SP3`.
+    """
+    with open(sp3_fname) as fid:
+        lines = fid.read().splitlines()
+    version = lines[0][1]
+    if version not in ['c', 'd']:
+        raise ValueError('{} is SP3-{} (only SP3-c and SP3-d are '
+                         'supported)'.format(sp3_fname, version))
+    coord_system = lines[0][46:51].strip()
+    agency = lines[0][56:60].strip()
+    N_sats = int(lines[2][3:6])
+    sats = []
+    time_system = None
+    dt = []
+    position_lines = []
+    epoch_index = []
+    for line in lines[2:]:
+        if line.startswith('+ '):
+            sats.extend([line[i:i + 3] for i in range(9, 60, 3)])
+        elif line.startswith('%c') and time_system is None:
+            time_system = line[9:12].strip()
+        elif line.startswith('*'):
+            dt.append(parse_epoch(line))
+        elif line.startswith('P'):
+            position_lines.append(line)
+            epoch_index.append(len(dt) - 1)
+        elif line.startswith('EOF'):
+            break
+    sats = [x.replace(' ', '0') for x in sats[:N_sats]]
+    # fixed width fields: x, y, z (in [km]) and clock (in [us])
+    values = NP.array([(x[4:18], x[18:32], x[32:46], x[46:60]) for x in position_lines],
+                      dtype=NP.float64)
+    sat_index_map = {x: i for i, x in enumerate(sats)}
+    I = NP.array(epoch_index, dtype=NP.int64)
+    J = NP.array([sat_index_map[x[1:4].replace(' ', '0')] for x in position_lines],
+                 dtype=NP.int64)
+    xyz = NP.full((len(dt), len(sats), 3), NP.nan)
+    clock = NP.full((len(dt), len(sats)), NP.nan)
+    if len(values) > 0:
+        position = values[:, :3] * 1e3
+        position[NP.any(values[:, :3] == BAD_POSITION, axis=1)] = NP.nan
+        xyz[I, J] = position
+        clock[I, J] = NP.where(values[:, 3] >= BAD_CLOCK, NP.nan, values[:, 3] * 1e-6)
+    return SP3(version,
+               time_system,
+               coord_system,
+               agency,
+               dt,
+               sats,
+               xyz,
+               clock)
+
+
+def read_sp3_window(sp3_fnames):
+    """
+    Parse and concatenate the consecutive SP3 files *sp3_fnames*
+    (e.g., the previous, current, and next day so that
+    interpolation near the day boundaries is well centered). The
+    output contains the union of satellites and epochs duplicated at
+    file boundaries are stored only once (the first occurrence is
+    kept). Return an :class:`SP3`.
+    """
+    sp3_list = [read_sp3(x) for x in sp3_fnames]
+    sats = sorted(set.union(*[set(x.sats) for x in sp3_list]))
+    sat_index_map = {x: i for i, x in enumerate(sats)}
+    dt_map = OrderedDict()
+    for k, sp3 in enumerate(sp3_list):
+        for i, dt_i in enumerate(sp3.dt):
+            dt_map.setdefault(dt_i, (k, i))
+    dt = sorted(dt_map)
+    xyz = NP.full((len(dt), len(sats), 3), NP.nan)
+    clock = NP.full((len(dt), len(sats)), NP.nan)
+    for k, sp3 in enumerate(sp3_list):
+        pairs = [(i, dt_map[x][1]) for i, x in enumerate(dt) if dt_map[x][0] == k]
+        if not pairs:
+            continue
+        I_out, I_in = map(list, zip(*pairs))
+        J = [sat_index_map[x] for x in sp3.sats]
+        xyz[NP.ix_(I_out, J)] = sp3.xyz[I_in]
+        clock[NP.ix_(I_out, J)] = sp3.clock[I_in]
+    first = sp3_list[0]
+    return SP3(first.version,
+               first.time_system,
+               first.coord_system,
+               first.agency,
+               dt,
+               sats,
+               xyz,
+               clock)
+
+
+WEIGHT_CACHE = OrderedDict()
+"""
+Barycentric weights for each window of the most recently used
+interpolation node grids, keyed by the node grid and interpolation
+order (least recently used first).
+"""
+
+WEIGHT_CACHE_SIZE = 8
+"""
+Maximum number of node grids kept in :data:`WEIGHT_CACHE`.
+"""
+
+
+def barycentric_weights(nodes, order):
+    """
+    Return the barycentric weights (an array of shape len(*nodes*) -
+    *order* by *order* + 1) for each window of *order* + 1
+    consecutive *nodes*. Weights are cached for the
+    :data:`WEIGHT_CACHE_SIZE` most recently used node grids.
+    """
+    nodes = NP.asarray(nodes, dtype=NP.float64)
+    key = (nodes.tostring(), order)
+    try:
+        # move to the most recently used position
+        weights = WEIGHT_CACHE.pop(key)
+        WEIGHT_CACHE[key] = weights
+        return weights
+    except KeyError:
+        pass
+    N = order + 1
+    windows = nodes[NP.arange(len(nodes) - order)[:, None] + NP.arange(N)]
+    # w_j = 1 / prod_{k != j} (x_j - x_k) with the scale of each window
+    # normalized (the interpolant is invariant to a scale factor)
+    scale = (windows[:, -1] - windows[:, 0])[:, None, None] / 2
+    scale[scale == 0] = 1
+    D = (windows[:, :, None] - windows[:, None, :]) / scale
+    D[:, NP.arange(N), NP.arange(N)] = 1
+    weights = 1 / NP.prod(D, axis=2)
+    WEIGHT_CACHE[key] = weights
+    while len(WEIGHT_CACHE) > WEIGHT_CACHE_SIZE:
+        WEIGHT_CACHE.popitem(last=False)
+    return weights
+
+
+class LagrangeInterpolator(object):
+    def __init__(self, nodes, values, order=LAGRANGE_ORDER):
+        """
+        Piecewise Lagrange interpolation of *values* (an array whose
+        leading dimension is aligned with the increasing *nodes*)
+        using polynomials of degree *order* fit to the *order* + 1
+        nodes closest to (centered on) each query point.
+        """
+        self.nodes = NP.asarray(nodes, dtype=NP.float64)
+        self.values = NP.asarray(values, dtype=NP.float64)
+        if len(self.nodes) != len(self.values):
+            raise ValueError('nodes and values must have the same leading dimension')
+        if len(self.nodes) < order + 1:
+            raise ValueError('{} nodes are insufficient for an order {} '
+                             'interpolant'.format(len(self.nodes), order))
+        self.order = order
+        self.weights = barycentric_weights(self.nodes, order)
+
+    def coefficients(self, t):
+        """
+        Return the tuple of the first node index of the window used
+        for each query point in *t* and the array (len(*t*) by *order*
+        + 1) of interpolation coefficients.
+        """
+        t = NP.asarray(t, dtype=NP.float64)
+        N = self.order + 1
+        I0 = NP.searchsorted(self.nodes, t) - N // 2
+        I0 = NP.clip(I0, 0, len(self.nodes) - N)
+        diff = t[:, None] - self.nodes[I0[:, None] + NP.arange(N)]
+        exact = diff == 0
+        diff[exact] = 1
+        C = self.weights[I0] / diff
+        # query points coinciding with a node take the node value
+        I_exact = NP.any(exact, axis=1)
+        C[I_exact] = exact[I_exact]
+        C /= NP.sum(C, axis=1)[:, None]
+        return I0, C
+
+    def __call__(self, t):
+        """
+        Return the interpolated values at *t* (an array with leading
+        dimension len(*t*)).
+        """
+        I0, C = self.coefficients(t)
+        shape = (len(I0),) + (1,) * (self.values.ndim - 1)
+        output = NP.zeros((len(I0),) + self.values.shape[1:])
+        for j in range(self.order + 1):
+            output += C[:, j].reshape(shape) * self.values[I0 + j]
+        return output
+
+
+def synthetic_sp3(start=datetime(2014, 1, 1), N_epochs=96, N_sats=32):
+    """
+    Return an :class:`SP3` with *N_epochs* 15 minute epochs (starting
+    at *start*) of *N_sats* satellites on circular orbits (zero
+    clocks).
+    """
+    dt = [start + timedelta(minutes=15 * i) for i in range(N_epochs)]
+    t = NP.array([(x - dt[0]).total_seconds() for x in dt])
+    phase = NP.linspace(0, 2 * NP.pi, N_sats, endpoint=False)
+    omega = 2 * NP.pi / (43082.)
+    arg = omega * t[:, None] + phase[None, :]
+    xyz = 26560e3 * NP.stack((NP.cos(arg),
+                              NP.sin(arg) * NP.cos(NP.radians(55)),
+                              NP.sin(arg) * NP.sin(NP.radians(55))), axis=2)
+    return SP3('d', 'GPS', 'IGS14', 'SYNT', dt,
+               ['G{:02d}'.format(i + 1) for i in range(N_sats)],
+               xyz, NP.zeros(xyz.shape[:2]))
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    parser = ArgumentParser('Read SP3 precise orbits and time the vectorized Lagrange interpolation '
+                            '(see sp3_test for accuracy checks).',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('sp3_fnames',
+                        type=str,
+                        nargs='*',
+                        metavar='sp3_fname',
+                        help='input SP3 files (consecutive days) --- use synthetic orbits if not given')
+    parser.add_argument('--order',
+                        '-n',
+                        type=int,
+                        default=LAGRANGE_ORDER,
+                        help='Lagrange interpolating polynomial degree')
+    parser.add_argument('--interval',
+                        '-i',
+                        type=float,
+                        default=30,
+                        help='interpolation interval [s]')
+    args = parser.parse_args(argv[1:])
+
+    if args.sp3_fnames:
+        sp3 = read_sp3_window(args.sp3_fnames)
+    else:
+        sp3 = synthetic_sp3()
+    t = sp3.t
+    t_query = NP.arange(t[0], t[-1] + args.interval / 2, args.interval)
+    # timing (weights are cached after the first call)
+    sp3.interpolator(order=args.order)(t_query)
+    N_trials = 10
+    start = time.time()
+    for _ in range(N_trials):
+        interpolator = sp3.interpolator(order=args.order)
+        interpolator(t_query)
+    elapsed = (time.time() - start) / N_trials
+    logger.info('interpolated {} epochs x {} satellites in {:.1f} [ms]'.format(len(t_query),
+                                                                             len(sp3.sats),
+                                                                             elapsed * 1e3))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
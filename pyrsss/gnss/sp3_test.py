@@ -0,0 +1,76 @@
+from __future__ import division
+
+import logging
+
+import numpy as NP
+
+from sp3 import (LAGRANGE_ORDER, WEIGHT_CACHE, WEIGHT_CACHE_SIZE,
+                 LagrangeInterpolator, barycentric_weights, synthetic_sp3)
+
+
+def test_polynomial_reproduction(order=LAGRANGE_ORDER, interval=30):
+    """
+    Polynomials of degree *order* are reproduced (to rounding error)
+    between the nodes.
+    """
+    t = synthetic_sp3().t
+    t_query = NP.arange(t[0], t[-1] + interval / 2, interval)
+    coef = NP.random.RandomState(0).randn(order + 1)
+    scale = t[-1] - t[0]
+    interpolator = LagrangeInterpolator(t,
+                                        NP.polyval(coef, t / scale),
+                                        order=order)
+    error = NP.max(NP.abs(interpolator(t_query) - NP.polyval(coef, t_query / scale)))
+    assert error < 1e-9
+
+
+def test_lagrange_parity(order=LAGRANGE_ORDER, N_samples=3, interval=30):
+    """
+    The vectorized interpolant agrees with the symbolic
+    :func:`pyrsss.util.lagrange.multivariate_lagrange` interpolant
+    (each sample takes several seconds) on synthetic orbits.
+    """
+    from ..util.lagrange import multivariate_lagrange
+    sp3 = synthetic_sp3()
+    t = sp3.t
+    t_query = NP.arange(t[0], t[-1] + interval / 2, interval)
+    interpolator = sp3.interpolator(order=order)
+    xyz_query = interpolator(t_query)
+    I0, _ = interpolator.coefficients(t_query)
+    for k in NP.linspace(1, len(t_query) - 2, N_samples).astype(int):
+        nodes = t[I0[k]:I0[k] + order + 1]
+        j = k % len(sp3.sats)
+        values = sp3.xyz[I0[k]:I0[k] + order + 1, j, 0]
+        # map the abscissa to [-1, 1] for numerical conditioning
+        center = (nodes[0] + nodes[-1]) / 2
+        half_width = (nodes[-1] - nodes[0]) / 2
+        poly, _, _, _ = multivariate_lagrange(zip((nodes - center) / half_width, values),
+                                              order)
+        symbolic = float(poly.eval((t_query[k] - center) / half_width))
+        assert abs(symbolic - xyz_query[k, j, 0]) / NP.max(NP.abs(values)) < 1e-9
+
+
+def test_weight_cache_bounded(order=LAGRANGE_ORDER):
+    """
+    The barycentric weight cache holds at most
+    :data:`WEIGHT_CACHE_SIZE` node grids and evicts the least recently
+    used grid.
+    """
+    WEIGHT_CACHE.clear()
+    grids = [NP.arange(20) * 900. + 86400 * i for i in range(WEIGHT_CACHE_SIZE + 3)]
+    first = barycentric_weights(grids[0], order)
+    for nodes in grids[1:]:
+        # keep the first grid in use
+        assert barycentric_weights(grids[0], order) is first
+        barycentric_weights(nodes, order)
+    assert len(WEIGHT_CACHE) == WEIGHT_CACHE_SIZE
+    assert barycentric_weights(grids[0], order) is first
+    assert (grids[1].tostring(), order) not in WEIGHT_CACHE
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    test_polynomial_reproduction()
+    test_lagrange_parity()
+    test_weight_cache_bounded()
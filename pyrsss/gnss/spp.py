@@ -0,0 +1,331 @@
+from __future__ import division
+
+import os
+import sys
+import logging
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from collections import namedtuple
+
+import numpy as NP
+import scipy.constants as const
+
+from observation import ObsMap
+from rindump import read_rindump
+from sp3 import read_sp3_window
+
+logger = logging.getLogger('pyrsss.gps.spp')
+
+
+"""
+Single point positioning (SPP) from the ionosphere free pseudorange
+combination and the satellite positions stored in an observation
+container. All epochs are solved at once: the per epoch least-squares
+problems share one padded (epoch by satellite) design matrix layout
+so that each Gauss-Newton iteration is a handful of array operations
+regardless of the record length. The daily receiver position is the
+median of the per epoch solutions.
+"""
+
+
+OMEGA_E = 7.2921151467e-5
+"""
+Earth rotation rate (WGS84) [rad / s].
+"""
+
+MAX_ITERATIONS = 10
+"""
+Maximum number of Gauss-Newton iterations.
+"""
+
+TOLERANCE = 1e-4
+"""
+Iterations stop once no epoch position update exceeds this value (in
+[m]).
+"""
+
+MINIMUM_SATS = 5
+"""
+Epochs with fewer satellites are not solved (4 are required, the 5th
+provides the residual used to screen the solution).
+"""
+
+MAX_PDOP = 6
+"""
+Epoch solutions with larger position dilution of precision are
+excluded from the daily median.
+"""
+
+MAX_RESIDUAL_RMS = 10
+"""
+Epoch solutions with larger post-fit residual RMS are excluded from
+the daily median (in [m]).
+"""
+
+
+class SPPSolution(namedtuple('SPPSolution',
+                             't '
+                             'xyz '
+                             'clock '
+                             'N '
+                             'pdop '
+                             'residual_rms')):
+    """
+    Per epoch single point positioning solutions. *t* is the array of
+    epoch times (in [s] since the UNIX epoch), *xyz* is the array
+    (epoch by 3) of receiver positions (ECEF, in [m]), *clock* is the
+    receiver clock offset (in [m]), *N* is the number of satellites,
+    *pdop* is the position dilution of precision, and *residual_rms*
+    is the post-fit residual RMS (in [m]). Unsolved epochs are NaN.
+    """
+    pass
+
+
+def iono_free(obs_map, sat, obs):
+    """
+    Return the ionosphere free pseudorange combination (in [m]) of
+    the :class:`Observation` of arrays *obs* for the corresponding
+    satellite identifiers *sat* (see :meth:`ObsMap.arrays`). The
+    carrier frequencies are those recorded in *obs_map*.
+    """
+    sats, I = NP.unique(sat, return_inverse=True)
+    f1, f2 = NP.array([obs_map.frequency(x) for x in sats]).T
+    f1_2 = f1[I]**2
+    f2_2 = f2[I]**2
+    return (f1_2 * obs.P1 - f2_2 * obs.P2) / (f1_2 - f2_2)
+
+
+def epoch_arrays(t, *columns):
+    """
+    Arrange the observations at times *t* into padded epoch by
+    satellite arrays. Return the array of unique epoch times, the
+    boolean mask of valid entries, and each of *columns* (arrays
+    aligned with *t*, possibly with trailing dimensions) rearranged
+    (padding is 0).
+    """
+    I = NP.argsort(t, kind='mergesort')
+    t = t[I]
+    epochs, epoch_index, counts = NP.unique(t,
+                                            return_inverse=True,
+                                            return_counts=True)
+    first = NP.concatenate(([0], NP.cumsum(counts)[:-1]))
+    slot = NP.arange(len(t)) - first[epoch_index]
+    shape = (len(epochs), counts.max() if len(counts) else 0)
+    mask = NP.zeros(shape, dtype=bool)
+    mask[epoch_index, slot] = True
+    output = []
+    for column in columns:
+        column = NP.asarray(column)[I]
+        padded = NP.zeros(shape + column.shape[1:])
+        padded[epoch_index, slot] = column
+        output.append(padded)
+    return [epochs, mask] + output
+
+
+def rotate_earth(S, tau):
+    """
+    Rotate the satellite positions *S* (array with last dimension 3,
+    ECEF in [m]) about the Earth axis by the angle swept during the
+    signal travel times *tau* [s] (array matching the leading
+    dimensions of *S*), i.e., express the position at transmission
+    in the ECEF frame at reception.
+    """
+    theta = OMEGA_E * tau
+    cos_theta = NP.cos(theta)
+    sin_theta = NP.sin(theta)
+    return NP.stack((cos_theta * S[..., 0] + sin_theta * S[..., 1],
+                     -sin_theta * S[..., 0] + cos_theta * S[..., 1],
+                     S[..., 2]),
+                    axis=-1)
+
+
+def gauss_newton(P, S, mask,
+                 earth_rotation=True,
+                 max_iterations=MAX_ITERATIONS,
+                 tolerance=TOLERANCE):
+    """
+    Solve for the receiver position and clock offset at each epoch
+    given the epoch by satellite arrays of pseudoranges *P* (in [m]),
+    satellite positions *S* (ECEF, in [m]), and boolean *mask* of
+    valid entries (see :func:`epoch_arrays`). Correct for the Earth
+    rotation during signal travel if *earth_rotation*. Return the
+    array (epoch by 4) of states (x, y, z, and clock, all in [m]),
+    the array of normal matrices, and the array of post-fit
+    residuals. Epochs with fewer than 4 satellites are NaN.
+    """
+    E = P.shape[0]
+    X = NP.zeros((E, 4))
+    solved = mask.sum(axis=1) >= 4
+    mask3 = mask[..., NP.newaxis]
+    # padded entries are given the first satellite position of the
+    # epoch so that ranges are never zero
+    S = NP.where(mask3, S, S[:, :1, :])
+    for i in range(max_iterations):
+        if earth_rotation:
+            d = S - X[:, NP.newaxis, :3]
+            tau = NP.sqrt(NP.einsum('eki,eki->ek', d, d)) / const.c
+            S_i = rotate_earth(S, tau)
+        else:
+            S_i = S
+        d = S_i - X[:, NP.newaxis, :3]
+        rho = NP.sqrt(NP.einsum('eki,eki->ek', d, d))
+        A = NP.concatenate((-d / rho[..., NP.newaxis],
+                            NP.ones(rho.shape + (1,))),
+                           axis=-1)
+        A = NP.where(mask3, A, 0)
+        r = NP.where(mask, P - rho - X[:, NP.newaxis, 3], 0)
+        N = NP.einsum('eki,ekj->eij', A, A)
+        b = NP.einsum('eki,ek->ei', A, r)
+        dX = NP.zeros_like(X)
+        dX[solved] = NP.linalg.solve(N[solved], b[solved][..., NP.newaxis])[..., 0]
+        X += dX
+        max_update = NP.abs(dX[:, :3]).max() if E > 0 else 0
+        logger.debug('iteration {}: max update={:.3e} [m]'.format(i, max_update))
+        if max_update < tolerance:
+            break
+    else:
+        logger.warning('Gauss-Newton iterations did not converge (max '
+                       'update={:.3e} [m])'.format(max_update))
+    r = NP.where(mask, r - NP.einsum('eki,ei->ek', A, dX), 0)
+    X[~solved] = NP.nan
+    return X, N, r
+
+
+def spp(obs_map,
+        sat_clock=None,
+        earth_rotation=True,
+        minimum_sats=MINIMUM_SATS,
+        max_iterations=MAX_ITERATIONS,
+        tolerance=TOLERANCE):
+    """
+    Compute the per epoch single point positioning solutions from
+    the ionosphere free pseudoranges and satellite positions found in
+    *obs_map*. If given, *sat_clock* is a function of satellite
+    identifier and time arrays (in [s] since the UNIX epoch)
+    returning the satellite clock corrections (in [s], NaN when
+    unknown, e.g., :meth:`SP3.sat_clock`). Without satellite clock
+    corrections, satellite clock errors remain in the solutions.
+    Epochs with fewer than *minimum_sats* are not solved. Return an
+    :class:`SPPSolution`.
+    """
+    sat, t, obs = obs_map.arrays()
+    P = iono_free(obs_map, sat, obs)
+    S = NP.column_stack((obs.satx, obs.saty, obs.satz))
+    if sat_clock is not None:
+        P += const.c * sat_clock(sat, t)
+    valid = NP.isfinite(P) & NP.all(NP.isfinite(S), axis=1) & NP.any(S != 0, axis=1)
+    epochs, mask, P, S = epoch_arrays(t[valid], P[valid], S[valid])
+    N_sats = mask.sum(axis=1)
+    mask[N_sats < minimum_sats] = False
+    X, N, r = gauss_newton(P,
+                           S,
+                           mask,
+                           earth_rotation=earth_rotation,
+                           max_iterations=max_iterations,
+                           tolerance=tolerance)
+    solved = NP.isfinite(X[:, 0])
+    pdop = NP.full(len(epochs), NP.nan)
+    pdop[solved] = NP.sqrt(NP.trace(NP.linalg.inv(N[solved])[:, :3, :3],
+                                    axis1=1,
+                                    axis2=2))
+    residual_rms = NP.full(len(epochs), NP.nan)
+    dof = N_sats[solved] - 4
+    with NP.errstate(divide='ignore', invalid='ignore'):
+        residual_rms[solved] = NP.sqrt(NP.sum(r[solved]**2, axis=1) / dof)
+    logger.info('solved {} of {} epochs'.format(NP.sum(solved), len(epochs)))
+    return SPPSolution(epochs,
+                       X[:, :3],
+                       X[:, 3],
+                       N_sats,
+                       pdop,
+                       residual_rms)
+
+
+def median_position(solution,
+                    max_pdop=MAX_PDOP,
+                    max_residual_rms=MAX_RESIDUAL_RMS):
+    """
+    Return the median receiver position (ECEF, in [m]) of the epoch
+    *solution* (see :func:`spp`) excluding epochs with PDOP greater
+    than *max_pdop* or residual RMS greater than
+    *max_residual_rms*. Raise :class:`RuntimeError` if no epoch
+    remains.
+    """
+    with NP.errstate(invalid='ignore'):
+        I = (solution.pdop <= max_pdop) & (solution.residual_rms <= max_residual_rms)
+    if not NP.any(I):
+        raise RuntimeError('no epoch solution passes screening '
+                           '(PDOP <= {}, residual RMS <= {} [m])'.format(max_pdop,
+                                                                         max_residual_rms))
+    logger.info('median of {} of {} epoch solutions'.format(NP.sum(I),
+                                                          len(solution.t)))
+    return NP.median(solution.xyz[I], axis=0)
+
+
+def receiver_position(obs_map, sat_clock=None, earth_rotation=True, **kwds):
+    """
+    Return the robust daily receiver position (ECEF, in [m]) estimated
+    from *obs_map* (see :func:`spp` and :func:`median_position`,
+    which receive *kwds*).
+    """
+    spp_kwds = {k: v for k, v in kwds.iteritems() if k not in ['max_pdop',
+                                                                'max_residual_rms']}
+    median_kwds = {k: v for k, v in kwds.iteritems() if k in ['max_pdop',
+                                                               'max_residual_rms']}
+    solution = spp(obs_map,
+                   sat_clock=sat_clock,
+                   earth_rotation=earth_rotation,
+                   **spp_kwds)
+    return median_position(solution, **median_kwds)
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    parser = ArgumentParser('Estimate the receiver position by single point positioning.',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('input_fname',
+                        type=str,
+                        help='RinDump output (see pyrsss.gps.rinex) or H5 file generated by pyrsss.gps.phase_edit')
+    parser.add_argument('--sp3',
+                        type=str,
+                        nargs='+',
+                        default=[],
+                        help='SP3 files providing satellite clock corrections (e.g., the previous, current, and next day)')
+    parser.add_argument('--no-earth-rotation',
+                        action='store_true',
+                        help='do not correct satellite positions for the Earth rotation during signal travel')
+    parser.add_argument('--max-pdop',
+                        type=float,
+                        default=MAX_PDOP,
+                        help='exclude epoch solutions with larger PDOP from the median')
+    parser.add_argument('--max-residual-rms',
+                        type=float,
+                        default=MAX_RESIDUAL_RMS,
+                        help='exclude epoch solutions with larger post-fit residual RMS [m] from the median')
+    args = parser.parse_args(argv[1:])
+
+    if os.path.splitext(args.input_fname)[1] == '.h5':
+        obs_map = ObsMap(args.input_fname)
+    else:
+        obs_map = read_rindump(args.input_fname)
+    sat_clock = read_sp3_window(args.sp3).sat_clock if args.sp3 else None
+
+    xyz = receiver_position(obs_map,
+                            sat_clock=sat_clock,
+                            earth_rotation=not args.no_earth_rotation,
+                            max_pdop=args.max_pdop,
+                            max_residual_rms=args.max_residual_rms)
+    print('XYZ [m]: {:.4f} {:.4f} {:.4f}'.format(*xyz))
+    if hasattr(obs_map, 'xyz'):
+        delta = xyz - NP.asarray(obs_map.xyz)
+        print('difference from recorded position [m]: '
+              '{:.4f} {:.4f} {:.4f} (|.|={:.4f})'.format(delta[0],
+                                                         delta[1],
+                                                         delta[2],
+                                                         NP.linalg.norm(delta)))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,107 @@
+from __future__ import division
+
+import logging
+from datetime import datetime, timedelta
+
+import numpy as NP
+import scipy.constants as const
+
+from ..util.date import UNIX_EPOCH
+from observation import ObsMap, Observation
+from constants import F_1, F_2
+from sp3 import SP3
+from spp import spp, receiver_position, rotate_earth
+
+
+RECEIVER_XYZ = NP.array([-2493304.0625, -4655215.5574, 3565497.3454])
+"""
+Known receiver position (ECEF, in [m]) of the synthetic observations.
+"""
+
+RECEIVER_CLOCK = 1.5e-4
+"""
+Known receiver clock offset (in [s]) of the synthetic observations.
+"""
+
+SAT_CLOCK = 200e-6
+"""
+Magnitude of the synthetic satellite clock offsets (in [s]).
+"""
+
+
+def synthetic_obs_map(N_epochs=20, N_sats=8, interval=30, seed=0):
+    """
+    Return the tuple :class:`ObsMap` and :class:`SP3` (providing the
+    satellite clocks) of *N_epochs* epochs (every *interval* [s]) of
+    *N_sats* satellites above the receiver at
+    :data:`RECEIVER_XYZ`. The P1 and P2 pseudoranges include the
+    receiver clock :data:`RECEIVER_CLOCK`, satellite clocks of
+    alternating sign and magnitude :data:`SAT_CLOCK` (with a small
+    drift), a dispersive ionospheric delay, and the Earth rotation
+    during signal travel (modeled as in
+    :func:`pyrsss.gnss.spp.gauss_newton`).
+    """
+    random_state = NP.random.RandomState(seed)
+    dt = [datetime(2014, 1, 1) + timedelta(seconds=interval * i) for i in range(N_epochs)]
+    t = NP.array([(x - UNIX_EPOCH).total_seconds() for x in dt])
+    sats = ['G{:02d}'.format(i + 1) for i in range(N_sats)]
+    # local east, north, up unit vectors at the receiver
+    up = RECEIVER_XYZ / NP.linalg.norm(RECEIVER_XYZ)
+    east = NP.cross([0, 0, 1], up)
+    east /= NP.linalg.norm(east)
+    north = NP.cross(up, east)
+    az = NP.linspace(0, 2 * NP.pi, N_sats, endpoint=False)
+    el = NP.radians(random_state.uniform(15, 85, N_sats))
+    sign = NP.where(NP.arange(N_sats) % 2 == 0, 1, -1)
+    clock = (sign * SAT_CLOCK)[NP.newaxis, :] + 1e-11 * (t - t[0])[:, NP.newaxis]
+    xyz = NP.empty((N_epochs, N_sats, 3))
+    obs_map = ObsMap()
+    for j, sat in enumerate(sats):
+        for i, dt_i in enumerate(dt):
+            # slow apparent motion across the sky
+            el_ij = el[j] + 1e-4 * i
+            los = (NP.cos(el_ij) * (NP.sin(az[j]) * east + NP.cos(az[j]) * north) +
+                   NP.sin(el_ij) * up)
+            S = RECEIVER_XYZ + 2.2e7 * los
+            xyz[i, j] = S
+            tau = NP.linalg.norm(S - RECEIVER_XYZ) / const.c
+            rho = NP.linalg.norm(rotate_earth(S, tau) - RECEIVER_XYZ)
+            P = rho + const.c * (RECEIVER_CLOCK - clock[i, j])
+            I1 = 5 + random_state.uniform(0, 10)
+            P1 = P + I1
+            P2 = P + I1 * (F_1 / F_2)**2
+            obs_map[sat][dt_i] = Observation(P1, P1, P2, 0., 0., 0., 0., S[0], S[1], S[2])
+    sp3 = SP3('d', 'GPS', 'IGS14', 'SYNT', dt, sats, xyz, clock)
+    return obs_map, sp3
+
+
+def test_spp_sat_clock():
+    """
+    Single point positioning with the satellite clock corrections
+    recovers the known receiver position and clock offset.
+    """
+    obs_map, sp3 = synthetic_obs_map()
+    solution = spp(obs_map, sat_clock=sp3.sat_clock)
+    assert NP.all(NP.isfinite(solution.xyz))
+    assert NP.max(NP.abs(solution.xyz - RECEIVER_XYZ)) < 1e-3
+    assert NP.max(NP.abs(solution.clock - const.c * RECEIVER_CLOCK)) < 1e-3
+    xyz = receiver_position(obs_map, sat_clock=sp3.sat_clock)
+    assert NP.linalg.norm(xyz - RECEIVER_XYZ) < 1e-3
+
+
+def test_spp_no_sat_clock():
+    """
+    Without the satellite clock corrections, the satellite clock
+    errors bias the position by far more than the positioning
+    accuracy.
+    """
+    obs_map, _ = synthetic_obs_map()
+    solution = spp(obs_map)
+    assert NP.all(NP.linalg.norm(solution.xyz - RECEIVER_XYZ, axis=1) > 1e3)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    test_spp_sat_clock()
+    test_spp_no_sat_clock()
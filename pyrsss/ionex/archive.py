@@ -0,0 +1,172 @@
+"""
+Continuous, multi-day access to a directory of daily IONEX files.
+"""
+
+import os
+import logging
+import datetime
+from collections import OrderedDict
+
+import numpy as np
+
+from read_ionex import IonexCube, IonexInterpolator, read_ionex, timestamps
+
+logger = logging.getLogger('pyrsss.ionex.archive')
+
+
+IONEX_TEMPLATE = '{center}{date:%j}0.{date:%y}i'
+"""
+Daily IONEX file name template (IGS convention, matched without regard
+to case).
+"""
+
+MAX_DAYS = 3
+"""
+Default number of parsed days held in memory by IonexArchive.
+"""
+
+
+class IonexArchive(object):
+    def __init__(self, path, center='jplg', template=IONEX_TEMPLATE, max_days=MAX_DAYS):
+        """
+        IonexArchive
+        The daily IONEX files of analysis center center (e.g., 'jplg'
+        or 'codg') found in the directory path (see IONEX_TEMPLATE)
+        presented as a single record with a continuous time axis. The
+        most recently used max_days parsed days are kept in memory
+        (least recently used days are discarded first).
+        """
+        self.path     = path
+        self.center   = center
+        self.template = template
+        self.max_days = max_days
+        self.days     = OrderedDict()
+        # CASE INSENSITIVE FILE NAME LOOKUP #
+        self.fnames   = dict([(fname.lower(), os.path.join(path, fname))
+                              for fname in os.listdir(path)])
+
+    def fname(self, date):
+        """
+        Returns the IONEX file for date or None if there is none.
+        """
+        return self.fnames.get(self.template.format(center=self.center,
+                                                    date=date).lower())
+
+    def day(self, date):
+        """
+        Returns the IonexCube (see read_ionex) of date or None if
+        there is no IONEX file for date.
+        """
+        if date in self.days:
+            cube = self.days.pop(date)
+        else:
+            fname = self.fname(date)
+            if fname is None:
+                logger.warning('no {} IONEX file for {:%Y-%m-%d} in {}'.format(self.center,
+                                                                            date,
+                                                                            self.path))
+                cube = None
+            else:
+                logger.info('reading {}'.format(fname))
+                cube = read_ionex(fname)
+        self.days[date] = cube
+        while len(self.days) > self.max_days:
+            self.days.popitem(last=False)
+        return cube
+
+    def cube(self, start, end):
+        """
+        Returns the IonexCube of the maps with epochs in [start, end]
+        (datetimes) stitched across days, including the nearest map
+        before start and after end (if any, read from the adjacent
+        days only when necessary) so that the entire span may be
+        interpolated. Boundary epochs present in two consecutive
+        files (24:00 of one day and 00:00 of the next) appear once
+        (the map from the later day is used). The biases and header
+        are those of the first day contributing maps. Returns None if
+        there are no maps.
+        """
+        dates = [start.date() + datetime.timedelta(days=i)
+                 for i in range((end.date() - start.date()).days + 1)]
+        cubes = [x for x in [self.day(date) for date in dates] if x is not None]
+        # ADJACENT DAYS ARE ONLY NEEDED FOR THE BRACKETING MAPS #
+        if not cubes or cubes[0].times[0] > start:
+            before = self.day(dates[0] - datetime.timedelta(days=1))
+            if before is not None:
+                cubes.insert(0, before)
+        if not cubes or cubes[-1].times[-1] < end:
+            after = self.day(dates[-1] + datetime.timedelta(days=1))
+            if after is not None:
+                cubes.append(after)
+        if not cubes:
+            return None
+
+        seconds = np.concatenate([timestamps(x.times) for x in cubes])
+        source  = np.concatenate([np.repeat(i, len(x.times)) for i, x in enumerate(cubes)])
+        index   = np.concatenate([np.arange(len(x.times)) for x in cubes])
+
+        # REMOVE DUPLICATED EPOCHS (KEEP THE LATER DAY) #
+        keep = np.ones(len(seconds), dtype=bool)
+        keep[:-1] = seconds[:-1] != seconds[1:]
+
+        # LIMIT TO [start, end] AND THE BRACKETING MAPS #
+        t1, t2 = timestamps([start, end])
+        I  = np.flatnonzero(keep)
+        i1 = max(np.searchsorted(seconds[I], t1, side='right') - 1, 0)
+        i2 = min(np.searchsorted(seconds[I], t2, side='left') + 1, len(I))
+        I  = I[i1:i2]
+        if len(I) == 0:
+            return None
+
+        for x in cubes[1:]:
+            if (not np.array_equal(x.lons, cubes[0].lons) or
+                not np.array_equal(x.lats, cubes[0].lats)):
+                raise ValueError('IONEX grids differ across days in {}'.format(self.path))
+
+        def stack(name):
+            if any(getattr(cubes[source[i]], name) is None for i in I):
+                return None
+            return np.array([getattr(cubes[source[i]], name)[index[i]] for i in I])
+
+        first = cubes[source[I[0]]]
+        return IonexCube(first.lons,
+                         first.lats,
+                         first.heights,
+                         [cubes[source[i]].times[index[i]] for i in I],
+                         stack('tec'),
+                         stack('rms'),
+                         stack('height'),
+                         first.satellite_biases,
+                         first.station_biases,
+                         first.header)
+
+    def interpolate(self, times, lats, lons, data='tec', method='linear', rotate=False):
+        """
+        Returns the 1D numpy array of the maps (data is 'tec' or 'rms')
+        interpolated at the points given by times (list of datetimes
+        or array of UNIX times in [s]), lats, and lons (see
+        IonexInterpolator for method and rotate). The points may span
+        any number of days: they are processed one day at a time (in
+        time order) so that each day file is parsed once when the
+        archive holds at least three days (see max_days). Points
+        outside the available maps are nan.
+        """
+        if len(times) and isinstance(times[0], datetime.datetime):
+            times = timestamps(times)
+        points = np.column_stack((np.asarray(times, dtype=np.float64),
+                                  np.asarray(lats, dtype=np.float64),
+                                  np.asarray(lons, dtype=np.float64)))
+        output = np.full(len(points), np.nan)
+
+        day_numbers = np.floor(points[:, 0] / 86400).astype(np.int64)
+        for day_number in np.unique(day_numbers):
+            I    = np.flatnonzero(day_numbers == day_number)
+            cube = self.cube(datetime.datetime.utcfromtimestamp(points[I, 0].min()),
+                             datetime.datetime.utcfromtimestamp(points[I, 0].max()))
+            if cube is None or len(cube.times) < 2 or getattr(cube, data) is None:
+                continue
+            output[I] = IonexInterpolator(cube,
+                                          data=data,
+                                          method=method,
+                                          rotate=rotate)(points[I])
+        return output
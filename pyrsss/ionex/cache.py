@@ -0,0 +1,355 @@
+"""
+Persistent binary cache of parsed IONEX files.
+
+The maps parsed from an IONEX file (see read_ionex.parse_maps) are
+stored as one .npy array per map type plus a small pickle of the
+header information, map ids, epochs, and biases. Map indices (see
+indexed.build_index) are stored as pickles. Parsed maps are keyed by
+the SHA1 hash of the IONEX file contents, so an entry is never used
+for a changed file. Map indices exist to avoid reading the whole
+file, so they are keyed by the path, size, and modification time of
+the file instead (see stat_key) and the SHA1 hash is only computed
+on a miss, to reuse the index of an unchanged file whose modification
+time changed. Entry names include the file name and a hash of the
+absolute path of the file (see path_key), so that files with the same
+name in different directories sharing a cache directory do not
+collide, and stale entries for the same file are removed when the new
+entry is written. Arrays are memory mapped on load.
+
+By default, entries are stored in the directory .ionex_cache next to
+the IONEX file (a sidecar). The environment variable
+PYRSSS_IONEX_CACHE overrides the location (a single directory for all
+entries) or, if set to "off", disables the cache.
+"""
+
+import os
+import re
+import sys
+import shutil
+import hashlib
+import logging
+import tempfile
+import cPickle
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+import numpy as np
+
+logger = logging.getLogger('pyrsss.ionex.cache')
+
+
+CACHE_ENV = 'PYRSSS_IONEX_CACHE'
+"""
+Environment variable overriding the cache location ("off" disables
+the cache).
+"""
+
+SIDECAR_DIRNAME = '.ionex_cache'
+"""
+Name of the cache directory created next to IONEX files (used when
+CACHE_ENV is not set).
+"""
+
+CACHE_VERSION = 4
+"""
+Version of the cache entry layout (part of the key so that entries
+written by a different layout are not used).
+"""
+
+META_FNAME = 'meta.pkl'
+"""
+File name of the pickled entry metadata.
+"""
+
+INDEX_EXT = '.idx'
+"""
+File name extension of cached map indices (see
+indexed.build_index).
+"""
+
+
+def file_hash(fname, block_size=2**20):
+    """
+    Return the SHA1 hex digest of the contents of *fname*.
+    """
+    sha1 = hashlib.sha1()
+    with open(fname, 'rb') as fid:
+        for block in iter(lambda: fid.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def stat_key(fname):
+    """
+    Return the SHA1 hex digest of the absolute path, size, and
+    modification time of *fname* (a key that changes with the file
+    but does not require reading it, see file_hash).
+    """
+    st = os.stat(fname)
+    return hashlib.sha1(repr((os.path.abspath(fname),
+                              st.st_size,
+                              st.st_mtime))).hexdigest()
+
+
+def path_key(fname):
+    """
+    Return the SHA1 hex digest of the absolute path of *fname* (which
+    identifies the cache entries of the file, see entry_path).
+    """
+    return hashlib.sha1(os.path.abspath(fname)).hexdigest()
+
+
+def cache_root(ionex_fname):
+    """
+    Return the cache directory used for *ionex_fname* or None if the
+    cache is disabled (see CACHE_ENV).
+    """
+    root = os.environ.get(CACHE_ENV)
+    if root is None:
+        return os.path.join(os.path.dirname(os.path.abspath(ionex_fname)),
+                            SIDECAR_DIRNAME)
+    elif root.lower() == 'off':
+        return None
+    return root
+
+
+def entry_path(root, ionex_fname, key):
+    """
+    Return the path to the cache entry for *ionex_fname* with
+    *key* (see file_hash and stat_key) in *root*.
+    """
+    return os.path.join(root, '{}.{}.{}.v{}'.format(os.path.basename(ionex_fname),
+                                                    path_key(ionex_fname),
+                                                    key,
+                                                    CACHE_VERSION))
+
+
+def entry_re(ionex_fname):
+    """
+    Return the compiled regular expression matching the names of the
+    cache entries for *ionex_fname* (the same name and absolute path,
+    see entry_path; groups: key, cache version, and INDEX_EXT for
+    indices).
+    """
+    return re.compile(re.escape(os.path.basename(ionex_fname)) +
+                      r'\.' + path_key(ionex_fname) +
+                      r'\.([0-9a-f]{40})\.v(\d+)(' + re.escape(INDEX_EXT) + ')?$')
+
+
+def remove_stale(root, ionex_fname, key, index=False):
+    """
+    Remove the cache entries for *ionex_fname* in *root* of the same
+    kind as the entry keyed by *key* (indices if *index*, parsed maps
+    otherwise) but with a different key. Remove all entries (of both
+    kinds) if *key* is None.
+    """
+    name_re = entry_re(ionex_fname)
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        m = name_re.match(name)
+        if m is None or m.group(1) == key:
+            continue
+        if m.group(3):
+            if key is not None and not index:
+                continue
+            logger.info('removing stale IONEX cache index {}'.format(path))
+            os.remove(path)
+        elif os.path.isfile(os.path.join(path, META_FNAME)):
+            if key is not None and index:
+                continue
+            logger.info('removing stale IONEX cache entry {}'.format(path))
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def store(path, header_info, maps, satellite_biases, station_biases):
+    """
+    Store the parsed IONEX contents (see read_ionex.parse_maps) to the
+    cache entry *path*. The entry is written to a temporary directory
+    and renamed so that a partial entry is never visible.
+    """
+    root = os.path.dirname(path)
+    temp_path = tempfile.mkdtemp(prefix='.tmp', dir=root)
+    try:
+        meta = {'header_info': header_info,
+                'satellite_biases': satellite_biases,
+                'station_biases': station_biases,
+                'maps': {}}
+        for map_type, type_maps in maps.iteritems():
+            map_ids = sorted(type_maps)
+            meta['maps'][map_type] = (map_ids,
+                                      [type_maps[x][0] for x in map_ids])
+            if map_ids:
+                np.save(os.path.join(temp_path, map_type + '.npy'),
+                        np.array([type_maps[x][1] for x in map_ids]))
+        with open(os.path.join(temp_path, META_FNAME), 'wb') as fid:
+            cPickle.dump(meta, fid, cPickle.HIGHEST_PROTOCOL)
+        try:
+            os.rename(temp_path, path)
+        except OSError:
+            # another process stored the same entry first
+            if not os.path.isdir(path):
+                raise
+            shutil.rmtree(temp_path, ignore_errors=True)
+    except:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        raise
+    return path
+
+
+def load(path):
+    """
+    Load the cache entry *path* and return the parsed IONEX contents
+    (see read_ionex.parse_maps). Map data blocks are read-only views
+    of memory mapped arrays.
+    """
+    with open(os.path.join(path, META_FNAME), 'rb') as fid:
+        meta = cPickle.load(fid)
+    maps = {}
+    for map_type, (map_ids, epochs) in meta['maps'].iteritems():
+        if map_ids:
+            blocks = np.load(os.path.join(path, map_type + '.npy'),
+                             mmap_mode='r')
+        else:
+            blocks = []
+        maps[map_type] = dict(zip(map_ids, zip(epochs, blocks)))
+    return (meta['header_info'],
+            maps,
+            meta['satellite_biases'],
+            meta['station_biases'])
+
+
+def cached_maps(ionex_fname, parse):
+    """
+    Return the parsed contents of *ionex_fname* (see
+    read_ionex.parse_maps) from the cache. On a miss, call
+    *parse*(*ionex_fname*), store the result, and remove stale
+    entries for the same file. If the cache is disabled or its
+    directory cannot be written, return the result of *parse*.
+    """
+    root = cache_root(ionex_fname)
+    if root is None:
+        return parse(ionex_fname)
+    key = file_hash(ionex_fname)
+    path = entry_path(root, ionex_fname, key)
+    if os.path.isfile(os.path.join(path, META_FNAME)):
+        logger.debug('loading {} from IONEX cache {}'.format(ionex_fname, path))
+        return load(path)
+    result = parse(ionex_fname)
+    try:
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        store(path, *result)
+        remove_stale(root, ionex_fname, key)
+        logger.debug('stored {} to IONEX cache {}'.format(ionex_fname, path))
+    except (IOError, OSError) as e:
+        logger.warning('could not store {} to IONEX cache {} '
+                       '({})'.format(ionex_fname, root, e))
+    return result
+
+
+def find_index(root, ionex_fname, content_key):
+    """
+    Return the index stored in *root* for *ionex_fname* whose file
+    contents had the SHA1 hash *content_key* (see cached_index) or
+    None if there is no such index.
+    """
+    name_re = entry_re(ionex_fname)
+    for name in os.listdir(root):
+        m = name_re.match(name)
+        if m is None or not m.group(3) or int(m.group(2)) != CACHE_VERSION:
+            continue
+        try:
+            with open(os.path.join(root, name), 'rb') as fid:
+                stored_key, index = cPickle.load(fid)
+        except Exception as e:
+            logger.warning('could not load IONEX cache index {} '
+                           '({})'.format(name, e))
+            continue
+        if stored_key == content_key:
+            return index
+    return None
+
+
+def cached_index(ionex_fname, build):
+    """
+    Return the map index of *ionex_fname* (see indexed.build_index)
+    from the cache. Indices are keyed by stat_key, i.e., found
+    without reading *ionex_fname*, and stored along with the SHA1
+    hash of the file contents. On a miss, the index of a file with the
+    same contents is reused (e.g., after the modification time
+    changed) or, failing that, *build*(*ionex_fname*) is called. The
+    (pickled) result is stored and stale indices for the same file
+    are removed. If the cache is disabled or its directory
+    cannot be written, return the result of *build*.
+    """
+    root = cache_root(ionex_fname)
+    if root is None:
+        return build(ionex_fname)
+    key = stat_key(ionex_fname)
+    path = entry_path(root, ionex_fname, key) + INDEX_EXT
+    if os.path.isfile(path):
+        with open(path, 'rb') as fid:
+            return cPickle.load(fid)[1]
+    content_key = file_hash(ionex_fname)
+    index = None
+    if os.path.isdir(root):
+        index = find_index(root, ionex_fname, content_key)
+    if index is None:
+        index = build(ionex_fname)
+    else:
+        logger.debug('reusing IONEX cache index of unchanged {}'.format(ionex_fname))
+    try:
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        fd, temp_fname = tempfile.mkstemp(prefix='.tmp', dir=root)
+        try:
+            with os.fdopen(fd, 'wb') as fid:
+                cPickle.dump((content_key, index), fid, cPickle.HIGHEST_PROTOCOL)
+            os.rename(temp_fname, path)
+        except:
+            os.remove(temp_fname)
+            raise
+        remove_stale(root, ionex_fname, key, index=True)
+        logger.debug('stored {} index to IONEX cache {}'.format(ionex_fname, path))
+    except (IOError, OSError) as e:
+        logger.warning('could not store {} index to IONEX cache {} '
+                       '({})'.format(ionex_fname, root, e))
+    return index
+
+
+def clear(ionex_fname):
+    """
+    Remove all cache entries for *ionex_fname*.
+    """
+    root = cache_root(ionex_fname)
+    if root is not None and os.path.isdir(root):
+        remove_stale(root, ionex_fname, None)
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    parser = ArgumentParser('Populate (or clear) the binary cache of parsed IONEX files.',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('ionex_fnames',
+                        type=str,
+                        nargs='+',
+                        metavar='ionex_fname',
+                        help='IONEX file')
+    parser.add_argument('--clear',
+                        action='store_true',
+                        help='remove the cache entries instead')
+    args = parser.parse_args(argv[1:])
+
+    from read_ionex import parse_maps
+
+    for ionex_fname in args.ionex_fnames:
+        if args.clear:
+            clear(ionex_fname)
+        else:
+            cached_maps(ionex_fname, parse_maps)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
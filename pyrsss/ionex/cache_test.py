@@ -0,0 +1,86 @@
+import os
+import shutil
+import logging
+import datetime
+import tempfile
+
+import numpy as np
+
+from read_ionex import IonexCube, parse_maps
+from write_ionex import write_ionex
+from indexed import build_index
+from cache import CACHE_ENV, cached_maps, cached_index
+
+
+def synthetic_cube(offset=0., n_times=3, interval=7200):
+    """
+    synthetic_cube
+    Returns an IonexCube of n_times global TEC maps (every interval
+    [s]) of the constant offset + 20 [TECU].
+    """
+    lats  = np.arange(87.5, -87.5 - 2.5, -2.5)
+    lons  = np.arange(-180, 180 + 5, 5.)
+    times = [datetime.datetime(2014, 1, 1) + datetime.timedelta(seconds=interval * i) for i in range(n_times)]
+    tec   = np.full((n_times, len(lats), len(lons)), 20 + offset)
+    return IonexCube(lons, lats, [450.], times, tec, None, None, {}, {}, {'exponent': -1})
+
+
+class Counter(object):
+    def __init__(self, f):
+        """
+        Counter
+        Wraps the function f and counts the calls.
+        """
+        self.f = f
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+        return self.f(*args)
+
+
+def test_shared_cache():
+    """
+    Files with the same name in two directories (e.g., rapid and
+    final archives) sharing a cache directory do not evict each
+    other's entries, while a changed file replaces its own.
+    """
+    path = tempfile.mkdtemp()
+    environ = os.environ.get(CACHE_ENV)
+    try:
+        os.environ[CACHE_ENV] = os.path.join(path, 'cache')
+        fnames = []
+        for i, archive in enumerate(['rapid', 'final']):
+            os.makedirs(os.path.join(path, archive))
+            fnames.append(write_ionex(os.path.join(path, archive, 'codg0010.14i'),
+                                      synthetic_cube(offset=i)))
+        parse = Counter(parse_maps)
+        build = Counter(build_index)
+        for _ in range(2):
+            for i, fname in enumerate(fnames):
+                _, maps, _, _ = cached_maps(fname, parse)
+                assert np.all(maps['TEC'][1][1] == 20 + i)
+                cached_index(fname, build)
+        assert parse.count == len(fnames)
+        assert build.count == len(fnames)
+        # A CHANGED FILE REPLACES ITS OWN ENTRIES ONLY #
+        write_ionex(fnames[0], synthetic_cube(offset=5.))
+        os.utime(fnames[0], (0, 0))
+        _, maps, _, _ = cached_maps(fnames[0], parse)
+        assert np.all(maps['TEC'][1][1] == 25)
+        cached_index(fnames[0], build)
+        assert len(os.listdir(os.environ[CACHE_ENV])) == 2 * len(fnames)
+        cached_maps(fnames[1], parse)
+        assert parse.count == len(fnames) + 1
+    finally:
+        if environ is None:
+            del os.environ[CACHE_ENV]
+        else:
+            os.environ[CACHE_ENV] = environ
+        shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    test_shared_cache()
@@ -0,0 +1,256 @@
+"""
+Indexed, lazily loaded access to the maps of an IONEX file.
+
+A first pass over the file records the header information and the
+byte offset, length, and epoch of every map (see build_index). The
+index is stored in the IONEX cache (see cache.cached_index). Maps are
+then read on demand by seeking to the recorded offsets, so that, e.g.,
+the two maps bracketing a single hour are parsed without touching the
+rest of the file (including the RMS maps).
+"""
+
+import logging
+from collections import namedtuple
+
+import numpy as np
+
+from read_ionex import (MAP_TYPES, read_header, grids, parse_epoch,
+                        parse_map_section, parse_block, timestamps)
+
+logger = logging.getLogger('pyrsss.ionex.indexed')
+
+
+class MapRecord(namedtuple('MapRecord',
+                           'map_id '
+                           'epoch '
+                           'offset '
+                           'length')):
+    """
+    MapRecord
+    Location of a map in an IONEX file: map_id, epoch (datetime or
+    None), and the byte offset and length of the map (from the START
+    OF ... MAP record up to and including the END OF ... MAP record).
+    """
+    pass
+
+
+def build_index(path_to_file):
+    """
+    build_index
+    Scans the IONEX file path_to_file and returns the index: a
+    dictionary with the header information (see read_header), the
+    satellite and station biases, and, keyed by map type (see
+    MAP_TYPES), the list of MapRecord in map_id order. Only the map
+    labels are inspected (the data lines are not converted).
+    """
+    with open(path_to_file, 'rb') as ionex_file:
+        header_info, satellite_biases, station_biases = read_header(ionex_file)
+        offset = ionex_file.tell()
+        data   = ionex_file.read()
+
+    maps  = dict([(map_type, []) for map_type in MAP_TYPES])
+    start = None
+    for line in data.splitlines(True):
+        label = line[60:80]
+        if 'START OF' in label and label.split()[2] in maps:
+            start    = offset
+            map_type = label.split()[2]
+            map_id   = int(line[0:60].split()[0])
+            epoch    = None
+        elif start is not None:
+            if 'EPOCH OF CURRENT MAP' in label:
+                epoch = parse_epoch(line[0:60])
+            elif 'END OF' in label:
+                maps[map_type].append(MapRecord(map_id,
+                                                epoch,
+                                                start,
+                                                offset + len(line) - start))
+                start = None
+        offset += len(line)
+
+    for records in maps.itervalues():
+        records.sort(key=lambda x: x.map_id)
+
+    return {'header_info': header_info,
+            'satellite_biases': satellite_biases,
+            'station_biases': station_biases,
+            'maps': maps}
+
+
+def read_index(path_to_file, cache=True):
+    """
+    read_index
+    Returns the index of the IONEX file path_to_file (see
+    build_index). If cache, the index is loaded from (or stored to)
+    the IONEX cache (see cache.cached_index).
+    """
+    if cache:
+        from cache import cached_index
+        return cached_index(path_to_file, build_index)
+    return build_index(path_to_file)
+
+
+class LazyMaps(object):
+    def __init__(self, ionex, map_type, records):
+        """
+        LazyMaps
+        The maps of type map_type of the IndexedIonex ionex (one
+        MapRecord per TEC map epoch, None for epochs without a map of
+        this type) presented as an array with the shape of the
+        corresponding IonexCube array, i.e., (n_times, n_lats,
+        n_lons) for 2D and (n_times, n_heights, n_lats, n_lons) for 3D
+        files. Indexing (basic or integer array indexing along time
+        followed by any indexing of the remaining axes) reads and
+        parses only the selected maps.
+        """
+        self.ionex    = ionex
+        self.map_type = map_type
+        self.records  = records
+
+    @property
+    def shape(self):
+        return (len(self.records),) + self.ionex.map_shape
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def dtype(self):
+        return np.dtype(np.float64)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __array__(self, dtype=None):
+        return np.asarray(self[:], dtype=dtype)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        time_key, map_key = key[0], key[1:]
+        index = np.arange(len(self.records))[time_key]
+        if index.ndim == 0:
+            return self.read(int(index))[map_key]
+        blocks = np.empty((len(index),) + self.ionex.map_shape)
+        for i, j in enumerate(index):
+            blocks[i] = self.read(j)
+        return blocks[(slice(None),) + map_key]
+
+    def read(self, i):
+        """
+        Reads and returns the map at time index i (all nan if there
+        is no map of this type at that epoch).
+        """
+        record = self.records[i]
+        if record is None:
+            return np.full(self.ionex.map_shape, np.nan)
+        block = self.ionex.read_block(record)
+        if self.ionex.map_dimension == 2:
+            # 2D MAPS: DROP THE HEIGHT AXIS #
+            block = block[0, :, :]
+        return block
+
+
+class IndexedIonex(object):
+    def __init__(self, path_to_file, cache=True):
+        """
+        IndexedIonex
+        Random access reader of the IONEX file path_to_file. The
+        attributes mirror IonexCube (see read_ionex.read_ionex) but
+        tec, rms, and height are LazyMaps (rms and height are None if
+        not present in the file), i.e., maps are only read when
+        indexed. If cache, the map index is loaded from (or stored
+        to) the IONEX cache.
+        """
+        self.path_to_file = path_to_file
+        index = read_index(path_to_file, cache=cache)
+
+        self.header           = index['header_info']
+        self.satellite_biases = index['satellite_biases']
+        self.station_biases   = index['station_biases']
+        self.lons, self.lats, self.heights = grids(self.header)
+        self.map_dimension    = self.header.get('map_dimension', 2)
+        if self.map_dimension == 2:
+            self.map_shape = (len(self.lats), len(self.lons))
+        else:
+            self.map_shape = (len(self.heights), len(self.lats), len(self.lons))
+        self.line_count = int(np.ceil(len(self.lons)/16.))
+
+        tec_records = index['maps']['TEC']
+        self.times  = [x.epoch for x in tec_records]
+
+        def lazy_maps(map_type):
+            if len(index['maps'][map_type]) == 0:
+                return None
+            by_id = dict([(x.map_id, x) for x in index['maps'][map_type]])
+            return LazyMaps(self,
+                            map_type,
+                            [by_id.get(x.map_id) for x in tec_records])
+
+        self.tec    = lazy_maps('TEC')
+        self.rms    = lazy_maps('RMS')
+        self.height = lazy_maps('HEIGHT')
+
+    def read_block(self, record):
+        """
+        Reads, parses, and returns the data block (with shape
+        (n_heights, n_lats, n_lons)) of the map at MapRecord record.
+        """
+        with open(self.path_to_file, 'rb') as ionex_file:
+            ionex_file.seek(record.offset)
+            content = ionex_file.read(record.length)
+        # BLANK LINES ARE IGNORED (SEE next_line) #
+        lines = [line for line in content.splitlines() if line.strip()]
+        _, exponent, data_lines, _ = parse_map_section(lines,
+                                                       1,
+                                                       self.header['exponent'],
+                                                       self.line_count)
+        return parse_block(data_lines,
+                           len(self.lons),
+                           len(self.lats),
+                           len(self.heights),
+                           exponent)
+
+    def time_slice(self, start=None, end=None):
+        """
+        Returns the slice of the time indices with epochs in [start,
+        end] (datetimes, None for no limit).
+        """
+        seconds = timestamps(self.times)
+        i1 = 0 if start is None else np.searchsorted(seconds, timestamps([start])[0], side='left')
+        i2 = len(seconds) if end is None else np.searchsorted(seconds, timestamps([end])[0], side='right')
+        return slice(i1, i2)
+
+    def window(self, start=None, end=None, lat_range=None, lon_range=None, map_type='TEC'):
+        """
+        Reads the maps of map_type with epochs in [start, end] and
+        returns the 4-tuple of the epochs, latitudes, longitudes, and
+        array of maps restricted to the latitudes in lat_range and
+        longitudes in lon_range (2-tuples of inclusive limits in
+        [deg], None for no limit). Only the maps within the time
+        window are read.
+        """
+        maps = getattr(self, map_type.lower())
+        if maps is None:
+            raise ValueError('{} maps are not present in {}'.format(map_type,
+                                                                   self.path_to_file))
+        time_slice = self.time_slice(start, end)
+        lats       = np.asarray(self.lats, dtype=np.float64)
+        lons       = np.asarray(self.lons, dtype=np.float64)
+        lat_index  = np.arange(len(lats))
+        lon_index  = np.arange(len(lons))
+        if lat_range is not None:
+            lat_index = lat_index[(lats >= min(lat_range)) & (lats <= max(lat_range))]
+        if lon_range is not None:
+            lon_index = lon_index[(lons >= min(lon_range)) & (lons <= max(lon_range))]
+        # CONTIGUOUS WINDOWS OF A REGULAR GRID: SLICES (VIEWS) #
+        lat_slice = slice(lat_index[0], lat_index[-1] + 1) if len(lat_index) else slice(0, 0)
+        lon_slice = slice(lon_index[0], lon_index[-1] + 1) if len(lon_index) else slice(0, 0)
+        spatial_key = (lat_slice, lon_slice)
+        if self.map_dimension != 2:
+            spatial_key = (slice(None),) + spatial_key
+        return (self.times[time_slice],
+                lats[lat_slice],
+                lons[lon_slice],
+                maps[(time_slice,) + spatial_key])
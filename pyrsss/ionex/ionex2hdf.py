@@ -0,0 +1,464 @@
+"""
+Consolidated HDF5 archive of many (e.g., years of) daily IONEX files.
+
+The TEC and RMS maps of the ingested files are stored in two
+extendable, compressed arrays with shape (n_times, n_lats, n_lons) of
+integer counts of 10**exponent (the IONEX representation, which
+compresses far better than floating point values, with 9999 for
+missing values) and the map epochs (UNIX times in [s]) in a third. The arrays are
+chunked in blocks of CHUNK_SHAPE (times, lats, lons) so that both a
+map at an epoch and the time series at a pixel are read from a modest
+number of chunks. The ingested files (name, SHA1 hash of the contents,
+and epoch range) and their satellite and station DCBs are stored in
+tables, so that bias time series are available as well.
+
+Ingesting is incremental and idempotent: files already ingested (by
+content) are skipped and only epochs not yet stored are added (the
+boundary epoch present in two consecutive daily files is taken from
+the later file, as in archive.IonexArchive). A revised file for a
+stored day (e.g., a final product replacing a rapid one) replaces the
+maps of the day. Epochs after the end of
+the archive are appended. The maps are appended before the epochs, so
+an interrupted append is detected and rolled back when the archive is
+next opened for appending. Epochs before the end of the archive
+(e.g., a missing day ingested later) are inserted in time order, which
+rewrites the maps after the insertion point. An interrupted insert
+cannot be rolled back and is reported when the archive is next
+opened.
+"""
+
+import os
+import re
+import sys
+import logging
+import datetime
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+import numpy as np
+from tables import (open_file, Filters, IsDescription, StringCol,
+                    Int32Col, Float64Col, Float64Atom, Int32Atom, which_lib_version)
+
+from read_ionex import (MISSING_VALUE, IonexCube, read_header, read_ionex,
+                        grids, timestamps)
+from cache import file_hash
+
+logger = logging.getLogger('pyrsss.ionex.ionex2hdf')
+
+
+CHUNK_SHAPE = (64, 16, 16)
+"""
+Chunk shape (times, lats, lons) of the map arrays (a 64 kB chunk
+holds 64 epochs, 5.3 days of 2 hour maps, of a 16 by 16 pixel tile).
+"""
+
+FILTERS = Filters(complevel=5,
+                  complib='blosc' if which_lib_version('blosc') else 'zlib',
+                  shuffle=True)
+"""
+Compression used for the map arrays and tables.
+"""
+
+IONEX_FNAME_RE = re.compile(r'.*\.\d\di$', re.IGNORECASE)
+"""
+Pattern of the IONEX file names ingested from directories.
+"""
+
+
+class IngestedFile(IsDescription):
+    fname   = StringCol(64)
+    sha1    = StringCol(40)
+    first   = Float64Col()
+    last    = Float64Col()
+    n_maps  = Int32Col()
+
+
+class SatelliteBias(IsDescription):
+    file_id = Int32Col()
+    epoch   = Float64Col()
+    system  = StringCol(8)
+    prn     = Int32Col()
+    bias    = Float64Col()
+    rms     = Float64Col()
+
+
+class StationBias(IsDescription):
+    file_id = Int32Col()
+    epoch   = Float64Col()
+    system  = StringCol(8)
+    station = StringCol(4)
+    domes   = StringCol(9)
+    bias    = Float64Col()
+    rms     = Float64Col()
+
+
+def ionex_fnames(paths):
+    """
+    ionex_fnames
+    Returns the list of IONEX files given by paths (files or
+    directories, which are searched, not recursively, for names
+    matching IONEX_FNAME_RE) sorted by the epoch of the first map.
+    """
+    fnames = []
+    for path in paths:
+        if os.path.isdir(path):
+            fnames.extend([os.path.join(path, x) for x in sorted(os.listdir(path))
+                           if IONEX_FNAME_RE.match(x) and os.path.isfile(os.path.join(path, x))])
+        else:
+            fnames.append(path)
+
+    def first_epoch(fname):
+        with open(fname, 'rb') as ionex_file:
+            return read_header(ionex_file)[0]['start_epoch']
+
+    return sorted(fnames, key=first_epoch)
+
+
+def create_archive(h5file, cube):
+    """
+    create_archive
+    Creates the arrays and tables of an empty archive in the open
+    h5file for the grids of the IonexCube cube.
+    """
+    n_lats = len(cube.lats)
+    n_lons = len(cube.lons)
+    chunkshape = (CHUNK_SHAPE[0], min(CHUNK_SHAPE[1], n_lats), min(CHUNK_SHAPE[2], n_lons))
+    for name, title in [('tec', 'TEC maps [TECU]'), ('rms', 'RMS maps [TECU]')]:
+        h5file.create_earray('/',
+                             name,
+                             Int32Atom(dflt=MISSING_VALUE),
+                             (0, n_lats, n_lons),
+                             title,
+                             filters=FILTERS,
+                             chunkshape=chunkshape)
+    h5file.create_earray('/',
+                         'times',
+                         Float64Atom(),
+                         (0,),
+                         'map epochs [s since the UNIX epoch]',
+                         filters=FILTERS)
+    h5file.create_table('/', 'ingested', IngestedFile, 'ingested IONEX files', filters=FILTERS)
+    h5file.create_table('/', 'satellite_biases', SatelliteBias, 'satellite DCBs [ns]', filters=FILTERS)
+    h5file.create_table('/', 'station_biases', StationBias, 'station DCBs [ns]', filters=FILTERS)
+    attrs = h5file.root._v_attrs
+    attrs.lats   = np.asarray(cube.lats, dtype=np.float64)
+    attrs.lons   = np.asarray(cube.lons, dtype=np.float64)
+    attrs.header = cube.header
+    attrs.exponent = cube.header.get('exponent', -1)
+
+
+def to_counts(maps, exponent, fname):
+    """
+    to_counts
+    Returns the int32 array of the counts of 10**exponent of the
+    array maps (MISSING_VALUE for nan). Values that are not multiples
+    of 10**exponent (e.g., maps with a finer map specific exponent in
+    the IONEX file fname) are rounded (with a warning).
+    """
+    missing = np.isnan(maps)
+    maps    = np.where(missing, 0, maps)
+    counts  = np.rint(maps / 10.**exponent)
+    if (counts * 10.**exponent != maps).any():
+        logger.warning('values of {} rounded to the archive precision of 10**{}'.format(fname, exponent))
+    counts[missing] = MISSING_VALUE
+    return counts.astype(np.int32)
+
+
+def from_counts(counts, exponent):
+    """
+    from_counts
+    Returns the float array of the counts of 10**exponent counts (nan
+    for MISSING_VALUE), computed as in read_ionex.parse_block.
+    """
+    maps = counts * 10.**exponent
+    maps[counts == MISSING_VALUE] = np.nan
+    return maps
+
+
+def roll_back(h5file):
+    """
+    roll_back
+    Truncates the map arrays of the open h5file to the number of
+    stored epochs (i.e., removes the maps of an interrupted ingest).
+    """
+    n_times = len(h5file.root.times)
+    for maps in [h5file.root.tec, h5file.root.rms]:
+        if len(maps) > n_times:
+            logger.warning('removing {} maps of an interrupted ingest from {}'.format(len(maps) - n_times,
+                                                                                     maps._v_pathname))
+            maps.truncate(n_times)
+
+
+def check_insert(h5file):
+    """
+    check_insert
+    Raises a RuntimeError if an insert (see insert_maps) into the
+    open h5file was interrupted.
+    """
+    attrs = h5file.root._v_attrs
+    if 'inserting' in attrs._f_list():
+        raise RuntimeError('{} was interrupted while inserting the maps of {} --- '
+                           'the archive must be rebuilt'.format(h5file.filename, attrs.inserting))
+
+
+def insert_maps(h5file, positions, seconds, tec, rms, fname, block_size=16 * CHUNK_SHAPE[0]):
+    """
+    insert_maps
+    Inserts the maps tec and rms (arrays of counts) with epochs
+    seconds (increasing and not stored) into the open archive h5file
+    before the stored epochs at indices positions (see
+    numpy.searchsorted). The stored maps after the first insertion
+    point are moved in blocks of block_size epochs (starting from the
+    end) and the maps of the insertion window are rewritten. The
+    inserted file fname is recorded in the archive attributes for the
+    duration (see check_insert).
+    """
+    root  = h5file.root
+    attrs = root._v_attrs
+    N     = len(root.times)
+    n     = len(seconds)
+    i0    = positions[0]
+    i1    = positions[-1]
+    logger.info('inserting {} maps of {} (rewriting {} stored maps)'.format(n, fname, N - i0))
+    attrs.inserting = os.path.basename(fname)
+    h5file.flush()
+    for maps, new_maps in [(root.tec, tec), (root.rms, rms)]:
+        maps.append(np.full((n,) + maps.shape[1:], MISSING_VALUE, dtype=np.int32))
+        # MOVE THE STORED MAPS AFTER i1 BY n (BACKWARD, SO THAT #
+        # SOURCE BLOCKS ARE READ BEFORE THEY ARE OVERWRITTEN) #
+        for stop in range(N, i1, -block_size):
+            start = max(stop - block_size, i1)
+            maps[start + n:stop + n] = maps[start:stop]
+        # MERGE THE INSERTION WINDOW #
+        maps[i0:i1 + n] = np.insert(maps[i0:i1], positions - i0, new_maps, axis=0)
+    times = np.insert(root.times[i0:], positions - i0, seconds)
+    root.times.append(seconds)
+    root.times[i0:] = times
+    del attrs.inserting
+    h5file.flush()
+
+
+def append_cube(h5file, cube, fname, sha1):
+    """
+    append_cube
+    Adds the maps of the IonexCube cube (read from fname with contents
+    hash sha1) with epochs not in the open archive h5file (appended
+    after the last stored epoch or inserted in time order, see
+    insert_maps) and records the file and its biases. A stored map
+    at the first epoch of cube is replaced (the boundary epoch shared
+    with the file of the previous day belongs to the later file, see
+    archive.IonexArchive). A revision of an ingested file (same first
+    epoch, different contents) replaces all the stored maps it covers
+    (but the first epoch of the next file), so that its maps and
+    biases are consistent. Returns the number of new epochs.
+    """
+    root = h5file.root
+    if (not np.array_equal(np.asarray(cube.lats, dtype=np.float64), root._v_attrs.lats) or
+        not np.array_equal(np.asarray(cube.lons, dtype=np.float64), root._v_attrs.lons)):
+        raise ValueError('IONEX grid of {} differs from the archive grid'.format(fname))
+    if cube.tec.ndim != 3:
+        raise ValueError('only 2D IONEX files are supported ({} is 3D)'.format(fname))
+
+    seconds  = timestamps(cube.times)
+    exponent = root._v_attrs.exponent
+    tec      = to_counts(cube.tec, exponent, fname)
+    rms      = to_counts(cube.rms if cube.rms is not None else np.full(cube.tec.shape, np.nan),
+                         exponent,
+                         fname)
+    stored    = root.times.read()
+    positions = np.searchsorted(stored, seconds)
+    exists    = np.zeros(len(seconds), dtype=bool)
+    inside    = positions < len(stored)
+    exists[inside] = stored[positions[inside]] == seconds[inside]
+
+    # THE BOUNDARY EPOCH: THE LATER FILE WINS #
+    replace = np.zeros(len(seconds), dtype=bool)
+    replace[:1] = exists[:1]
+    firsts = root.ingested.col('first')
+    if len(seconds) and (firsts == seconds[0]).any():
+        # A REVISION OF AN INGESTED FILE (E.G., A FINAL PRODUCT #
+        # REPLACING A RAPID ONE) REPLACES EVERY STORED MAP IT COVERS #
+        # BUT THE FIRST EPOCH OF THE NEXT FILE #
+        logger.info('{} revises an ingested file --- replacing the stored maps'.format(fname))
+        replace = exists.copy()
+        if len(seconds) > 1 and (firsts == seconds[-1]).any():
+            replace[-1] = False
+    for i in np.flatnonzero(replace):
+        root.tec[positions[i]] = tec[i]
+        root.rms[positions[i]] = rms[i]
+    # (THE LAST EPOCH IS EXPECTED TO BE STORED WHEN FILLING A GAP) #
+    if (exists[1:-1] & ~replace[1:-1]).any():
+        logger.warning('{} of the maps of {} are already in the archive --- '
+                       'keeping the stored maps'.format((exists[1:-1] & ~replace[1:-1]).sum(), fname))
+    I = np.flatnonzero(~exists)
+    if len(I) and positions[I[0]] < len(stored):
+        insert_maps(h5file, positions[I], seconds[I], tec[I], rms[I], fname)
+    elif len(I):
+        root.tec.append(tec[I])
+        root.rms.append(rms[I])
+        # EPOCHS LAST: AN INTERRUPTED INGEST IS ROLLED BACK #
+        root.times.append(seconds[I])
+
+    file_id = root.ingested.nrows
+    row     = root.ingested.row
+    row['fname']  = os.path.basename(fname)
+    row['sha1']   = sha1
+    row['first']  = seconds[0] if len(seconds) else np.nan
+    row['last']   = seconds[-1] if len(seconds) else np.nan
+    row['n_maps'] = len(I)
+    row.append()
+
+    epoch = seconds[0] if len(seconds) else np.nan
+    row   = root.satellite_biases.row
+    for system, biases in sorted((cube.satellite_biases or {}).iteritems()):
+        for prn, (bias, bias_rms) in sorted(biases.iteritems()):
+            row['file_id'] = file_id
+            row['epoch']   = epoch
+            row['system']  = system
+            row['prn']     = prn
+            row['bias']    = bias
+            row['rms']     = bias_rms
+            row.append()
+    row = root.station_biases.row
+    for system, biases in sorted((cube.station_biases or {}).iteritems()):
+        for station, (bias, bias_rms, domes) in sorted(biases.iteritems()):
+            row['file_id'] = file_id
+            row['epoch']   = epoch
+            row['system']  = system
+            row['station'] = station
+            row['domes']   = domes or ''
+            row['bias']    = bias
+            row['rms']     = bias_rms
+            row.append()
+    h5file.flush()
+    return len(I)
+
+
+def ionex2hdf(h5_fname, paths):
+    """
+    ionex2hdf
+    Ingests the IONEX files given by paths (see ionex_fnames) into the
+    HDF5 archive h5_fname (created if it does not exist). Files
+    already in the archive (same contents) are skipped. Returns the
+    number of new epochs.
+    """
+    count = 0
+    with open_file(h5_fname, mode='a', title='IONEX archive') as h5file:
+        if 'times' in h5file.root:
+            check_insert(h5file)
+            roll_back(h5file)
+            ingested = set(h5file.root.ingested.col('sha1'))
+        else:
+            ingested = set()
+        for fname in ionex_fnames(paths):
+            sha1 = file_hash(fname)
+            if sha1 in ingested:
+                logger.debug('skipping {} (already ingested)'.format(fname))
+                continue
+            logger.info('ingesting {}'.format(fname))
+            cube = read_ionex(fname)
+            if 'times' not in h5file.root:
+                create_archive(h5file, cube)
+            count += append_cube(h5file, cube, fname, sha1)
+            ingested.add(sha1)
+    return count
+
+
+def read_hdf(h5_fname, start=None, end=None, lat_range=None, lon_range=None):
+    """
+    read_hdf
+    Reads the maps with epochs in [start, end] (datetimes, None for no
+    limit) of the HDF5 archive h5_fname and returns them as an
+    IonexCube (see read_ionex.read_ionex) restricted to the
+    latitudes in lat_range and longitudes in lon_range (2-tuples of
+    inclusive limits in [deg], None for no limit). Only the chunks
+    overlapping the selection are read (e.g., the time series at a
+    pixel is read with lat_range and lon_range set to the pixel). The
+    biases are those of the file of the first selected map. RMS
+    values are nan for files without RMS maps.
+    """
+    with open_file(h5_fname, mode='r') as h5file:
+        root    = h5file.root
+        seconds = root.times.read()
+        i1 = 0 if start is None else np.searchsorted(seconds, timestamps([start])[0], side='left')
+        i2 = len(seconds) if end is None else np.searchsorted(seconds, timestamps([end])[0], side='right')
+
+        lats = root._v_attrs.lats
+        lons = root._v_attrs.lons
+        def window(grid, limits):
+            if limits is None:
+                return slice(0, len(grid))
+            I = np.flatnonzero((grid >= min(limits)) & (grid <= max(limits)))
+            return slice(I[0], I[-1] + 1) if len(I) else slice(0, 0)
+        lat_slice = window(lats, lat_range)
+        lon_slice = window(lons, lon_range)
+
+        exponent = root._v_attrs.exponent
+        tec = from_counts(root.tec[i1:i2, lat_slice, lon_slice], exponent)
+        rms = from_counts(root.rms[i1:i2, lat_slice, lon_slice], exponent)
+
+        satellite_biases = {'GPS': {}, 'GLONASS': {}}
+        station_biases   = {'GPS': {}, 'GLONASS': {}}
+        if i2 > i1:
+            ingested = root.ingested.read()
+            # THE FILE OF THE FIRST SELECTED MAP (THE LATER FILE AT A #
+            # BOUNDARY EPOCH, WHICHEVER WAS INGESTED FIRST) #
+            file_ids = np.flatnonzero((ingested['first'] <= seconds[i1]) & (ingested['last'] >= seconds[i1]))
+            if len(file_ids):
+                selected = file_ids[::-1][np.argmax(ingested['first'][file_ids][::-1])]
+                condvars = {'selected': int(selected)}
+                for row in root.satellite_biases.where('file_id == selected', condvars=condvars):
+                    satellite_biases.setdefault(row['system'], {})[row['prn']] = (row['bias'], row['rms'])
+                for row in root.station_biases.where('file_id == selected', condvars=condvars):
+                    station_biases.setdefault(row['system'], {})[row['station']] = (row['bias'],
+                                                                                    row['rms'],
+                                                                                    row['domes'] or None)
+        header = root._v_attrs.header
+        _, _, heights = grids(header)
+        return IonexCube(lons[lon_slice],
+                         lats[lat_slice],
+                         heights,
+                         [datetime.datetime.utcfromtimestamp(x) for x in seconds[i1:i2]],
+                         tec,
+                         rms,
+                         None,
+                         satellite_biases,
+                         station_biases,
+                         header)
+
+
+def read_biases(h5_fname):
+    """
+    read_biases
+    Returns the 2-tuple of the record arrays of the satellite and
+    station DCBs of every ingested file of the HDF5 archive h5_fname
+    (see SatelliteBias and StationBias; epoch is the first map epoch
+    of the file).
+    """
+    with open_file(h5_fname, mode='r') as h5file:
+        return (h5file.root.satellite_biases.read(),
+                h5file.root.station_biases.read())
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    parser = ArgumentParser('Ingest IONEX files into a consolidated, chunked HDF5 archive (repeated runs only add new files).',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('h5_fname',
+                        type=str,
+                        help='HDF5 archive (created if it does not exist)')
+    parser.add_argument('paths',
+                        type=str,
+                        nargs='+',
+                        metavar='path',
+                        help='IONEX file or directory of IONEX files')
+    args = parser.parse_args(argv[1:])
+
+    count = ionex2hdf(args.h5_fname, args.paths)
+    logger.info('appended {} epochs to {}'.format(count, args.h5_fname))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
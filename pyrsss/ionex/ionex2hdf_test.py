@@ -0,0 +1,68 @@
+import os
+import shutil
+import logging
+import datetime
+import tempfile
+
+import numpy as np
+
+from read_ionex import IonexCube, read_ionex
+from write_ionex import write_ionex
+from ionex2hdf import ionex2hdf, read_hdf
+
+
+def synthetic_day(day, offset=0., bias=0., n_times=13, interval=7200, seed=0):
+    """
+    synthetic_day
+    Returns an IonexCube of the n_times global TEC and RMS maps (every
+    interval [s], from 2014-01-01 plus day days) of a random field
+    (on the 0.1 TECU grid of the default IONEX exponent) plus offset
+    [TECU] and GPS satellite DCBs of bias [ns].
+    """
+    rs    = np.random.RandomState(seed + day)
+    lats  = np.arange(87.5, -87.5 - 2.5, -2.5)
+    lons  = np.arange(-180, 180 + 5, 5.)
+    start = datetime.datetime(2014, 1, 1) + datetime.timedelta(days=day)
+    times = [start + datetime.timedelta(seconds=interval * i) for i in range(n_times)]
+    tec   = np.round((20 + offset + 10 * rs.rand(n_times, len(lats), len(lons))) * 10) / 10
+    rms   = np.round(0.1 * tec * 10) / 10
+    satellite_biases = {'GPS': {prn: (bias + 0.1 * prn, 0.01) for prn in range(1, 4)}}
+    return IonexCube(lons, lats, [450.], times, tec, rms, None, satellite_biases, {}, {'exponent': -1})
+
+
+def test_revised_day():
+    """
+    Re-ingesting a revised file of a stored day replaces all of its
+    maps (but the first epoch of the next day) and its biases, with
+    the same result as ingesting the revised file in the first place.
+    """
+    path = tempfile.mkdtemp()
+    try:
+        rapid = write_ionex(os.path.join(path, 'corg0010.14i'), synthetic_day(0))
+        final = write_ionex(os.path.join(path, 'codg0010.14i'), synthetic_day(0, offset=5., bias=1., seed=10))
+        next_day = write_ionex(os.path.join(path, 'codg0020.14i'), synthetic_day(1))
+        revised_h5_fname = os.path.join(path, 'revised.h5')
+        ionex2hdf(revised_h5_fname, [rapid, next_day])
+        assert ionex2hdf(revised_h5_fname, [final]) == 0
+        reference_h5_fname = os.path.join(path, 'reference.h5')
+        ionex2hdf(reference_h5_fname, [final, next_day])
+        revised   = read_hdf(revised_h5_fname)
+        reference = read_hdf(reference_h5_fname)
+        assert revised.times == reference.times
+        assert np.array_equal(revised.tec, reference.tec)
+        assert np.array_equal(revised.rms, reference.rms)
+        final_cube = read_ionex(final)
+        day = read_hdf(revised_h5_fname, end=final_cube.times[-2])
+        assert np.array_equal(day.tec, final_cube.tec[:-1])
+        assert day.satellite_biases['GPS'] == final_cube.satellite_biases['GPS']
+        # THE BOUNDARY EPOCH STAYS WITH THE NEXT DAY #
+        boundary = read_hdf(revised_h5_fname, start=final_cube.times[-1], end=final_cube.times[-1])
+        assert np.array_equal(boundary.tec[0], read_ionex(next_day).tec[0])
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    test_revised_day()
@@ -0,0 +1,300 @@
+"""
+Vectorized point queries of IONEX maps: VTEC and RMS at arbitrary
+(time, lat, lon) points.
+
+Maps are interpolated linearly in time between the two maps bracketing
+each query time (the nearest map for nearest neighbor queries) and in
+space on the regular IONEX grid with nearest neighbor, bilinear, or
+bicubic (Keys cubic convolution) interpolation. Optionally, the maps
+are rotated in longitude to account for the Earth rotation between the
+map epochs and the query time (Sun-fixed interpolation, see Schaer et
+al., IONEX Version 1, 1998). All points are processed with array
+operations (gathers of the interpolation stencils from padded maps).
+"""
+
+import datetime
+from collections import namedtuple
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from read_ionex import EARTH_ROTATION_RATE, read_ionex, decreasing, timestamps
+
+
+METHODS = ['nearest', 'bilinear', 'bicubic']
+"""
+Supported spatial interpolation methods.
+"""
+
+KEYS_A = -0.5
+"""
+Free parameter of the Keys cubic convolution kernel (-0.5 gives third
+order convergence, see Keys, Cubic convolution interpolation for
+digital image processing, 1981).
+"""
+
+STENCIL_SIZES = {'nearest': 1, 'bilinear': 2, 'bicubic': 4}
+"""
+Number of samples along each spatial axis used by each method.
+"""
+
+CHUNK_SIZE = 2**18
+"""
+Number of query points evaluated at once by IonexQuery.
+"""
+
+
+class QueryResult(namedtuple('QueryResult',
+                             'tec '
+                             'rms')):
+    """
+    QueryResult
+    The interpolated VTEC and RMS arrays of a query (rms is None if
+    the IONEX file does not include RMS maps).
+    """
+    pass
+
+
+def keys_weights(s):
+    """
+    keys_weights
+    Returns the (N, 4) numpy array of the Keys cubic convolution
+    weights of the samples at offsets -1, 0, 1, and 2 for the
+    fractional positions s (in [0, 1]).
+    """
+    a  = KEYS_A
+    s2 = s * s
+    s3 = s2 * s
+    return np.column_stack((a * (s3 - 2 * s2 + s),
+                            (a + 2) * s3 - (a + 3) * s2 + 1,
+                            -(a + 2) * s3 + (2 * a + 3) * s2 - a * s,
+                            a * (s2 - s3)))
+
+
+def pad(maps, axis, periodic):
+    """
+    pad
+    Returns maps extended by one sample on each end of axis. If
+    periodic, the first and last samples are assumed to coincide
+    (e.g., -180 and 180 deg longitude) and the neighbors across the
+    period are copied. Otherwise, the samples are extrapolated with
+    the Keys boundary condition (which preserves the third order
+    accuracy of the bicubic interpolation up to the boundary).
+    """
+    maps = np.moveaxis(maps, axis, -1)
+    if periodic:
+        first = maps[..., -2]
+        last  = maps[..., 1]
+    else:
+        first = 3 * maps[..., 0] - 3 * maps[..., 1] + maps[..., 2]
+        last  = 3 * maps[..., -1] - 3 * maps[..., -2] + maps[..., -3]
+    padded = np.concatenate((first[..., np.newaxis], maps, last[..., np.newaxis]), axis=-1)
+    return np.moveaxis(padded, -1, axis)
+
+
+class IonexQuery(object):
+    def __init__(self, cube, method='bilinear', rotate=False):
+        """
+        IonexQuery
+        Point query interface to the TEC and RMS maps of the
+        IonexCube cube (see read_ionex.read_ionex; for 3D files, the
+        first height is used). method is one of METHODS. The result
+        is nan outside the time and latitude range of the maps (and
+        the longitude range unless the grid spans 360 degrees, in
+        which case longitudes are wrapped) and wherever the
+        interpolated value depends on a missing sample. If rotate,
+        map i is evaluated at lon + (t - T_i) * EARTH_ROTATION_RATE
+        (see read_ionex.IonexInterpolator).
+        """
+        if method not in METHODS:
+            raise ValueError('unknown method {} (choices are {})'.format(method, METHODS))
+        if len(cube.lats) < 3 or len(cube.lons) < 3:
+            raise ValueError('at least 3 latitudes and longitudes are required')
+        self.method = method
+        self.rotate = rotate
+        self.times  = timestamps(cube.times)
+        lats        = np.asarray(cube.lats, dtype=np.float64)
+        lons        = np.asarray(cube.lons, dtype=np.float64)
+        flip_lats   = decreasing(lats)
+        flip_lons   = decreasing(lons)
+        if flip_lats:
+            lats = lats[::-1]
+        if flip_lons:
+            lons = lons[::-1]
+        self.lat0, self.dlat, self.n_lats = lats[0], lats[1] - lats[0], len(lats)
+        self.lon0, self.dlon, self.n_lons = lons[0], lons[1] - lons[0], len(lons)
+        self.global_lons = lons[-1] - lons[0] >= 360
+
+        k = STENCIL_SIZES[method]
+        def windows(maps):
+            # (k, k) STENCIL WINDOWS OF THE FLATTENED PADDED MAPS: A #
+            # STENCIL IS GATHERED WITH THE INDEX OF ITS FIRST SAMPLE #
+            maps = np.ascontiguousarray(maps.ravel())
+            row  = self.n_lons + 2
+            return as_strided(maps,
+                              shape=(len(maps) - (k - 1) * (row + 1), k, k),
+                              strides=(maps.itemsize, row * maps.itemsize, maps.itemsize))
+
+        self.maps = {}
+        for map_type in ['tec', 'rms']:
+            maps = getattr(cube, map_type)
+            if maps is None:
+                continue
+            maps = np.asarray(maps, dtype=np.float64)
+            if maps.ndim == 4:
+                # 3D MAPS: USE THE FIRST HEIGHT #
+                maps = maps[:, 0, :, :]
+            if flip_lats:
+                maps = maps[:, ::-1, :]
+            if flip_lons:
+                maps = maps[:, :, ::-1]
+            missing = np.isnan(maps)
+            self.maps[map_type] = (windows(self.pad(np.where(missing, 0, maps))),
+                                   windows(self.pad_missing(missing.astype(np.float64))) if missing.any() else None)
+
+    def pad(self, maps):
+        """
+        Returns the (n_times, n_lats, n_lons) array maps padded with
+        one sample on each side of both spatial axes (see pad).
+        """
+        return pad(pad(maps, 1, False), 2, self.global_lons)
+
+    def pad_missing(self, missing):
+        """
+        Returns the missing sample indicator array missing padded as
+        with pad (extrapolated samples are missing if any of the
+        three samples they depend on is missing).
+        """
+        missing = self.pad(missing)
+        if not self.global_lons:
+            missing[:, :, 0]  = missing[:, :, 1:4].max(axis=2)
+            missing[:, :, -1] = missing[:, :, -4:-1].max(axis=2)
+        missing[:, 0, :]  = missing[:, 1:4, :].max(axis=1)
+        missing[:, -1, :] = missing[:, -4:-1, :].max(axis=1)
+        return missing
+
+    def stencil(self, u, n):
+        """
+        Returns the 2-tuple of the indices (into the padded axis) of
+        the first samples and the (N, k) array of the weights of the
+        k consecutive samples used to interpolate at the fractional
+        grid indices u of an axis with n samples.
+        """
+        i = np.clip(np.floor(u), 0, n - 2).astype(np.int64)
+        s = u - i
+        if self.method == 'nearest':
+            # TIES GO TO THE LOWER SAMPLE (AS IN RegularGridInterpolator) #
+            return i + (s > 0.5) + 1, np.ones((len(u), 1))
+        elif self.method == 'bilinear':
+            return i + 1, np.column_stack((1 - s, s))
+        return i, keys_weights(s)
+
+    def sample(self, k, i_lat, lons):
+        """
+        Returns the 3-tuple of the flat indices of the first stencil
+        samples, the lon stencil weights, and the validity of the
+        spatial interpolation at lat index i_lat (see stencil) and lons
+        of maps k.
+        """
+        if self.global_lons:
+            lons = self.lon0 + np.mod(lons - self.lon0, 360)
+        u     = (lons - self.lon0) / self.dlon
+        valid = (u >= 0) & (u <= self.n_lons - 1)
+        i_lon, w_lon = self.stencil(u, self.n_lons)
+        flat = (k * (self.n_lats + 2) + i_lat) * (self.n_lons + 2) + i_lon
+        return flat, w_lon, valid
+
+    def evaluate(self, t, lats, lons):
+        """
+        Returns the 2-tuple of the TEC and RMS (None if not present)
+        interpolated at the 1D arrays t (UNIX times in [s]), lats, and
+        lons.
+        """
+        n  = len(self.times)
+        i  = np.clip(np.searchsorted(self.times, t, side='right') - 1, 0, max(n - 2, 0))
+        j  = np.minimum(i + 1, n - 1)
+        dt = self.times[j] - self.times[i]
+        w  = np.where(dt > 0, (t - self.times[i]) / np.where(dt > 0, dt, 1), 0)
+        if self.method == 'nearest':
+            terms = [(np.where(w > 0.5, j, i), None)]
+        else:
+            terms = [(i, 1 - w), (j, w)]
+
+        u     = (lats - self.lat0) / self.dlat
+        valid = (t >= self.times[0]) & (t <= self.times[-1]) & (u >= 0) & (u <= self.n_lats - 1)
+        i_lat, w_lat = self.stencil(u, self.n_lats)
+
+        samples = []
+        for k, w_k in terms:
+            if self.rotate or not samples:
+                lons_k = lons + (t - self.times[k]) * EARTH_ROTATION_RATE if self.rotate else lons
+                flat, w_lon, valid_k = self.sample(k, i_lat, lons_k)
+                valid &= valid_k
+            else:
+                # SAME SPATIAL STENCIL, NEXT MAP #
+                flat = flat + (k - terms[0][0]) * (self.n_lats + 2) * (self.n_lons + 2)
+            samples.append((flat, w_lon, w_k))
+
+        def contract(windows, flat, w_lat, w_lon):
+            # SEPARABLE WEIGHTS: LON THEN LAT #
+            return np.einsum('ni,ni->n',
+                             np.einsum('nij,nj->ni', np.take(windows, flat, axis=0), w_lon),
+                             w_lat)
+
+        output = []
+        for map_type in ['tec', 'rms']:
+            if map_type not in self.maps:
+                output.append(None)
+                continue
+            data, missing = self.maps[map_type]
+            values        = np.zeros(len(t))
+            missing_total = np.zeros(len(t))
+            for flat, w_lon, w_k in samples:
+                v = contract(data, flat, w_lat, w_lon)
+                values += v if w_k is None else w_k * v
+                if missing is not None:
+                    m = contract(missing, flat, np.abs(w_lat), np.abs(w_lon))
+                    missing_total += m if w_k is None else np.abs(w_k) * m
+            values[~valid | (missing_total > 0)] = np.nan
+            output.append(values)
+        return output
+
+    def __call__(self, times, lats, lons):
+        """
+        Returns the QueryResult of the TEC and RMS maps interpolated at
+        times (list of datetimes or array of UNIX times in [s]), lats,
+        and lons (in [deg]). Arguments are broadcast and the arrays of
+        the result have the broadcast shape.
+        """
+        if len(np.shape(times)) and len(times) and isinstance(times[0], datetime.datetime):
+            times = timestamps(times)
+        t, lats, lons = np.broadcast_arrays(np.asarray(times, dtype=np.float64),
+                                            np.asarray(lats, dtype=np.float64),
+                                            np.asarray(lons, dtype=np.float64))
+        shape = t.shape
+        t, lats, lons = [np.ravel(x) for x in [t, lats, lons]]
+        tec = np.empty(len(t))
+        rms = np.empty(len(t)) if 'rms' in self.maps else None
+        for i in range(0, len(t), CHUNK_SIZE):
+            chunk = slice(i, i + CHUNK_SIZE)
+            tec_i, rms_i = self.evaluate(t[chunk], lats[chunk], lons[chunk])
+            tec[chunk] = tec_i
+            if rms is not None:
+                rms[chunk] = rms_i
+        return QueryResult(tec.reshape(shape),
+                           rms.reshape(shape) if rms is not None else None)
+
+
+def query(ionex, times, lats, lons, method='bilinear', rotate=False):
+    """
+    query
+    Returns the QueryResult of the VTEC and RMS of ionex (an IonexCube
+    or the path to an IONEX file) interpolated at times (list of
+    datetimes or array of UNIX times in [s]), lats, and lons (in
+    [deg]). Arguments are broadcast. See IonexQuery for method and
+    rotate. Use an IonexQuery directly to query the same maps
+    repeatedly.
+    """
+    if isinstance(ionex, basestring):
+        ionex = read_ionex(ionex)
+    return IonexQuery(ionex, method=method, rotate=rotate)(times, lats, lons)
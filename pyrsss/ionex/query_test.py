@@ -0,0 +1,199 @@
+import os
+import shutil
+import logging
+import datetime
+import tempfile
+
+import numpy as np
+
+from read_ionex import (IonexCube, IonexInterpolator, read_ionex, timestamps,
+                        interpolate2D_spatial, interpolate2D_temporal,
+                        interpolate2D_spatiotemporal)
+from write_ionex import write_ionex
+from query import IonexQuery
+
+
+TOLERANCE = 1e-9
+"""
+Maximum absolute difference (in [TECU]) between IonexQuery and the
+interpolate2D_* results.
+"""
+
+
+def synthetic_cube(n_times=13, interval=7200, seed=0):
+    """
+    synthetic_cube
+    Returns an IonexCube of n_times global TEC and RMS maps (every
+    interval [s]) of a smooth field plus noise (on the 0.1 TECU grid
+    of the default IONEX exponent) with one missing TEC sample.
+    """
+    rs    = np.random.RandomState(seed)
+    lats  = np.arange(87.5, -87.5 - 2.5, -2.5)
+    lons  = np.arange(-180, 180 + 5, 5.)
+    times = [datetime.datetime(2014, 1, 1) + datetime.timedelta(seconds=interval * i) for i in range(n_times)]
+    LATS, LONS = np.meshgrid(lats, lons, indexing='ij')
+    tec = np.array([20 + 10 * np.cos(np.radians(LATS)) * np.cos(np.radians(LONS + 15 * i)) + rs.rand(*LATS.shape)
+                    for i in range(n_times)])
+    # SAMPLES AT -180 AND 180 DEG COINCIDE #
+    tec[:, :, -1] = tec[:, :, 0]
+    tec = np.round(tec * 10) / 10
+    rms = np.round(0.1 * tec * 10) / 10
+    tec[n_times // 2, len(lats) // 2, len(lons) // 2] = np.nan
+    return IonexCube(lons, lats, [450.], times, tec, rms, None, {}, {}, {'exponent': -1})
+
+
+def query_points(cube, n_times=17, seed=1):
+    """
+    query_points
+    Returns the 3-tuple of the temporal grid (datetimes, away from the
+    map epochs) and the spatial grid (longitudes, including values
+    outside of [-180, 180], and latitudes) used to compare the
+    interpolators.
+    """
+    rs = np.random.RandomState(seed)
+    T  = timestamps(cube.times)
+    seconds = np.sort(rs.uniform(T[0], T[-1], n_times))
+    temporal_grid = [datetime.datetime.utcfromtimestamp(x) for x in seconds]
+    lons = np.sort(rs.uniform(-270, 270, 31))
+    lats = np.sort(rs.uniform(-87.5, 87.5, 19))
+    return temporal_grid, lons, lats
+
+
+def grid_query(q, temporal_grid, spatial_grid):
+    """
+    grid_query
+    Returns the QueryResult of the IonexQuery q on the grid spanned by
+    temporal_grid and spatial_grid with arrays of shape (n_lons,
+    n_lats, n_times) (as returned by the interpolate2D_* functions).
+    """
+    lons, lats = spatial_grid
+    T, LATS, LONS = np.meshgrid(timestamps(temporal_grid), lats, lons, indexing='ij')
+    result = q(T, LATS, LONS)
+    return [None if x is None else x.transpose(2, 1, 0) for x in result]
+
+
+def assert_same(a, b):
+    """
+    assert_same
+    Asserts the arrays a and b are missing (nan) at the same points
+    and otherwise agree to within TOLERANCE.
+    """
+    assert a.shape == b.shape
+    assert np.array_equal(np.isnan(a), np.isnan(b))
+    assert np.nanmax(np.abs(a - b)) < TOLERANCE
+
+
+class Fixture(object):
+    def __init__(self):
+        """
+        Fixture
+        A temporary directory with the synthetic IONEX file (see
+        synthetic_cube), removed on exit.
+        """
+        self.path = tempfile.mkdtemp()
+        self.fname = write_ionex(os.path.join(self.path, 'synt0010.14i'), synthetic_cube())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def test_spatial():
+    """
+    Bilinear and nearest neighbor queries at the map epochs agree with
+    interpolate2D_spatial (including wrapped longitudes).
+    """
+    with Fixture() as fixture:
+        cube = read_ionex(fixture.fname)
+        _, lons, lats = query_points(cube)
+        for method, spatial_method in [('bilinear', 'linear'), ('nearest', 'nearest')]:
+            time_grid, tec, rms, _, _ = interpolate2D_spatial(fixture.fname, (lons, lats), method=spatial_method)
+            q_tec, q_rms = grid_query(IonexQuery(cube, method=method), time_grid, (lons, lats))
+            assert_same(q_tec, tec)
+            assert_same(q_rms, rms)
+
+
+def test_temporal():
+    """
+    Bilinear and nearest neighbor queries at the map nodes agree with
+    linear and nearest interpolate2D_temporal.
+    """
+    with Fixture() as fixture:
+        cube = read_ionex(fixture.fname)
+        temporal_grid, _, _ = query_points(cube)
+        for method, temporal_method in [('bilinear', 'linear'), ('nearest', 'nearest')]:
+            _, _, tec, rms, _, _ = interpolate2D_temporal(fixture.fname, temporal_grid, method=temporal_method)
+            q_tec, q_rms = grid_query(IonexQuery(cube, method=method), temporal_grid, (cube.lons, cube.lats))
+            assert_same(q_tec, tec)
+            assert_same(q_rms, rms)
+
+
+def test_spatiotemporal():
+    """
+    Bilinear queries agree with linear interpolate2D_spatiotemporal,
+    with and without rotation.
+    """
+    with Fixture() as fixture:
+        cube = read_ionex(fixture.fname)
+        temporal_grid, lons, lats = query_points(cube)
+        for rotate in [False, True]:
+            tec, rms, _, _ = interpolate2D_spatiotemporal(fixture.fname,
+                                                          temporal_grid,
+                                                          (lons, lats),
+                                                          rotate=rotate)
+            q = IonexQuery(cube, method='bilinear', rotate=rotate)
+            q_tec, q_rms = grid_query(q, temporal_grid, (lons, lats))
+            assert_same(q_tec, tec)
+            assert_same(q_rms, rms)
+
+
+def test_wrap():
+    """
+    On a global grid, IonexInterpolator and IonexQuery results do not
+    change when the query longitudes are shifted by 360 deg.
+    """
+    cube = synthetic_cube()
+    temporal_grid, lons, lats = query_points(cube)
+    T, LATS, LONS = np.meshgrid(timestamps(temporal_grid), lats, lons, indexing='ij')
+    points = np.column_stack((T.ravel(), LATS.ravel(), LONS.ravel()))
+    for rotate in [False, True]:
+        interpolator = IonexInterpolator(cube, rotate=rotate)
+        values = interpolator(points)
+        assert np.isfinite(values).sum() > 0.9 * len(values)
+        for shift in [-360, 360]:
+            assert_same(interpolator(points + [0, 0, shift]), values)
+        q = IonexQuery(cube, method='bicubic', rotate=rotate)
+        assert_same(q(T, LATS, LONS + 360).tec, q(T, LATS, LONS).tec)
+
+
+def test_bicubic():
+    """
+    Bicubic queries reproduce the map samples at the nodes and
+    quadratic fields exactly.
+    """
+    cube = synthetic_cube()
+    T = timestamps(cube.times)
+    LATS, LONS = np.meshgrid(cube.lats, cube.lons, indexing='ij')
+    q = IonexQuery(cube, method='bicubic')
+    for i in [0, len(T) // 2, len(T) - 1]:
+        assert_same(q(T[i], LATS, LONS).tec, cube.tec[i])
+    f = lambda lat, lon: 3 + 0.01 * lat**2 - 0.002 * lon**2 + 0.005 * lat * lon + 0.1 * lon
+    quadratic = cube._replace(tec=np.array([f(LATS, LONS)] * len(T)), rms=None)
+    rs  = np.random.RandomState(2)
+    lat = rs.uniform(-85, 85, 1000)
+    lon = rs.uniform(-175, 175, 1000)
+    result = IonexQuery(quadratic, method='bicubic')(rs.uniform(T[0], T[-1], 1000), lat, lon)
+    assert result.rms is None
+    assert np.max(np.abs(result.tec - f(lat, lon))) < 1e-9
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    test_spatial()
+    test_temporal()
+    test_spatiotemporal()
+    test_wrap()
+    test_bicubic()
@@ -24,6 +24,8 @@ Published on February 25, 1998.
 
 import numpy as np
 import datetime
+import calendar
+from collections import namedtuple
 
 def next_line(ionex_file):
     """
@@ -52,143 +54,6 @@ def read_misc_line(ionex_file):
 
     return label, content
 
-def read_lon_slice(ionex_file, n_lons):
-    """
-    read_lon_slice
-    Reads in a single lon slice of data (for a particular epoch, lat, height)
-    as a 1D numpy array filled with the data (TEC/RMS/HEIGHT)
-    """
-    # 16 ENTRIES MAX PER LINE, I5 FORMAT #
-    line_count = int(np.ceil(n_lons/16.))
-    data       = []
-
-    for i in range(0, line_count):
-        remaining = 16
-        if i == line_count - 1:
-            # LAST LINE: CHECK IF THE LINE IS FULL OR NOT #
-            remaining = n_lons % 16
-            if remaining == 0:
-                remaining = 16
-
-        line = next_line(ionex_file)
-        pos  = 0
-        for j in range(0, remaining):
-            try:
-                val = int(line[pos:pos+5])
-                if val == 9999:
-                    val = np.nan
-                data.append(val)
-            except Exception as e:
-                print(e)
-                raise
-            pos = pos + 5
-
-    return np.array(data)
-
-def read_lonlat_block(ionex_file, n_lons, n_lats):
-    """
-    read_lonlat_block
-    Reads in a set of n_lat lon slices and returns the data
-    as a 2D numpy array filled with the data (TEC/RMS/HEIGHT)
-    """
-    data = np.zeros([n_lons, n_lats])
-    for i in range(0, n_lats):
-        label, content = read_misc_line(ionex_file)
-        if 'LAT/LON1/LON2/DLON/H' in label:
-           # CONTENT: 2X, 5F6.1, 28X
-            try:
-                # Not sure if this data is needed (seems redundant), but it is available here.
-                lat  = float(content[2:8])
-                lon1 = float(content[8:14])
-                lon2 = float(content[14:20])
-                dlon = float(content[20:26])
-                h    = float(content[26:32])
-            except Exception as e:
-                print(e)
-                raise
-
-            # READ IN THIS PARTICULAR LON SLICE #
-            lon_slice = read_lon_slice(ionex_file, n_lons)
-            data[:,i] = lon_slice
-
-        else:
-            raise Exception("read_lonlat_block encountered an unexpected line:\n %s" % content)
-
-    return data
-
-def read_block_header(ionex_file, exponent):
-    """
-    read_block_header
-    Reads the lines that precede each data block.
-    Sometimes, a new exponent may be specified for
-    a data block, so there needs to be a check here
-    for that. It is unclear from the specification
-    whether a newly defined exponent is intended to
-    apply to data from subsequent maps. Here, the
-    assumption is made that exponent redefinitions
-    are local only to the map they are defined in.
-    The function returns the epoch and exponent.
-    If no epoch was present, None is returned in its
-    place. If no exponent was present, the exponent
-    defined in the header is returned or the default
-    exponent (-1) is returned if one was not defined
-    in the header.
-    """
-    epoch        = None
-    new_exponent = exponent
-
-    done = False
-    while not done:
-        before = ionex_file.tell()
-        label, content = read_misc_line(ionex_file)
-        if 'LAT/LON1/LON2/DLON/H' in label:
-            # END OF BLOCK HEADER, BACK UP ONE LINE #
-            # (this is because read_lonlat_block expects this line) #
-            ionex_file.seek(before)
-            return epoch, new_exponent
-        elif 'EXPONENT' in label:
-            try:
-                new_exponent = int(content[0:6])
-            except Exception as e:
-                print(e)
-                raise
-        elif 'EPOCH OF CURRENT MAP':
-            try:
-                year    = int(content[0:6])
-                month   = int(content[6:12])
-                day     = int(content[12:18])
-                hour    = int(content[18:24])
-                minute  = int(content[24:30])
-                sec     = int(content[30:36])
-
-                epoch = datetime.datetime(year, month, day, \
-                                                hour, minute, sec)
-
-            except Exception as e:
-                print(e)
-                raise
-
-def read_map(ionex_file, n_lons, n_lats, n_heights, exponent):
-    """
-    read_map
-    Reads in an entire map (TEC/RMS/HEIGHT) over
-    longitude, latitude, and height. The epoch and 
-    data is returned as a datetime and 3D numpy array
-    (respectively) in the form of a 3-tuple. The numpy
-    array has shape (n_lats, n_lons, n_heights). If there
-    was no epoch listed, None is returned in place of
-    the epoch.
-    """
-
-    epoch, exponent = read_block_header(ionex_file, exponent)
-
-    # FOR EACH HEIGHT, READ IN A BLOCK OF LAT, LON DATA #
-    tec_block = np.zeros([n_lons, n_lats, n_heights])
-    for k in range(0, n_heights):
-        tec_block[:,:,k] = read_lonlat_block(ionex_file, n_lons, n_lats)*10**(exponent)
-
-    return epoch, tec_block
-
 def read_header(ionex_file):
     """
     Header lines are first read in as 2-tuples.
@@ -311,6 +176,22 @@ def read_header(ionex_file):
             except Exception as e:
                 print(e)
                 raise
+        elif 'BASE RADIUS' in label:
+            try:
+                header_info['base_radius'] = float(content[0:8])
+            except Exception as e:
+                print(e)
+                raise
+        elif 'MAPPING FUNCTION' in label:
+            header_info['mapping_function'] = content[2:6].strip()
+        elif 'ELEVATION CUTOFF' in label:
+            try:
+                header_info['elevation_cutoff'] = float(content[0:8])
+            except Exception as e:
+                print(e)
+                raise
+        elif 'OBSERVABLES USED' in label:
+            header_info['observables_used'] = content.strip()
         elif 'EXPONENT' in label:
             try:
                 exponent = int(content[0:6])
@@ -375,6 +256,278 @@ def read_header(ionex_file):
 
     return header_info, satellite_biases, station_biases
 
+MAP_TYPES = ['TEC', 'RMS', 'HEIGHT']
+"""
+The types of maps (data blocks) found in IONEX files.
+"""
+
+MISSING_VALUE = 9999
+"""
+Data value (prior to exponent scaling) flagging a missing value.
+"""
+
+
+class IonexCube(namedtuple('IonexCube',
+                           'lons '
+                           'lats '
+                           'heights '
+                           'times '
+                           'tec '
+                           'rms '
+                           'height '
+                           'satellite_biases '
+                           'station_biases '
+                           'header')):
+    """
+    IonexCube
+    The contents of an IONEX file with the maps stacked in time order
+    (of the TEC map ids). lons, lats, and heights are the grids,
+    times is the list of TEC map epochs (datetimes), and tec is the
+    array of TEC maps with shape (n_times, n_lats, n_lons) for 2D
+    files and (n_times, n_heights, n_lats, n_lons) for 3D files (i.e.,
+    latitude and longitude are always the last two axes). rms and
+    height are the RMS and height maps with the same shape (None if
+    not present in the file). Missing values are nan. The bias
+    dictionaries are as described in parser and header is the
+    dictionary of header information returned by read_header.
+    """
+    pass
+
+
+def grids(header_info):
+    """
+    grids
+    Returns the longitude, latitude, and height grids described by
+    header_info (see read_header) as a 3-tuple.
+    """
+    starting_ht  = header_info['height1']
+    stopping_ht  = header_info['height2']
+    dh           = header_info['dh']
+    starting_lat = header_info['lat1']
+    stopping_lat = header_info['lat2']
+    dlat         = header_info['dlat']
+    starting_lon = header_info['lon1']
+    stopping_lon = header_info['lon2']
+    dlon         = header_info['dlon']
+
+    if dh == 0:
+        n_heights = 1
+    else:
+        n_heights = int((stopping_ht - starting_ht)/dh) + 1
+
+    if dlat == 0:
+        n_lats = 1
+    else:
+        n_lats = int((stopping_lat - starting_lat)/dlat) + 1
+
+    if dlon == 0:
+        n_lons = 1
+    else:
+        n_lons = int((stopping_lon - starting_lon)/dlon) + 1
+
+    if n_lons > 1:
+        lons = np.arange(starting_lon, stopping_lon + dlon, dlon)
+    else:
+        lons = np.array([starting_lon])
+
+    if n_lats > 1:
+        lats = np.arange(starting_lat, stopping_lat + dlat, dlat)
+    else:
+        lats = [starting_lat]
+
+    if n_heights > 1:
+        heights = np.arange(starting_ht, stopping_ht + dh, dh)
+    else:
+        heights = [starting_ht]
+
+    return lons, lats, heights
+
+def parse_epoch(content):
+    """
+    parse_epoch
+    Returns the datetime found in the (6I6) epoch fields of content.
+    """
+    year    = int(content[0:6])
+    month   = int(content[6:12])
+    day     = int(content[12:18])
+    hour    = int(content[18:24])
+    minute  = int(content[24:30])
+    sec     = int(content[30:36])
+
+    return datetime.datetime(year, month, day, hour, minute, sec)
+
+def parse_i5(fields):
+    """
+    parse_i5
+    Converts the numpy array of I5 fields (dtype S5) to an int64
+    array. Right justified integers (the I5 format) are decoded with
+    arithmetic on the characters of all fields at once. If any field
+    is not of that form, the conversion falls back to int() for each
+    field (which raises for invalid fields).
+    """
+    chars     = np.ascontiguousarray(fields).view(np.uint8).reshape(fields.shape + (5,))
+    digits    = chars.astype(np.int64) - ord('0')
+    is_digit  = (digits >= 0) & (digits <= 9)
+    is_minus  = chars == ord('-')
+    is_other  = ~is_digit & ~is_minus & (chars != ord(' '))
+    # AFTER THE FIRST DIGIT, ONLY DIGITS MAY FOLLOW (RIGHT JUSTIFIED) #
+    gap       = np.logical_or.accumulate(is_digit, axis=-1) & ~is_digit
+    if is_other.any() or gap.any() or not is_digit[..., -1].all():
+        return fields.astype(np.int64)
+    values = np.dot(np.where(is_digit, digits, 0), 10**np.arange(4, -1, -1))
+    return np.where(is_minus.any(axis=-1), -values, values)
+
+def parse_block(data_lines, n_lons, n_lats, n_heights, exponent):
+    """
+    parse_block
+    Converts the data lines of an entire map (the lon slices for each
+    height and lat, in file order) to a 3D numpy array with shape
+    (n_heights, n_lats, n_lons). The I5 fields of all lines are
+    converted at once and the exponent scaling is applied to the whole
+    block. Missing values (9999) are nan.
+    """
+    # 16 ENTRIES MAX PER LINE, I5 FORMAT #
+    line_count = int(np.ceil(n_lons/16.))
+    if len(data_lines) != n_heights * n_lats * line_count:
+        raise Exception("parse_block expected %d data lines but found %d" %
+                        (n_heights * n_lats * line_count, len(data_lines)))
+    # LINES ARE PADDED TO 80 COLUMNS, i.e., 16 FIELDS #
+    fields = np.array(data_lines, dtype='S80').view('S5')
+    fields = fields.reshape(n_heights, n_lats, line_count * 16)[:, :, :n_lons]
+    values = parse_i5(fields)
+    block  = values * 10.**exponent
+    block[values == MISSING_VALUE] = np.nan
+    return block
+
+def parse_map_section(lines, i, exponent, line_count):
+    """
+    parse_map_section
+    Collects the map starting at lines[i] (the line following the
+    START OF ... MAP record, blank lines removed) up to the END OF ...
+    MAP record, where line_count is the number of data lines per lon
+    slice. Returns the 4-tuple of the map epoch (None if not given),
+    exponent (a map local EXPONENT record overrides the given
+    exponent), the data lines (see parse_block), and the index of the
+    END OF ... MAP line.
+    """
+    # MAP HEADER: EPOCH AND (MAP LOCAL) EXPONENT #
+    epoch      = None
+    data_lines = []
+    while i < len(lines):
+        label   = lines[i][60:80]
+        content = lines[i][0:60]
+        if 'LAT/LON1/LON2/DLON/H' in label:
+            data_lines.extend(lines[i + 1:i + 1 + line_count])
+            i += 1 + line_count
+            continue
+        elif 'END OF' in label:
+            break
+        elif 'EXPONENT' in label:
+            exponent = int(content[0:6])
+        elif 'EPOCH OF CURRENT MAP' in label:
+            epoch = parse_epoch(content)
+        i += 1
+    return epoch, exponent, data_lines, i
+
+def parse_maps(path_to_file):
+    """
+    parse_maps
+    Parses the IONEX file path_to_file and returns the 4-tuple of
+    header information (see read_header), a dictionary keyed by map
+    type (see MAP_TYPES) of dictionaries keyed by map_id of 2-tuples
+    (epoch, data block with shape (n_heights, n_lats, n_lons), see
+    parse_block), satellite biases, and station biases. The file is
+    read at once and each map is converted with a single call to
+    parse_block.
+    """
+    with open(path_to_file, 'rb') as ionex_file:
+        header_info, satellite_biases, station_biases = read_header(ionex_file)
+        # BLANK LINES ARE IGNORED (SEE next_line) #
+        lines = [line for line in ionex_file.read().splitlines() if line.strip()]
+
+    lons, lats, heights = grids(header_info)
+    n_lons     = len(lons)
+    n_lats     = len(lats)
+    n_heights  = len(heights)
+    line_count = int(np.ceil(n_lons/16.))
+
+    maps = dict([(map_type, {}) for map_type in MAP_TYPES])
+
+    i = 0
+    while i < len(lines):
+        label = lines[i][60:80]
+        i += 1
+        if 'START OF' not in label:
+            continue
+        map_type = label.split()[2]
+        if map_type not in maps:
+            continue
+        try:
+            map_id = int(lines[i - 1][0:60].split()[0])
+        except Exception as e:
+            print(e)
+            raise
+        epoch, exponent, data_lines, i = parse_map_section(lines, i, header_info['exponent'], line_count)
+        maps[map_type][map_id] = (epoch, parse_block(data_lines,
+                                                     n_lons,
+                                                     n_lats,
+                                                     n_heights,
+                                                     exponent))
+
+    return header_info, maps, satellite_biases, station_biases
+
+def read_maps(path_to_file, cache=True):
+    """
+    read_maps
+    Returns the parsed contents of the IONEX file path_to_file (see
+    parse_maps). If cache, the result is loaded from (or stored to)
+    the persistent binary cache (see the cache module), in which case
+    the data blocks are read-only.
+    """
+    if cache:
+        from cache import cached_maps
+        return cached_maps(path_to_file, parse_maps)
+    return parse_maps(path_to_file)
+
+def read_ionex(path_to_file):
+    """
+    read_ionex
+    Reads the IONEX file path_to_file and returns an IonexCube, i.e.,
+    the maps stacked into (time, lat, lon) arrays (with an additional
+    height axis following time for 3D files).
+    """
+    header_info, maps, satellite_biases, station_biases = read_maps(path_to_file)
+    lons, lats, heights = grids(header_info)
+
+    map_ids = sorted(maps['TEC'])
+    times   = [maps['TEC'][map_id][0] for map_id in map_ids]
+
+    def stack(map_type):
+        if len(maps[map_type]) == 0:
+            return None
+        blocks = []
+        for map_id in map_ids:
+            try:
+                blocks.append(maps[map_type][map_id][1])
+            except KeyError:
+                blocks.append(np.full((len(heights), len(lats), len(lons)), np.nan))
+        cube = np.array(blocks)
+        if header_info.get('map_dimension', 2) == 2:
+            # 2D MAPS: DROP THE HEIGHT AXIS #
+            cube = cube[:, 0, :, :]
+        return cube
+
+    return IonexCube(lons,
+                     lats,
+                     heights,
+                     times,
+                     stack('TEC'),
+                     stack('RMS'),
+                     stack('HEIGHT'),
+                     satellite_biases,
+                     station_biases,
+                     header_info)
+
 def parser(path_to_file):
     """
     Returns the raw data from the specified IONEX file path_to_file.
@@ -409,100 +562,14 @@ def parser(path_to_file):
                   OF REFERENCE FRAMES, IMPLEMENTATION PLAN, 1983
     """
 
-    with open(path_to_file, 'rb') as ionex_file:
-
-        header_info, satellite_biases, station_biases = read_header(ionex_file)
-
-        starting_epoch = header_info['start_epoch']
-        stopping_epoch = header_info['stop_epoch']
-
-        # import time
-        # starting_sec   = time.mktime(starting_epoch.timetuple())
-        # stopping_sec   = time.mktime(stopping_epoch.timetuple())
-
-        starting_ht  = header_info['height1']
-        stopping_ht  = header_info['height2']
-        dh           = header_info['dh']
-        starting_lat = header_info['lat1']
-        stopping_lat = header_info['lat2']
-        dlat         = header_info['dlat']
-        starting_lon = header_info['lon1']
-        stopping_lon = header_info['lon2']
-        dlon         = header_info['dlon']
-
-        exponent     = header_info['exponent']
-
-        if dh == 0:
-            n_heights = 1
-        else:
-            n_heights = int((stopping_ht - starting_ht)/dh) + 1
-
-        if dlat == 0:
-            n_lats = 1
-        else:
-            n_lats = int((stopping_lat - starting_lat)/dlat) + 1
-
-        if dlon == 0:
-            n_lons = 1
-        else:
-            n_lons = int((stopping_lon - starting_lon)/dlon) + 1
-
-        if n_lons > 1:
-            lons = np.arange(starting_lon, stopping_lon + dlon, dlon)
-        else:
-            lons = np.array([starting_lon])
+    header_info, maps, satellite_biases, station_biases = read_maps(path_to_file)
+    lons, lats, heights = grids(header_info)
 
-        if n_lats > 1:
-            lats = np.arange(starting_lat, stopping_lat + dlat, dlat)
-        else:
-            lats = [starting_lat]
-
-        if n_heights > 1:
-            heights = np.arange(starting_ht, stopping_ht + dh, dh)
-        else:
-            heights = [starting_ht]
-
-        # maps are keyed by their map_id #
-        tec_maps    = {}
-        rms_maps    = {}
-        height_maps = {}
-
-        done = False
-        while not done:
-
-            # CHECK WHICH TYPE OF MAP THE NEXT DATA BLOCK IS FOR #
-            # MAPS ARE STORED IN A DICTIONARY THAT IS KEYED BY THE ID OF THE MAP #
-            label, content = read_misc_line(ionex_file)
-
-            if label is None:
-                done = True
-            elif 'START OF TEC MAP' in label:
-                split = content.split()
-                try:
-                    map_id = int(split[0])
-                except Exception as e:
-                    print(e)
-                    raise
-                epoch, data_block = read_map(ionex_file, n_lons, n_lats, n_heights, exponent)
-                tec_maps[map_id] = (epoch, data_block) 
-            elif 'START OF RMS MAP' in label:
-                split = content.split()
-                try:
-                    map_id = int(split[0])
-                except Exception as e:
-                    print(e)
-                    raise
-                epoch, data_block = read_map(ionex_file, n_lons, n_lats, n_heights, exponent)
-                rms_maps[map_id] = (epoch, data_block)
-            elif 'START OF HEIGHT MAP' in label:
-                split = content.split()
-                try:
-                    map_id = int(split[0])
-                except Exception as e:
-                    print(e)
-                    raise
-                epoch, data_block = read_map(ionex_file, n_lons, n_lats, n_heights, exponent)
-                height_maps[map_id] = (epoch, data_block)
+    # maps are keyed by their map_id #
+    # blocks are (n_lons, n_lats, n_heights) in the output #
+    tec_maps, rms_maps, height_maps = [dict([(map_id, (epoch, np.ascontiguousarray(block.transpose(2, 1, 0))))
+                                             for map_id, (epoch, block) in maps[map_type].iteritems()])
+                                       for map_type in MAP_TYPES]
 
     return lons, lats, heights, tec_maps, rms_maps, height_maps, satellite_biases, station_biases
 
@@ -594,59 +661,219 @@ def interpolate2D_spatial(path_to_file, spatial_grid, method = 'linear'):
     default: 'linear'
     """
 
-    # TODO: unify outputs, write documentation, generate movie
-    lons, lats, heights, tec_maps, rms_maps, height_maps, satellite_biases, station_biases = parser(path_to_file)
+    cube = read_ionex(path_to_file)
 
-    time_grid = [tec_maps[key][0] for key in tec_maps]
+    time_grid = cube.times
 
-    si_grid_tec   = np.zeros([len(spatial_grid[0]), len(spatial_grid[1]), len(time_grid)])
+    def interpolate_2D(data):
+        if getattr(cube, data) is None:
+            return None
+        return interpolate_grid(IonexInterpolator(cube, data = data, method = method), time_grid, spatial_grid)
 
-    if len(rms_maps) > 0:
-        si_grid_rms   = np.zeros([len(spatial_grid[0]), len(spatial_grid[1]), len(time_grid)])
-    else:
-        si_grid_rms = None
+    si_grid_tec = interpolate_2D('tec')
+    si_grid_rms = interpolate_2D('rms')
 
-    if spatial_grid is not None:
+    return time_grid, si_grid_tec, si_grid_rms, cube.satellite_biases, cube.station_biases
 
-        # SPATIAL INTERPOLATION #
-        from scipy import interpolate
 
-        # FORCE THE DATA TO BE STRICTLY INCREASING #
-        if decreasing(lons):
-            lons = lons[::-1]
-            for key in tec_maps:
-                tec_maps[key][1][:,:,0] = tec_maps[key][1][::-1,:,0]
-                if len(rms_maps) > 0:
-                    rms_maps[key][1][:,:,0] = rms_maps[key][1][::-1,:,0]
+def timestamps(dts):
+    """
+    timestamps
+    Returns the 1D numpy array of the UNIX times (in [s], including
+    fractional seconds) of the list of datetimes dts.
+    """
+    return np.array([calendar.timegm(dt.timetuple()) + dt.microsecond * 1e-6 for dt in dts],
+                    dtype=np.float64)
 
-        if decreasing(lats):
-            lats = lats[::-1]
-            for key in tec_maps:
-                tec_maps[key][1][:,:,0] = tec_maps[key][1][:,::-1,0]
-                if len(rms_maps) > 0:
-                    rms_maps[key][1][:,:,0] = rms_maps[key][1][:,::-1,0]
+def temporal_weights(times, new_times, method = "linear"):
+    """
+    temporal_weights
+    Returns the 2D numpy array W with shape (len(new_times), len(times))
+    such that W.dot(y) is the interpolation (of type method, see
+    scipy.interpolate.interp1d) of the samples y, given at times, to
+    new_times. The weights depend only on the time grids and are
+    shared by every pixel of a map. Rows of new times outside the
+    range of times are nan.
+    """
+    from scipy import interpolate
 
-        for i, key in enumerate(tec_maps):
-            tec_map            = tec_maps[key][1][:,:,0]
-            s_interpolator_tec = interpolate.RegularGridInterpolator((lons, lats), tec_map, method = method, bounds_error = False)
+    # INTERPOLATING THE IDENTITY GIVES THE WEIGHT OF EACH SAMPLE #
+    return interpolate.interp1d(times, np.eye(len(times)), kind = method, axis = 0, bounds_error = False)(new_times)
+
+def interpolate_temporal(maps, times, temporal_grid, method = "linear"):
+    """
+    interpolate_temporal
+    Interpolates the numpy array maps (time along the first axis,
+    e.g., IonexCube.tec) given at the list of datetimes times to the
+    list of datetimes temporal_grid. The whole array is interpolated
+    with a single matrix product (see temporal_weights). Returns an
+    array with shape (len(temporal_grid),) + maps.shape[1:] that is
+    nan outside the time range of times and wherever the interpolated
+    value depends on a missing (nan) sample.
+    """
+    W       = temporal_weights(timestamps(times), timestamps(temporal_grid), method = method)
+    outside = np.isnan(W).any(axis=1)
+    W[outside, :] = 0
 
-            if len(rms_maps) > 0:
-                rms_map            = rms_maps[key][1][:,:,0]
-                s_interpolator_rms = interpolate.RegularGridInterpolator((lons, lats), rms_map, method = method, bounds_error = False)
+    samples = np.asarray(maps).reshape(len(times), -1)
+    missing = np.isnan(samples)
 
-            DENSE_LATS, DENSE_LONS = np.meshgrid(spatial_grid[1], spatial_grid[0])
-            points                 = zip(DENSE_LONS.flatten(), DENSE_LATS.flatten())
+    output = W.dot(np.where(missing, 0, samples))
+    # NAN MASK: ANY MISSING SAMPLE WITH NONZERO WEIGHT #
+    output[(W != 0).astype(np.float64).dot(missing) > 0] = np.nan
+    output[outside, :] = np.nan
 
-            s_interpolated_tec = s_interpolator_tec(points).reshape(DENSE_LATS.shape)
-            si_grid_tec[:,:,i] = s_interpolated_tec
+    return output.reshape((len(temporal_grid),) + np.shape(maps)[1:])
 
-            if len(rms_maps) > 0:
-                s_interpolated_rms = s_interpolator_rms(points).reshape(DENSE_LATS.shape)
-                si_grid_rms[:,:,i] = s_interpolated_rms
+EARTH_ROTATION_RATE = 360. / 86400
+"""
+Longitude shift rate (in [deg/s]) applied by IonexInterpolator when
+rotate is set (the ionosphere is approximately fixed with respect to
+the Sun).
+"""
 
+CHUNK_SIZE = 2**20
+"""
+Number of query points evaluated at once by IonexInterpolator.
+"""
 
-    return time_grid, si_grid_tec, si_grid_rms, satellite_biases, station_biases
+class IonexInterpolator(object):
+    def __init__(self, cube, data = 'tec', method = 'linear', rotate = False, layers = False):
+        """
+        IonexInterpolator
+        Interpolator over the full (time, lat, lon) grid of the
+        IonexCube cube (see read_ionex). data selects the 'tec' or
+        'rms' maps. For 3D files, the first height is used unless
+        layers, in which case the interpolator is over the full
+        (time, height, lat, lon) grid. method is 'linear' or 'nearest'
+        (see scipy.interpolate.RegularGridInterpolator) and applies to
+        all axes. The result is nan outside the grid and wherever the
+        interpolated value depends on a missing (nan) sample.
+
+        If rotate, the two maps bracketing a query time t are rotated
+        in longitude by the Earth rotation between their epochs T_i
+        and t, i.e., map i is evaluated at lon + (t - T_i) *
+        EARTH_ROTATION_RATE, before the (linear) temporal
+        interpolation (interpolation in a Sun-fixed frame, see
+        Schaer et al., IONEX Version 1, 1998). Longitudes are wrapped
+        to the grid when it spans 360 degrees.
+        """
+        from scipy import interpolate
 
+        maps = getattr(cube, data)
+        if maps is None:
+            raise ValueError('{} maps are not present in the IONEX file'.format(data))
+        heights = np.asarray(cube.heights, dtype=np.float64)
+        if layers:
+            if maps.ndim != 4:
+                raise ValueError('layers requires 3D maps')
+        elif maps.ndim == 4:
+            # 3D MAPS: USE THE FIRST HEIGHT #
+            maps = maps[:, 0, :, :]
+        self.times = timestamps(cube.times)
+        lats       = np.asarray(cube.lats, dtype=np.float64)
+        lons       = np.asarray(cube.lons, dtype=np.float64)
+
+        # FORCE THE DATA TO BE STRICTLY INCREASING #
+        if decreasing(lats):
+            lats = lats[::-1]
+            maps = maps[..., ::-1, :]
+        if decreasing(lons):
+            lons = lons[::-1]
+            maps = maps[..., ::-1]
+        if layers and decreasing(heights):
+            heights = heights[::-1]
+            maps    = maps[:, ::-1, :, :]
+
+        self.lons        = lons
+        self.global_lons = lons[-1] - lons[0] >= 360
+        self.rotate      = rotate
+
+        if layers:
+            grid = (self.times, heights, lats, lons)
+        else:
+            grid = (self.times, lats, lons)
+        missing = np.isnan(maps)
+        self.interpolator = interpolate.RegularGridInterpolator(grid,
+                                                                np.where(missing, 0, maps),
+                                                                method = method,
+                                                                bounds_error = False)
+        if missing.any():
+            self.missing_interpolator = interpolate.RegularGridInterpolator(grid,
+                                                                            missing.astype(np.float64),
+                                                                            method = method,
+                                                                            bounds_error = False)
+        else:
+            self.missing_interpolator = None
+
+    def __call__(self, points):
+        """
+        Returns the 1D numpy array of the interpolated values at the
+        (N, 3) array points of (UNIX time in [s], lat, lon) rows
+        ((N, 4) array of (UNIX time in [s], height, lat, lon) rows if
+        layers).
+        """
+        points = np.asarray(points, dtype=np.float64)
+        output = np.empty(len(points))
+        for i in range(0, len(points), CHUNK_SIZE):
+            chunk = points[i:i + CHUNK_SIZE]
+            if self.rotate:
+                output[i:i + CHUNK_SIZE] = self.evaluate_rotated(chunk)
+            else:
+                output[i:i + CHUNK_SIZE] = self.evaluate(np.column_stack((chunk[:, :-1], self.wrap(chunk[:, -1]))))
+        return output
+
+    def evaluate(self, points):
+        values = self.interpolator(points)
+        if self.missing_interpolator is not None:
+            values[self.missing_interpolator(points) > 0] = np.nan
+        return values
+
+    def wrap(self, lons):
+        if self.global_lons:
+            return self.lons[0] + np.mod(lons - self.lons[0], 360)
+        return lons
+
+    def evaluate_rotated(self, points):
+        t   = points[:, 0]
+        # BRACKETING MAPS #
+        i   = np.clip(np.searchsorted(self.times, t, side='right') - 1, 0, len(self.times) - 2)
+        t0  = self.times[i]
+        t1  = self.times[i + 1]
+        w   = (t - t0) / (t1 - t0)
+        v0  = self.evaluate(np.column_stack((t0, points[:, 1:-1], self.wrap(points[:, -1] + (t - t0) * EARTH_ROTATION_RATE))))
+        v1  = self.evaluate(np.column_stack((t1, points[:, 1:-1], self.wrap(points[:, -1] + (t - t1) * EARTH_ROTATION_RATE))))
+        values = (1 - w) * v0 + w * v1
+        # AT THE MAP EPOCHS, ONLY THAT MAP IS USED #
+        values[w == 0] = v0[w == 0]
+        values[w == 1] = v1[w == 1]
+        values[(t < self.times[0]) | (t > self.times[-1])] = np.nan
+        return values
+
+def interpolate_grid(interpolator, times, spatial_grid):
+    """
+    interpolate_grid
+    Evaluates the IonexInterpolator interpolator on the grid spanned
+    by the list of datetimes times and spatial_grid (a 2-tuple of
+    longitudes and latitudes). Returns a 3D numpy array with shape
+    (n_lons, n_lats, n_times). The query points are built for blocks
+    of times of about CHUNK_SIZE points.
+    """
+    seconds    = timestamps(times)
+    LONS, LATS = np.meshgrid(spatial_grid[0], spatial_grid[1], indexing='ij')
+    lons       = LONS.ravel()
+    lats       = LATS.ravel()
+
+    output = np.empty((len(seconds), len(lons)))
+    step   = max(1, CHUNK_SIZE // max(len(lons), 1))
+    for i in range(0, len(seconds), step):
+        t      = seconds[i:i + step]
+        points = np.column_stack((np.repeat(t, len(lons)),
+                                  np.tile(lats, len(t)),
+                                  np.tile(lons, len(t))))
+        output[i:i + step, :] = interpolator(points).reshape(len(t), len(lons))
+
+    return np.ascontiguousarray(output.T.reshape(LONS.shape + (len(seconds),)))
 
 def interpolate2D_temporal(path_to_file, temporal_grid, method = "linear", data = 'tec'):
     """
@@ -661,6 +888,7 @@ def interpolate2D_temporal(path_to_file, temporal_grid, method = "linear", data
     of temporal_grid. n_lons and n_lats are the length of the longitude and latitude grids in the 
     IONEX file. If the RMS data is not available in the IONEX file, None is returned in place of the
     3D numpy array. The fifth and sixth entries are the satellite biases and station biases, respectively.
+    The interpolation is computed for all pixels at once (see interpolate_temporal).
 
     satellite_biases: dictionary with keys "GPS" and "GLONASS"
               - satellite_biases['GPS'] contains another dictionary (keyed by PRN). Each
@@ -681,38 +909,23 @@ def interpolate2D_temporal(path_to_file, temporal_grid, method = "linear", data
     default: 'linear'
     """
 
-    lons, lats, heights, tec_maps, rms_maps, height_maps, satellite_biases, station_biases = parser(path_to_file)
-
-    import calendar
-    from scipy import interpolate
-
-    k      = tec_maps.keys()[0]
-    n_lons = tec_maps[k][1].shape[0]
-    n_lats = tec_maps[k][1].shape[1]
-
-    timestamps = [calendar.timegm(dt.timetuple()) for dt in temporal_grid]
-
-    ti_grid_tec    = np.zeros([n_lons, n_lats, len(timestamps)])
-
-    if len(rms_maps) > 0:
-        ti_grid_rms    = np.zeros([n_lons, n_lats, len(timestamps)])
-
-    for i in range(n_lons):
-        for j in range(n_lats):
-            pixel_times    = [calendar.timegm(tec_maps[key][0].timetuple()) for key in tec_maps]
+    cube = read_ionex(path_to_file)
 
-            pixel_list_tec     = [tec_maps[key][1][i,j,0] for key in tec_maps]
-            t_interpolator_tec = interpolate.interp1d(pixel_times, pixel_list_tec, kind = method, bounds_error = False)
-            ti_grid_tec[i,j,:] = t_interpolator_tec(timestamps)
+    def interpolate_2D(maps):
+        if maps is None:
+            return None
+        if maps.ndim == 4:
+            # 3D MAPS: USE THE FIRST HEIGHT #
+            maps = maps[:, 0, :, :]
+        # (n_times, n_lats, n_lons) -> (n_lons, n_lats, n_times) #
+        return np.ascontiguousarray(interpolate_temporal(maps, cube.times, temporal_grid, method = method).transpose(2, 1, 0))
 
-            if len(rms_maps) > 0:
-                pixel_list_rms     = [rms_maps[key][1][i,j,0] for key in rms_maps]
-                t_interpolator_rms = interpolate.interp1d(pixel_times, pixel_list_rms, kind = method, bounds_error = False)
-                ti_grid_rms[i,j,:] = t_interpolator_rms(timestamps)      
+    ti_grid_tec = interpolate_2D(cube.tec)
+    ti_grid_rms = interpolate_2D(cube.rms)
 
-    return lons, lats, ti_grid_tec, ti_grid_rms, satellite_biases, station_biases
+    return cube.lons, cube.lats, ti_grid_tec, ti_grid_rms, cube.satellite_biases, cube.station_biases
 
-def interpolate2D_spatiotemporal(path_to_file, temporal_grid, spatial_grid, temporal_method = "linear", spatial_method = "linear", data = 'tec'):
+def interpolate2D_spatiotemporal(path_to_file, temporal_grid, spatial_grid, temporal_method = "linear", spatial_method = "linear", data = 'tec', rotate = False):
     """
     interpolate2D_spatiotemporal:
     Reads in the IONEX file path_to_file and performs spatiotemporal interpolation on the data in 2D.
@@ -748,75 +961,31 @@ def interpolate2D_spatiotemporal(path_to_file, temporal_grid, spatial_grid, temp
     spatial_method specifies the spatial interpolation type:
     'nearest' or 'linear'
     default: 'linear'
-    """
-
-    lons, lats, heights, tec_maps, rms_maps, height_maps, satellite_biases, station_biases = parser(path_to_file)
-
-    si_grid_tec  = np.zeros([len(spatial_grid[0]), len(spatial_grid[1]), len(tec_maps.keys())])
-
-    if len(rms_maps) > 0:
-        si_grid_rms   = np.zeros([len(spatial_grid[0]), len(spatial_grid[1]), len(tec_maps.keys())])
-    else:
-        si_grid_rms = None
-
-   # SPATIAL INTERPOLATION #
-    from scipy import interpolate
-
-    # FORCE THE DATA TO BE STRICTLY INCREASING #
-    if decreasing(lons):
-        lons = lons[::-1]
-        for key in tec_maps:
-            tec_maps[key][1][:,:,0] = tec_maps[key][1][::-1,:,0]
-            if len(rms_maps) > 0:
-                rms_maps[key][1][:,:,0] = rms_maps[key][1][::-1,:,0]
-
-    if decreasing(lats):
-        lats = lats[::-1]
-        for key in tec_maps:
-            tec_maps[key][1][:,:,0] = tec_maps[key][1][:,::-1,0]
-            if len(rms_maps) > 0:
-                rms_maps[key][1][:,:,0] = rms_maps[key][1][:,::-1,0]
-
-    for i, key in enumerate(tec_maps):
-        tec_map            = tec_maps[key][1][:,:,0]
-        s_interpolator_tec = interpolate.RegularGridInterpolator((lons, lats), tec_map, method = spatial_method, bounds_error = False)
 
-        if len(rms_maps) > 0:
-            rms_map            = rms_maps[key][1][:,:,0]
-            s_interpolator_rms = interpolate.RegularGridInterpolator((lons, lats), rms_map, method = spatial_method, bounds_error = False)
-
-        DENSE_LATS, DENSE_LONS = np.meshgrid(spatial_grid[1], spatial_grid[0])
-        points                 = zip(DENSE_LONS.flatten(), DENSE_LATS.flatten())
-
-        s_interpolated_tec = s_interpolator_tec(points).reshape(DENSE_LATS.shape)
-        si_grid_tec[:,:,i] = s_interpolated_tec
-
-        if len(rms_maps) > 0:
-            s_interpolated_rms = s_interpolator_rms(points).reshape(DENSE_LATS.shape)
-            si_grid_rms[:,:,i] = s_interpolated_rms
-
-    # TEMPORAL INTERPOLATION #
-    import calendar
-
-    sti_grid_tec   = np.zeros([len(spatial_grid[0]), len(spatial_grid[1]), len(temporal_grid)])
-    timestamps = [calendar.timegm(dt.timetuple()) for dt in temporal_grid]
-
-    if len(rms_maps) > 0:
-        sti_grid_rms   = np.zeros([len(spatial_grid[0]), len(spatial_grid[1]), len(temporal_grid)])
-    else:
-        sti_grid_rms   = None
-
-    for i in range(0, len(spatial_grid[0])):
-        for j in range(0, len(spatial_grid[1])):
-            pixel_times         = [calendar.timegm(tec_maps[key][0].timetuple()) for key in tec_maps]
-
-            pixel_list_tec      = si_grid_tec[i,j,:]
-            t_interpolator_tec  = interpolate.interp1d(pixel_times, pixel_list_tec, kind = temporal_method, bounds_error = False)
-            sti_grid_tec[i,j,:] = t_interpolator_tec(timestamps)
-
-            if len(rms_maps) > 0:
-                pixel_list_rms      = si_grid_rms[i,j,:]
-                t_interpolator_rms  = interpolate.interp1d(pixel_times, pixel_list_rms, kind = temporal_method, bounds_error = False)
-                sti_grid_rms[i,j,:] = t_interpolator_rms(timestamps)               
+    The maps are interpolated in space at the map epochs with an
+    IonexInterpolator and then in time for all pixels at once (see
+    interpolate_temporal). If rotate, the maps are rotated in longitude
+    to account for the Earth rotation between the map epochs and the
+    interpolation times and every output point is evaluated with a
+    rotating IonexInterpolator (requires linear temporal_method).
+    """
 
-    return sti_grid_tec, sti_grid_rms, satellite_biases, station_biases
+    cube = read_ionex(path_to_file)
+
+    def interpolate_2D(data):
+        if getattr(cube, data) is None:
+            return None
+        if rotate:
+            if temporal_method != 'linear':
+                raise ValueError('rotate requires linear temporal interpolation')
+            return interpolate_grid(IonexInterpolator(cube, data = data, method = spatial_method, rotate = True), temporal_grid, spatial_grid)
+        # THE OUTPUT GRID IS A TENSOR PRODUCT: SPATIAL INTERPOLATION AT #
+        # THE MAP EPOCHS FOLLOWED BY TEMPORAL INTERPOLATION IS EQUIVALENT #
+        # TO (AND MUCH CHEAPER THAN) EVALUATING EVERY OUTPUT POINT #
+        si_grid = interpolate_grid(IonexInterpolator(cube, data = data, method = spatial_method), cube.times, spatial_grid)
+        return np.ascontiguousarray(interpolate_temporal(si_grid.transpose(2, 0, 1), cube.times, temporal_grid, method = temporal_method).transpose(1, 2, 0))
+
+    sti_grid_tec = interpolate_2D('tec')
+    sti_grid_rms = interpolate_2D('rms')
+
+    return sti_grid_tec, sti_grid_rms, cube.satellite_biases, cube.station_biases
@@ -0,0 +1,118 @@
+"""
+Slant electron content along receiver to satellite rays through the
+shells of IONEX maps (single shell for 2D maps and every height layer
+for 3D maps).
+"""
+
+import datetime
+
+import numpy as np
+
+from read_ionex import IonexInterpolator, timestamps
+
+
+BASE_RADIUS = 6371.
+"""
+Mean Earth radius (in [km]) used when the IONEX header does not
+include a BASE RADIUS record.
+"""
+
+MAPPING_FUNCTIONS = ['COSZ', 'NONE']
+"""
+Supported IONEX mapping functions (COSZ is assumed when the header
+does not include a MAPPING FUNCTION record).
+"""
+
+
+def pierce_points(lat, lon, az, el, height, radius=BASE_RADIUS):
+    """
+    pierce_points
+    Returns the 3-tuple of the latitudes and longitudes (in [deg]) and
+    the obliquity factors (1 / cos z', where z' is the zenith angle of
+    the ray at the pierce point) of the points where the rays leaving
+    receivers at lat, lon (in [deg]) with azimuth az and elevation el
+    (in [deg]) cross the spherical shell at height (in [km]) above
+    the sphere of radius radius (in [km]). The receivers are assumed
+    to be on the sphere. Arguments are broadcast.
+    """
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    az  = np.radians(az)
+    el  = np.radians(el)
+
+    sin_z = radius / (radius + np.asarray(height, dtype=np.float64)) * np.cos(el)
+    # EARTH CENTRAL ANGLE BETWEEN THE RECEIVER AND THE PIERCE POINT #
+    psi     = np.pi / 2 - el - np.arcsin(sin_z)
+    ipp_lat = np.arcsin(np.sin(lat) * np.cos(psi) +
+                        np.cos(lat) * np.sin(psi) * np.cos(az))
+    ipp_lon = lon + np.arctan2(np.sin(az) * np.sin(psi) * np.cos(lat),
+                               np.cos(psi) - np.sin(lat) * np.sin(ipp_lat))
+
+    return (np.degrees(ipp_lat),
+            np.mod(np.degrees(ipp_lon) + 180, 360) - 180,
+            1 / np.sqrt(1 - sin_z**2))
+
+
+def slant_tec(cube, times, lat, lon, az, el, data='tec', method='linear', rotate=False, layer_weights=None):
+    """
+    slant_tec
+    Returns the 1D numpy array of the slant electron content along the
+    rays leaving receivers at lat, lon (in [deg]) with azimuth az and
+    elevation el (in [deg]) at times (list of datetimes or array of
+    UNIX times in [s]) from the IonexCube cube (see
+    read_ionex.read_ionex). Arguments are broadcast.
+
+    For 2D maps, the map (data is 'tec' or 'rms') is interpolated at
+    the pierce point of the single shell and multiplied by the
+    mapping function of the file. For 3D maps, the ray is traced
+    through every height layer and the result is the sum over the
+    layers of layer_weights[k] * obliquity_k * map_k(pierce point_k).
+    By default, the weights are 1, i.e., each layer map is the
+    vertical content of the layer (pass the layer thicknesses, scaled
+    to the units of the maps, for electron density maps). The pierce
+    points of all rays and layers are interpolated with a single
+    IonexInterpolator call (see IonexInterpolator for method and
+    rotate).
+    """
+    header  = cube.header
+    radius  = header.get('base_radius', BASE_RADIUS)
+    mapping = header.get('mapping_function', 'COSZ')
+    if mapping not in MAPPING_FUNCTIONS:
+        raise ValueError('{} mapping function is not supported '
+                         '(choices are {})'.format(mapping, MAPPING_FUNCTIONS))
+
+    if len(times) and isinstance(times[0], datetime.datetime):
+        times = timestamps(times)
+    t, lat, lon, az, el = [np.ravel(x) for x in np.broadcast_arrays(np.asarray(times, dtype=np.float64),
+                                                                    lat,
+                                                                    lon,
+                                                                    az,
+                                                                    el)]
+
+    layers  = getattr(cube, data).ndim == 4
+    heights = np.asarray(cube.heights if layers else cube.heights[:1], dtype=np.float64)
+
+    # RAYS ALONG THE FIRST AXIS, LAYERS ALONG THE SECOND #
+    ipp_lat, ipp_lon, obliquity = pierce_points(lat[:, np.newaxis],
+                                                lon[:, np.newaxis],
+                                                az[:, np.newaxis],
+                                                el[:, np.newaxis],
+                                                heights[np.newaxis, :],
+                                                radius=radius)
+    if mapping == 'NONE':
+        obliquity = np.ones_like(obliquity)
+
+    interpolator = IonexInterpolator(cube,
+                                     data=data,
+                                     method=method,
+                                     rotate=rotate,
+                                     layers=layers)
+    columns = [np.repeat(t, len(heights))]
+    if layers:
+        columns.append(np.tile(heights, len(t)))
+    columns.extend([ipp_lat.ravel(), ipp_lon.ravel()])
+    values = interpolator(np.column_stack(columns)).reshape(len(t), len(heights))
+
+    if layer_weights is None:
+        layer_weights = np.ones(len(heights))
+    return np.sum(values * obliquity * layer_weights, axis=1)
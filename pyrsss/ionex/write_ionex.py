@@ -0,0 +1,303 @@
+"""
+IONEX writer.
+
+Writes IonexCube records (see read_ionex.read_ionex) in the format
+described in "IONEX: The IONosphere Map EXchange Format Version 1" by
+Stefan Schaer, Werner Gurtner, and Joachim Feltens (1998). Map values
+are scaled to integers, converted to I5 fields, and arranged in 80
+column lines for all maps at once, so that the output round-trips
+exactly through read_ionex.
+"""
+
+import logging
+
+import numpy as np
+
+from read_ionex import MISSING_VALUE, timestamps
+
+logger = logging.getLogger('pyrsss.ionex.write_ionex')
+
+
+BASE_RADIUS = 6371.
+"""
+Default BASE RADIUS (in [km]) written when the cube header does not
+include one.
+"""
+
+MAPPING_FUNCTION = 'COSZ'
+"""
+Default MAPPING FUNCTION written when the cube header does not include
+one.
+"""
+
+ELEVATION_CUTOFF = 0.
+"""
+Default ELEVATION CUTOFF (in [deg]) written when the cube header does
+not include one.
+"""
+
+FIELDS_PER_LINE = 16
+"""
+Number of I5 data fields per line.
+"""
+
+MAX_EXTRA_DIGITS = 5
+"""
+Maximum number of additional decimal digits (beyond the file
+exponent) used for a map that the file exponent cannot represent
+exactly.
+"""
+
+I5_MIN = -9999
+"""
+Smallest integer that fits in an I5 field.
+"""
+
+I5_MAX = 99999
+"""
+Largest integer that fits in an I5 field.
+"""
+
+I5_TABLE = []
+"""
+Lazily built table of the I5 fields (see i5_table).
+"""
+
+
+def format_ionex_line(content, label):
+    """
+    format_ionex_line
+    Returns the IONEX record line with 60 character content and 20
+    character label.
+    """
+    return '{:60s}{:20s}\n'.format(content, label)
+
+def format_ionex_epoch(dt):
+    """
+    format_ionex_epoch
+    Returns the IONEX epoch fields (6I6) for the datetime dt (IONEX
+    epochs are whole seconds: microseconds are dropped).
+    """
+    return '{:6d}{:6d}{:6d}{:6d}{:6d}{:6d}'.format(dt.year,
+                                                   dt.month,
+                                                   dt.day,
+                                                   dt.hour,
+                                                   dt.minute,
+                                                   dt.second)
+
+def format_grid(x1, x2, dx):
+    return '  {:6.1f}{:6.1f}{:6.1f}'.format(x1, x2, dx)
+
+def grid_step(grid):
+    return grid[1] - grid[0] if len(grid) > 1 else 0.
+
+def i5_table():
+    """
+    i5_table
+    Returns the uint8 array with shape (I5_MAX - I5_MIN + 1, 5) of
+    the right justified I5 fields (characters) of all integers from
+    I5_MIN to I5_MAX (built on first use).
+    """
+    if not I5_TABLE:
+        values    = np.arange(I5_MIN, I5_MAX + 1, dtype=np.int64)
+        magnitude = np.abs(values)[..., np.newaxis]
+        powers    = 10**np.arange(4, -1, -1)
+        digits    = (magnitude // powers) % 10
+        # THE FIRST COLUMN OF THE (RIGHT JUSTIFIED) DIGITS #
+        first     = 5 - np.maximum(np.sum(magnitude >= powers, axis=-1, keepdims=True), 1)
+        k         = np.arange(5)
+        chars     = np.where(k >= first, ord('0') + digits, ord(' '))
+        chars     = np.where((k == first - 1) & (values[..., np.newaxis] < 0), ord('-'), chars)
+        I5_TABLE.append(chars.astype(np.uint8))
+    return I5_TABLE[0]
+
+def format_i5(values):
+    """
+    format_i5
+    Converts the integer numpy array values to a uint8 array of
+    characters with an additional last axis of length 5, i.e., the
+    right justified I5 fields of all values at once.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    if values.size and (values.max() > I5_MAX or values.min() < I5_MIN):
+        raise ValueError('values do not fit in I5 fields (use a larger exponent)')
+    return i5_table()[values - I5_MIN]
+
+def scale(blocks, exponents):
+    with np.errstate(invalid='ignore'):
+        return np.rint(blocks / 10.**exponents.reshape((-1,) + (1,) * (blocks.ndim - 1)))
+
+def map_exponents(blocks, exponent):
+    """
+    map_exponents
+    Returns the integer numpy array of the exponent of each map of
+    blocks (with the map along the first axis): the largest exponent,
+    starting at exponent and using at most MAX_EXTRA_DIGITS additional
+    digits, with which the map values are represented exactly (as
+    read by parse_block) in I5 fields. Maps that cannot be
+    represented exactly use exponent.
+    """
+    n_maps    = len(blocks)
+    exponents = np.full(n_maps, exponent, dtype=np.int64)
+    finite    = np.where(np.isnan(blocks), 0, blocks).reshape(n_maps, -1)
+    # MAPS NOT YET REPRESENTED EXACTLY #
+    pending   = np.arange(n_maps)
+    for e in range(exponent, exponent - MAX_EXTRA_DIGITS - 1, -1):
+        values = scale(finite[pending], np.full(len(pending), e, dtype=np.int64))
+        fits   = ((values <= I5_MAX) & (values >= I5_MIN) & (values != MISSING_VALUE)).all(axis=1)
+        exact  = (values * 10.**e == finite[pending]).all(axis=1) & fits
+        exponents[pending[exact]] = e
+        # MORE DIGITS DO NOT HELP MAPS THAT ALREADY OVERFLOW #
+        pending = pending[~exact & fits]
+        if len(pending) == 0:
+            break
+    return exponents
+
+def format_blocks(blocks, heights, lats, lons, exponents):
+    """
+    format_blocks
+    Returns the list of strings, one per map, of the data records
+    (LAT/LON1/LON2/DLON/H records each followed by the lon slice of
+    16I5 lines) of the numpy array blocks with shape (n_maps,
+    n_heights, n_lats, n_lons). The values of map i are scaled by
+    10**-exponents[i] and nan is written as 9999.
+    """
+    n_maps, n_heights, n_lats, n_lons = blocks.shape
+    values = scale(blocks, exponents)
+    values[np.isnan(blocks)] = MISSING_VALUE
+    fields = format_i5(values.astype(np.int64)).reshape(n_maps * n_heights * n_lats, n_lons * 5)
+
+    # LINES OF 16 FIELDS (THE LAST LINE OF A LON SLICE MAY BE SHORTER) #
+    line_width = FIELDS_PER_LINE * 5
+    line_count = int(np.ceil(n_lons / float(FIELDS_PER_LINE)))
+    last_width = n_lons * 5 - (line_count - 1) * line_width
+
+    # EACH ROW IS A LAT/LON1/LON2/DLON/H RECORD AND ITS LON SLICE #
+    row_headers = np.array([[ord(c) for c in
+                             format_ionex_line('  {:6.1f}{:6.1f}{:6.1f}{:6.1f}{:6.1f}'.format(lat,
+                                                                                          lons[0],
+                                                                                          lons[-1],
+                                                                                          grid_step(lons),
+                                                                                          height),
+                                               'LAT/LON1/LON2/DLON/H')]
+                            for height in heights for lat in lats], dtype=np.uint8)
+    header_width = row_headers.shape[1]
+    row_width    = header_width + (line_count - 1) * (line_width + 1) + last_width + 1
+
+    rows = np.empty((n_maps, n_heights * n_lats, row_width), dtype=np.uint8)
+    rows[:, :, :header_width] = row_headers
+    rows = rows.reshape(-1, row_width)
+    for j in range(line_count):
+        start = header_width + j * (line_width + 1)
+        width = line_width if j < line_count - 1 else last_width
+        rows[:, start:start + width] = fields[:, j * line_width:j * line_width + width]
+        rows[:, start + width] = ord('\n')
+
+    rows = rows.reshape(n_maps, -1)
+    return [rows[i].tobytes() for i in range(n_maps)]
+
+def format_header(cube, exponent, interval, system, program, run_by, date, comments):
+    header  = cube.header
+    lines   = [format_ionex_line('{:8.1f}{:12s}{:20s}{:3s}'.format(1.0, '', 'IONOSPHERE MAPS', system),
+                                 'IONEX VERSION / TYPE'),
+               format_ionex_line('{:20s}{:20s}{:20s}'.format(program, run_by, date),
+                                 'PGM / RUN BY / DATE')]
+    lines  += [format_ionex_line(comment, 'COMMENT') for comment in comments]
+    lines  += [format_ionex_line(format_ionex_epoch(cube.times[0]), 'EPOCH OF FIRST MAP'),
+               format_ionex_line(format_ionex_epoch(cube.times[-1]), 'EPOCH OF LAST MAP'),
+               format_ionex_line('{:6d}'.format(interval), 'INTERVAL'),
+               format_ionex_line('{:6d}'.format(len(cube.times)), '# OF MAPS IN FILE'),
+               format_ionex_line('  {:4s}'.format(header.get('mapping_function', MAPPING_FUNCTION)),
+                                 'MAPPING FUNCTION'),
+               format_ionex_line('{:8.1f}'.format(header.get('elevation_cutoff', ELEVATION_CUTOFF)),
+                                 'ELEVATION CUTOFF'),
+               format_ionex_line(header.get('observables_used', ''), 'OBSERVABLES USED'),
+               format_ionex_line('{:8.1f}'.format(header.get('base_radius', BASE_RADIUS)),
+                                 'BASE RADIUS'),
+               format_ionex_line('{:6d}'.format(cube.tec.ndim - 1), 'MAP DIMENSION'),
+               format_ionex_line(format_grid(cube.heights[0], cube.heights[-1], grid_step(cube.heights)),
+                                 'HGT1 / HGT2 / DHGT'),
+               format_ionex_line(format_grid(cube.lats[0], cube.lats[-1], grid_step(cube.lats)),
+                                 'LAT1 / LAT2 / DLAT'),
+               format_ionex_line(format_grid(cube.lons[0], cube.lons[-1], grid_step(cube.lons)),
+                                 'LON1 / LON2 / DLON'),
+               format_ionex_line('{:6d}'.format(exponent), 'EXPONENT')]
+
+    satellite_biases = cube.satellite_biases or {}
+    station_biases   = cube.station_biases or {}
+    if any(satellite_biases.values()) or any(station_biases.values()):
+        lines.append(format_ionex_line('DIFFERENTIAL CODE BIASES', 'START OF AUX DATA'))
+        for gnss_system, code in [('GPS', 'G'), ('GLONASS', 'R')]:
+            for prn, (bias, rms) in sorted(satellite_biases.get(gnss_system, {}).iteritems()):
+                lines.append(format_ionex_line('   {}{:02d}{:10.3f}{:10.3f}'.format(code, prn, bias, rms),
+                                               'PRN / BIAS / RMS'))
+        for gnss_system, code in [('GPS', 'G'), ('GLONASS', 'R')]:
+            for station, (bias, rms, domes) in sorted(station_biases.get(gnss_system, {}).iteritems()):
+                lines.append(format_ionex_line('   {}  {:4s} {:9s}      {:10.3f}{:10.3f}'.format(code,
+                                                                                            station,
+                                                                                            domes or '',
+                                                                                            bias,
+                                                                                            rms),
+                                               'STATION / BIAS / RMS'))
+        lines.append(format_ionex_line('DIFFERENTIAL CODE BIASES', 'END OF AUX DATA'))
+    lines.append(format_ionex_line('', 'END OF HEADER'))
+    return lines
+
+def write_ionex(ionex_fname, cube, exponent=None, system='GPS', program='pyrsss.ionex', run_by='', date='', comments=None):
+    """
+    write_ionex
+    Writes the IonexCube cube (see read_ionex.read_ionex: the TEC
+    maps and, if not None, the RMS and height maps, the grids, the
+    biases, and the base radius, mapping function, elevation cutoff,
+    and observables of the header)
+    to the IONEX file ionex_fname. Values are written with the given
+    exponent (the exponent of the cube header, or -1, by default)
+    except for maps that require more digits to be represented exactly
+    (see map_exponents), which are written with a map specific
+    EXPONENT record. nan values are written as 9999. system,
+    program, run_by, date, and comments are written to the
+    corresponding header records. Epochs are written in whole seconds
+    (with a warning if any are not).
+    Returns ionex_fname.
+    """
+    if exponent is None:
+        exponent = cube.header.get('exponent', -1)
+    if comments is None:
+        comments = []
+    if any(dt.microsecond for dt in cube.times):
+        logger.warning('epochs of {} are truncated to whole seconds'.format(ionex_fname))
+    seconds = timestamps(cube.times)
+    steps   = np.unique(np.diff(seconds))
+    # INTERVAL IS 0 FOR IRREGULAR EPOCHS #
+    interval = int(steps[0]) if len(steps) == 1 else 0
+
+    output = format_header(cube, exponent, interval, system, program, run_by, date, comments)
+    for map_type, maps in [('TEC', cube.tec), ('RMS', cube.rms), ('HEIGHT', cube.height)]:
+        if maps is None:
+            continue
+        maps = np.asarray(maps, dtype=np.float64)
+        if maps.ndim == 3:
+            # 2D MAPS: A SINGLE HEIGHT #
+            maps = maps[:, np.newaxis, :, :]
+        exponents = map_exponents(maps, exponent)
+        blocks    = format_blocks(maps,
+                                  cube.heights,
+                                  cube.lats,
+                                  cube.lons,
+                                  exponents)
+        for i, (dt, map_exponent, block) in enumerate(zip(cube.times, exponents, blocks)):
+            output.append(format_ionex_line('{:6d}'.format(i + 1),
+                                            'START OF {} MAP'.format(map_type)))
+            output.append(format_ionex_line(format_ionex_epoch(dt),
+                                            'EPOCH OF CURRENT MAP'))
+            if map_exponent != exponent:
+                # MAP SPECIFIC EXPONENT #
+                output.append(format_ionex_line('{:6d}'.format(map_exponent), 'EXPONENT'))
+            output.append(block)
+            output.append(format_ionex_line('{:6d}'.format(i + 1),
+                                            'END OF {} MAP'.format(map_type)))
+    output.append(format_ionex_line('', 'END OF FILE'))
+
+    with open(ionex_fname, 'wb') as fid:
+        fid.write(''.join(output))
+    return ionex_fname
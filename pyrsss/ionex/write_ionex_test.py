@@ -0,0 +1,62 @@
+import os
+import shutil
+import logging
+import datetime
+import tempfile
+
+import numpy as np
+
+from read_ionex import IonexCube, read_ionex
+from write_ionex import write_ionex
+
+
+def synthetic_cube(n_times=5, interval=3600, seed=0):
+    """
+    synthetic_cube
+    Returns an IonexCube of n_times global TEC and RMS maps (every
+    interval [s], on the 0.1 TECU grid of the default IONEX exponent)
+    with an elevation cutoff and observables in the header.
+    """
+    rs    = np.random.RandomState(seed)
+    lats  = np.arange(87.5, -87.5 - 2.5, -2.5)
+    lons  = np.arange(-180, 180 + 5, 5.)
+    times = [datetime.datetime(2014, 1, 1) + datetime.timedelta(seconds=interval * i) for i in range(n_times)]
+    # COUNTS OF 0.1 TECU SCALED AS IN read_ionex.parse_block #
+    tec   = np.round((20 + 10 * rs.rand(n_times, len(lats), len(lons))) * 10) * 10.**-1
+    rms   = np.round(tec) * 10.**-1
+    header = {'exponent': -1,
+              'mapping_function': 'COSZ',
+              'base_radius': 6371.,
+              'elevation_cutoff': 10.,
+              'observables_used': 'TEC from GPS P1/P2 and L1/L2'}
+    return IonexCube(lons, lats, [450.], times, tec, rms, None, {}, {}, header)
+
+
+def test_round_trip():
+    """
+    The maps and the header records taken from the cube header
+    (including the elevation cutoff and observables) survive a write
+    and read round trip.
+    """
+    path = tempfile.mkdtemp()
+    try:
+        cube = synthetic_cube()
+        ionex_fname = write_ionex(os.path.join(path, 'synt0010.14i'), cube)
+        cube2 = read_ionex(ionex_fname)
+        assert cube2.times == cube.times
+        assert np.array_equal(cube2.tec, cube.tec)
+        assert np.array_equal(cube2.rms, cube.rms)
+        for key, value in cube.header.iteritems():
+            assert cube2.header[key] == value
+        # AND ONCE MORE FROM THE READ CUBE #
+        ionex_fname2 = write_ionex(os.path.join(path, 'synt0020.14i'), cube2)
+        with open(ionex_fname) as fid1, open(ionex_fname2) as fid2:
+            assert fid1.read() == fid2.read()
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    test_round_trip()
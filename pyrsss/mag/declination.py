@@ -0,0 +1,99 @@
+"""
+Local magnetic declination from the IGRF model (evaluated with
+pyglow) for arrays of locations and times.
+
+The IGRF is evaluated only at the nodes of a coarse time grid (one
+per day and location) and the declination at each requested time is
+interpolated linearly between the two bracketing nodes. Node values
+are cached for the life of the process, so converting, e.g., a year
+of daily files from one station requires at most one IGRF evaluation
+per day.
+"""
+from __future__ import division
+
+import logging
+from datetime import timedelta
+
+import numpy as NP
+from pyglow.pyglow import Point
+
+from ..util.date import UNIX_EPOCH
+
+logger = logging.getLogger('pyrsss.mag.declination')
+
+
+NODE_INTERVAL = 86400
+"""
+Interval (in [s]) between IGRF evaluation nodes. The secular
+variation of the declination is at most a few tenths of a degree per
+year, so the interpolation error is far below the declination change
+over one interval (< 2e-3 [deg] per day).
+"""
+
+NODE_CACHE = {}
+"""
+Declination (in [deg]) at IGRF evaluation nodes keyed by the tuple
+latitude, longitude, altitude, and node index (number of
+:data:`NODE_INTERVAL` past the UNIX epoch).
+"""
+
+
+def igrf_dec(lat, lon, alt, dt):
+    """
+    Return the IGRF declination (in [deg]) at geodetic *lat*, *lon*
+    (in [deg]), altitude *alt* (in [km]), and :class:`datetime`
+    *dt*.
+    """
+    point = Point(dt, lat, lon, alt)
+    point.run_igrf()
+    return point.dec
+
+
+def node_dec(lat, lon, alt, node):
+    """
+    Return the IGRF declination (in [deg]) at *lat*, *lon*, *alt* (see
+    :func:`igrf_dec`) and the time of *node* (see
+    :data:`NODE_CACHE`). Node values are cached.
+    """
+    key = (lat, lon, alt, node)
+    try:
+        return NODE_CACHE[key]
+    except KeyError:
+        dt = UNIX_EPOCH + timedelta(seconds=node * NODE_INTERVAL)
+        logger.debug('evaluating IGRF at {}, {}, {} on {:%Y-%m-%d %H:%M:%S}'.format(lat, lon, alt, dt))
+        dec = NODE_CACHE[key] = igrf_dec(lat, lon, alt, dt)
+        return dec
+
+
+def declination(lat, lon, alt, dt):
+    """
+    Return the local magnetic declination (in [deg]) at geodetic
+    *lat*, *lon* (in [deg]), altitude *alt* (in [km]), and times *dt*
+    (:class:`datetime` or :class:`datetime64`) interpolated from the
+    IGRF evaluated at the bracketing nodes (see
+    :data:`NODE_INTERVAL`). Arguments are broadcast and the result has
+    the broadcast shape.
+    """
+    t = NP.asarray(dt, dtype='datetime64[us]')
+    lat, lon, alt, t = NP.broadcast_arrays(NP.asarray(lat, dtype=NP.float64),
+                                           NP.asarray(lon, dtype=NP.float64),
+                                           NP.asarray(alt, dtype=NP.float64),
+                                           t)
+    shape = t.shape
+    u = (t.ravel() - NP.datetime64(UNIX_EPOCH)) / NP.timedelta64(NODE_INTERVAL, 's')
+    node = NP.floor(u)
+    w = u - node
+    # evaluate (or retrieve) each distinct location and node once
+    location = NP.column_stack((lat.ravel(), lon.ravel(), alt.ravel()))
+    keys = NP.vstack((NP.column_stack((location, node)),
+                      NP.column_stack((location, node + 1))))
+    unique_keys, inverse = NP.unique(keys, axis=0, return_inverse=True)
+    unique_dec = NP.array([node_dec(lat_i, lon_i, alt_i, int(node_i))
+                           for lat_i, lon_i, alt_i, node_i in unique_keys.tolist()])
+    dec1, dec2 = NP.split(unique_dec[inverse], 2)
+    # interpolate the shortest way around the circle
+    delta = NP.mod(dec2 - dec1 + 180, 360) - 180
+    dec = dec1 + w * delta
+    dec = NP.where(dec > 180, dec - 360, dec)
+    dec = NP.where(dec <= -180, dec + 360, dec)
+    return dec.reshape(shape)
@@ -0,0 +1,107 @@
+"""
+Vectorized conversions of surface magnetic field components between
+the geographic frame (X north, Y east), the magnetic frame (H
+horizontal intensity, D declination), and the observatory frame (H and
+E along and perpendicular to the declination baseline D0). The
+conversions follow those of the USGS geomag-algorithms package
+(geomagio.ChannelConverter) but operate directly on arrays (or
+:class:`DataFrame` columns). The vertical component Z is common to all
+frames. Angles are in [rad] unless noted otherwise.
+"""
+from __future__ import division
+
+import numpy as NP
+
+
+M2R = NP.pi / 180 / 60
+"""
+Conversion factor from minutes of arc to radians.
+"""
+
+
+def minutes2radians(m):
+    """
+    Return *m* converted from minutes of arc to radians.
+    """
+    return NP.multiply(m, M2R)
+
+
+def radians2minutes(r):
+    """
+    Return *r* converted from radians to minutes of arc.
+    """
+    return NP.divide(r, M2R)
+
+
+def decbas2radians(decbas):
+    """
+    Return the declination baseline *decbas* (in tenths of minutes of
+    arc, e.g., the IAGA-2002 DECBAS header record) converted to
+    radians.
+    """
+    return minutes2radians(NP.float64(decbas) / 10)
+
+
+def geo2mag(X, Y):
+    """
+    Return the tuple H (horizontal intensity) and D (declination)
+    given the geographic north *X* and east *Y* components.
+    """
+    return (NP.sqrt(NP.multiply(X, X) + NP.multiply(Y, Y)),
+            NP.arctan2(Y, X))
+
+
+def mag2geo(H, D):
+    """
+    Return the tuple X (geographic north) and Y (geographic east)
+    components given the horizontal intensity *H* and declination
+    *D*.
+    """
+    return (NP.multiply(H, NP.cos(D)),
+            NP.multiply(H, NP.sin(D)))
+
+
+def obs2mag(h, e, d0=0):
+    """
+    Return the tuple H (horizontal intensity) and D (declination)
+    given the observatory frame components *h* and *e* and
+    declination baseline *d0*.
+    """
+    return (NP.sqrt(NP.multiply(h, h) + NP.multiply(e, e)),
+            d0 + NP.arctan2(e, h))
+
+
+def mag2obs(H, D, d0=0):
+    """
+    Return the tuple h and e (observatory frame components) given the
+    horizontal intensity *H*, declination *D*, and declination
+    baseline *d0*.
+    """
+    return (NP.multiply(H, NP.cos(NP.subtract(D, d0))),
+            NP.multiply(H, NP.sin(NP.subtract(D, d0))))
+
+
+def obs_d2e(h, d):
+    """
+    Return the observatory frame e component given the *h* component
+    and the declination *d* relative to the declination baseline.
+    """
+    return NP.multiply(h, NP.tan(d))
+
+
+def obs2geo(h, e, d0=0):
+    """
+    Return the tuple X (geographic north) and Y (geographic east)
+    components given the observatory frame components *h* and *e* and
+    declination baseline *d0*.
+    """
+    return mag2geo(*obs2mag(h, e, d0=d0))
+
+
+def geo2obs(X, Y, d0=0):
+    """
+    Return the tuple h and e (observatory frame components) given the
+    geographic north *X* and east *Y* components and declination
+    baseline *d0*.
+    """
+    return mag2obs(*geo2mag(X, Y), d0=d0)
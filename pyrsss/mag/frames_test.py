@@ -0,0 +1,145 @@
+"""
+Parity checks of :mod:`frames` against a scalar transcription of the
+USGS geomag-algorithms conversions (geomagio.ChannelConverter, as
+applied by geomagio.StreamConverter) that it replaces. The vectorized
+conversions must agree bitwise.
+"""
+from __future__ import division
+
+import os
+import math
+import logging
+
+import numpy as NP
+
+from frames import decbas2radians, obs_d2e, obs2geo, geo2obs
+
+
+M2R = math.pi / 180 / 60
+"""
+Conversion factor from minutes of arc to radians (as in geomagio).
+"""
+
+
+def get_radians_from_minutes(m):
+    return m * M2R
+
+
+def get_obs_e_from_obs(h, d):
+    return h * math.tan(d)
+
+
+def get_mag_from_obs(h, e, d0=0):
+    return math.sqrt(h * h + e * e), d0 + math.atan2(e, h)
+
+
+def get_geo_from_mag(h, d):
+    return h * math.cos(d), h * math.sin(d)
+
+
+def get_mag_from_geo(X, Y):
+    return math.sqrt(X * X + Y * Y), math.atan2(Y, X)
+
+
+def get_obs_from_mag(h, d, d0=0):
+    return h * math.cos(d - d0), h * math.sin(d - d0)
+
+
+def get_geo_from_obs(h, e, d0=0):
+    return get_geo_from_mag(*get_mag_from_obs(h, e, d0))
+
+
+def get_obs_from_geo(X, Y, d0=0):
+    return get_obs_from_mag(*get_mag_from_geo(X, Y), d0=d0)
+
+
+def declination_base(decbas):
+    return get_radians_from_minutes(NP.float64(decbas) / 10)
+
+
+EXAMPLE_FNAME = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'example',
+                             'hon20000807d.min')
+"""
+IAGA-2002 (HDZF) example record.
+"""
+
+
+def synthetic_hd(N=86400, decbas=6144, seed=0):
+    """
+    Return the tuple of *N* synthetic observatory frame H (in [nT])
+    and D (relative to the declination baseline, in [rad]) samples
+    and the declination baseline *decbas* (in tenths of arcminutes).
+    """
+    random_state = NP.random.RandomState(seed)
+    h = 27000 + 500 * random_state.randn(N)
+    d = NP.radians(random_state.uniform(-3, 3, N))
+    return h, d, decbas
+
+
+def test_obs2geo():
+    """
+    :func:`frames.obs2geo` (with :func:`frames.obs_d2e`) is bitwise
+    equal to the geomagio observatory to geographic conversion.
+    """
+    h, d, decbas = synthetic_hd()
+    X, Y = obs2geo(h, obs_d2e(h, d), decbas2radians(decbas))
+    d0 = declination_base(decbas)
+    XY = NP.array([get_geo_from_obs(h_i, get_obs_e_from_obs(h_i, d_i), d0)
+                   for h_i, d_i in zip(h, d)])
+    assert NP.array_equal(X, XY[:, 0])
+    assert NP.array_equal(Y, XY[:, 1])
+
+
+def test_geo2obs():
+    """
+    :func:`frames.geo2obs` is bitwise equal to the geomagio
+    geographic to observatory conversion and inverts
+    :func:`frames.obs2geo` (to rounding error).
+    """
+    h, d, decbas = synthetic_hd()
+    e = obs_d2e(h, d)
+    X, Y = obs2geo(h, e, decbas2radians(decbas))
+    h2, e2 = geo2obs(X, Y, decbas2radians(decbas))
+    d0 = declination_base(decbas)
+    HE = NP.array([get_obs_from_geo(X_i, Y_i, d0) for X_i, Y_i in zip(X, Y)])
+    assert NP.array_equal(h2, HE[:, 0])
+    assert NP.array_equal(e2, HE[:, 1])
+    assert NP.max(NP.abs(h2 - h)) < 1e-9
+    assert NP.max(NP.abs(e2 - e)) < 1e-9
+
+
+def test_add_columns(iaga2002_fname=EXAMPLE_FNAME):
+    """
+    The XY and HE columns added by :func:`iaga2hdf.add_columns` to
+    the HDZ record *iaga2002_fname* are bitwise equal to the geomagio
+    conversions (D is converted to radians as in
+    :func:`iaga2hdf.df2stream`) and B_F agrees to within 1 ulp
+    (requires the :mod:`iaga2hdf` dependencies obspy and pyglow).
+    """
+    from iaga2002 import iaga2df
+    from iaga2hdf import add_columns
+    df, header = iaga2df(iaga2002_fname)
+    df = df.drop('B_F', axis=1)
+    output = add_columns(df, header, True, True)
+    d0 = declination_base(header['decbas'])
+    X, Y = NP.array([get_geo_from_obs(h_i, get_obs_e_from_obs(h_i, math.radians(d_i)), d0)
+                     for h_i, d_i in zip(df.B_H, df.B_D)]).T
+    H, E = NP.array([get_obs_from_geo(X_i, Y_i, d0) for X_i, Y_i in zip(X, Y)]).T
+    F = NP.array([math.sqrt(X_i * X_i + Y_i * Y_i + Z_i * Z_i) for X_i, Y_i, Z_i in zip(X, Y, df.B_Z)])
+    # missing samples (NaN) must coincide
+    NP.testing.assert_array_equal(output.B_X.values, X)
+    NP.testing.assert_array_equal(output.B_Y.values, Y)
+    NP.testing.assert_array_equal(output.B_H.values, H)
+    NP.testing.assert_array_equal(output.B_E.values, E)
+    assert NP.array_equal(NP.isnan(output.B_F.values), NP.isnan(F))
+    I = ~NP.isnan(F)
+    NP.testing.assert_array_max_ulp(output.B_F.values[I], F[I], maxulp=1)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    test_obs2geo()
+    test_geo2obs()
+    test_add_columns()
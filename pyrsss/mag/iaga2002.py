@@ -7,7 +7,9 @@ from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 from datetime import datetime, timedelta
 from collections import OrderedDict, namedtuple, defaultdict
 from abc import ABCMeta, abstractmethod, abstractproperty
+from cStringIO import StringIO
 
+import numpy as NP
 import pandas as PD
 
 logger = logging.getLogger('pyrsss.mag.iaga2002')
@@ -48,17 +50,33 @@ HEADER_TYPES = defaultdict(lambda: str,
                             ('Elevation', float)])
 
 
+"""IAGA-2002 data values flagging missing data (99999) and elements
+not observed (88888)."""
+MISSING_VALUES = [99999, 88888]
+
+
 def convert_float(s):
     """
     Convert the string data field *s* to a float. If the value is
     99999 (missing data) or 88888 (not observed), return not a number.
     """
     f = float(s)
-    if int(f) in [99999, 88888]:
+    if int(f) in MISSING_VALUES:
         return float('nan')
     return f
 
 
+def mask_missing(values):
+    """
+    Return a copy of the array *values* with the entries flagged by
+    :data:`MISSING_VALUES` (compared, as in :func:`convert_float`,
+    after truncation to integer) set to not a number.
+    """
+    values = NP.array(values, dtype=NP.float64)
+    values[NP.in1d(NP.trunc(values), MISSING_VALUES).reshape(values.shape)] = NP.nan
+    return values
+
+
 class IAGARecord(object):
     __metaclass__ = ABCMeta
 
@@ -188,13 +206,65 @@ def record_factory(reported, data):
         raise NotImplementedError('unknown record type {}'.format(reported))
 
 
-def parse(fname, strict=True):
+"""Names of the measured values (the :class:`IAGARecord` attributes)
+stored in the four data columns of each record type (D is in
+[deg])."""
+COLUMN_NAMES = OrderedDict([('HDZ', ['H', 'D', 'z', 'f']),
+                            ('XYZ', ['x', 'y', 'z', 'f'])])
+
+
+"""Character ranges of the four data fields of an IAGA-2002 data
+record."""
+DATA_FIELDS = [(31, 40),
+               (41, 50),
+               (51, 60),
+               (61, 70)]
+
+
+def parse_columns(fid, reported, strict=True):
+    """
+    Parse the IAGA-2002 data records remaining in the file object
+    *fid* (i.e., those following the data header record) with the
+    *reported* element type and return a structured array with the
+    record times (field `time`, :class:`datetime64` with microsecond
+    resolution) and measured values (fields given by
+    :data:`COLUMN_NAMES`). See :func:`parse` for *strict*.
+    """
+    for prefix, names in COLUMN_NAMES.iteritems():
+        if reported.startswith(prefix):
+            break
+    else:
+        raise NotImplementedError('unknown record type {}'.format(reported))
+    lines = NP.array([line for line in fid if line.strip()],
+                     dtype='S{}'.format(DATA_FIELDS[-1][1]))
+    chars = lines.view('S1').reshape(len(lines), -1)
+    columns = NP.empty(len(lines),
+                       dtype=[('time', 'datetime64[us]')] + [(x, NP.float64) for x in names])
+    try:
+        columns['time'] = chars[:, :23].copy().view('S23').ravel().astype('datetime64[us]')
+    except ValueError:
+        if strict:
+            raise
+        columns['time'] = chars[:, :19].copy().view('S19').ravel().astype('datetime64[us]')
+    for name, (i1, i2) in zip(names, DATA_FIELDS):
+        values = chars[:, i1:i2].copy().view('S{}'.format(i2 - i1)).ravel()
+        columns[name] = mask_missing(values.astype(NP.float64))
+    if prefix == 'HDZ':
+        # minutes of arc to degrees (as in HDZRecord)
+        columns['D'] /= 60
+    return columns
+
+
+def parse(fname, strict=True, columnar=False):
     """
     Parser the IAGA2002 format file *fname* and return a tuple with a
     :class:`Header` and mapping of date/times to measured values. If
     *strict*, fail when an nonconforming entry is encountered. If
     *strict* is not set, attempt to carry on when simple parse errors
-    are encountered.
+    are encountered. If *columnar*, return the measured values as a
+    structured array (see :func:`parse_columns`) instead of the
+    mapping to :class:`IAGARecord` objects --- much faster and
+    smaller for long (e.g., 1 second) records.
     """
     with open(fname) as fid:
         # parse header
@@ -233,6 +303,10 @@ def parse(fname, strict=True):
         if len(fields) != 7:
             raise RuntimeError('malformed data header record in {} ({})'.format(fname,
                                                                                 line))
+        if columnar:
+            return header, parse_columns(fid,
+                                         header_map['Reported'],
+                                         strict=strict)
         data_map = OrderedDict()
         # parse data records
         for line in fid:
@@ -325,18 +399,26 @@ def iaga2df(iaga2002_fname, D_to_radians=True):
         # parse header
         header, cols = parse_header(fid)
         keys = ['B_' + x for x in cols]
-        # parse data
-        index = []
-        data_map = defaultdict(list)
-        for line in fid:
-            toks = line.split()
-            dt = datetime.strptime(toks[0] + ' ' + toks[1], '%Y-%m-%d %H:%M:%S.%f')
-            index.append(dt)
-            data = map(convert_float, toks[3:])
-            for key_i, data_i in zip(keys, data):
-                if key_i == 'B_D' and D_to_radians:
-                    data_i = math.radians(data_i)
-                data_map[key_i].append(data_i)
+        # parse data --- the whitespace separated data block is read
+        # at once (round trip float conversion gives the same values
+        # as float)
+        data_block = ''.join(fid)
+    n_cols = 3 + len(keys)
+    dtype = dict([(0, str), (1, str)] + [(i, NP.float64) for i in range(3, n_cols)])
+    data = PD.read_csv(StringIO(data_block),
+                       delim_whitespace=True,
+                       header=None,
+                       usecols=range(n_cols),
+                       dtype=dtype,
+                       float_precision='round_trip')
+    index = PD.DatetimeIndex(PD.to_datetime(data[0] + ' ' + data[1],
+                                            format='%Y-%m-%d %H:%M:%S.%f').values)
+    values = mask_missing(data[range(3, n_cols)].values)
+    data_map = {}
+    for i, key_i in enumerate(keys):
+        data_map[key_i] = values[:, i]
+        if key_i == 'B_D' and D_to_radians:
+            data_map[key_i] = NP.radians(values[:, i])
     df = PD.DataFrame(index=index, data=data_map)
     return df, header
 
@@ -352,11 +434,11 @@ def main(argv=None):
                         help='IAGA2002 file name')
     args = parser.parse_args(argv[1:])
 
-    header, data_map = parse(args.iaga2002_fname)
+    header, columns = parse(args.iaga2002_fname, columnar=True)
 
     for key, value in header._asdict().items():
         print('{} = {}'.format(key.replace(' ', '-'), value))
-    for dt, values in data_map.items():
+    for dt, values in zip(columns['time'].tolist(), columns.tolist()):
         print('{:%Y-%m-%d %H:%M:%S.%f}:  {}  {}  {}  {}'.format(dt,
                                                                 values[1],
                                                                 values[2],
@@ -4,22 +4,30 @@ import os
 import sys
 import math
 import logging
+from collections import deque
+from multiprocessing import Pool, cpu_count
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 
 import numpy as NP
 import pandas as PD
-from pyglow.pyglow import Point
-from geomagio.StreamConverter import get_obs_from_geo, get_geo_from_obs
 from obspy.core.stream import Stream
 from obspy.core.utcdatetime import UTCDateTime
 from obspy.core.trace import Trace
 
-from pyrsss.mag.iaga2002 import iaga2df
+from pyrsss.mag.iaga2002 import iaga2df, parse_header
+from pyrsss.mag.frames import decbas2radians, obs_d2e, obs2geo, geo2obs
+from pyrsss.mag.declination import declination
 from ..util.angle import deg2tenths_of_arcminute
 
 logger = logging.getLogger('pyrsss.mag.iaga2hdf')
 
 
+"""Number of parsed IAGA-2002 files, per worker process, held in
+memory ahead of the consumer (bounds memory use when writing is slower
+than parsing)."""
+LOOKAHEAD = 2
+
+
 def find_value(key, headers):
     """
     Search *headers* for *key* and return the common value shared
@@ -76,14 +84,13 @@ def get_dec_tenths_arcminute(header, date):
     Return the local magnetic declination angle associated with a
     sensor at the location given in *header* and *date*. The returned
     angle is in tenths of arcminutes (there are 360 * 60 * 10 tenths
-    of arcminnutes in one circle).
+    of arcminnutes in one circle). The IGRF evaluations are cached
+    (see :func:`declination.declination`).
     """
-    point = Point(date,
-                  header['Geodetic Latitude'],
-                  header['Geodetic Longitude'],
-                  header['Elevation'])
-    point.run_igrf()
-    dec_deg = point.dec
+    dec_deg = float(declination(header['Geodetic Latitude'],
+                                header['Geodetic Longitude'],
+                                header['Elevation'],
+                                date))
     if 'IAGA CODE' in header:
         logger.info('using declination angle {:f} (deg) for {}'.format(dec_deg, header['IAGA CODE']))
     else:
@@ -91,6 +98,36 @@ def get_dec_tenths_arcminute(header, date):
     return fix_sign(deg2tenths_of_arcminute(dec_deg))
 
 
+def declination_base(header, date):
+    """
+    Return the declination baseline (in tenths of arcminutes) given
+    in *header* (`decbas`) or, if not present, the local magnetic
+    declination angle at the location given in *header* and *date*
+    (see :func:`get_dec_tenths_arcminute`).
+    """
+    if 'decbas' in header:
+        return header['decbas']
+    return get_dec_tenths_arcminute(header, date)
+
+
+def record_decbas(iaga2002_fnames):
+    """
+    Return the declination baseline (in tenths of arcminutes) shared
+    by the headers of the IAGA-2002 records *iaga2002_fnames* or None
+    if any of the headers does not give one (only the header lines
+    are read). Raise an exception if the headers give different
+    values (see :func:`find_value`).
+    """
+    headers = []
+    for iaga2002_fname in iaga2002_fnames:
+        with open(iaga2002_fname) as fid:
+            headers.append(parse_header(fid)[0])
+    try:
+        return find_value('decbas', headers)
+    except KeyError:
+        return None
+
+
 def df2stream(df,
               header,
               network='NT',
@@ -116,9 +153,7 @@ def df2stream(df,
     d2 = df.index[-1]
     d1_obj = UTCDateTime('{:%Y-%m-%d %H:%H:%S}'.format(d1))
     d2_obj = UTCDateTime('{:%Y-%m-%d %H:%H:%S}'.format(d2))
-    dec_tenths_arcminute = header.get('decbas',
-                                      get_dec_tenths_arcminute(header,
-                                                               d1.to_pydatetime()))
+    dec_tenths_arcminute = declination_base(header, d1.to_pydatetime())
     logger.info('using declination baseline = {:.1f} (tenths of arcminutes)'.format(dec_tenths_arcminute))
     N = df.shape[0]
     stream_header = {'geodetic_latitude': header['Geodetic Latitude'],
@@ -173,18 +208,71 @@ def read_hdf(hdf_fname, key):
         return df, header
 
 
-def combine_iaga(iaga2002_fnames):
+def iter_iaga(iaga2002_fnames, processes=cpu_count()):
+    """
+    Parse the IAGA-2002 data records *iaga2002_fnames* (in time order)
+    in *processes* worker processes and yield, in order, the tuple
+    :class:`DataFrame` and header (reduced and checked for consistency
+    with all preceding records, see :func:`reduce_headers`) of each
+    record. Samples at or before the last sample of the preceding
+    records (e.g., the duplicated midnight sample of daily files) are
+    dropped. At most *processes* * :data:`LOOKAHEAD` parsed records
+    are held in memory.
+    """
+    header = None
+    t_last = None
+    pool = Pool(processes)
+    try:
+        pending = deque()
+        fnames = iter(iaga2002_fnames)
+        while True:
+            for iaga2002_fname in fnames:
+                pending.append((iaga2002_fname,
+                                pool.apply_async(iaga2df, (iaga2002_fname,))))
+                if len(pending) >= processes * LOOKAHEAD:
+                    break
+            if not pending:
+                break
+            iaga2002_fname, result = pending.popleft()
+            df_i, header_i = result.get()
+            logger.info('processed {}'.format(iaga2002_fname))
+            if header is None:
+                header = reduce_headers([header_i])
+            else:
+                for key in header.keys():
+                    try:
+                        find_value(key, [header, header_i])
+                    except KeyError:
+                        logger.warning('Entry for {} not found in IAGA headers --- skipping'.format(key))
+                        del header[key]
+            df_i = df_i[~df_i.index.duplicated()]
+            if t_last is not None:
+                if len(df_i) > 0 and df_i.index[0] < t_last:
+                    logger.warning('{} starts before the end of the preceding '
+                                   'records --- dropping overlapping samples'.format(iaga2002_fname))
+                df_i = df_i[df_i.index > t_last]
+            if len(df_i) == 0:
+                continue
+            t_last = df_i.index[-1]
+            yield df_i, header
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def combine_iaga(iaga2002_fnames, processes=cpu_count()):
     """
     Load one or more IAGA-2002 data records *iaga_fnames* and
-    concatenate the data into a single :class:`DataFrame` record.
+    concatenate the data into a single :class:`DataFrame` record. See
+    :func:`iter_iaga` for *processes* (use :func:`iaga2hdf` to write
+    long spans without holding them in memory).
     """
     df_list = []
-    header_list = []
-    for iaga2002_fname in iaga2002_fnames:
-        df_i, header_i = iaga2df(iaga2002_fname)
+    header = None
+    for df_i, header in iter_iaga(iaga2002_fnames, processes=processes):
         df_list.append(df_i)
-        header_list.append(header_i)
-    return PD.concat(df_list), reduce_headers(header_list)
+    return PD.concat(df_list), header
 
 
 def xy2df(df, header):
@@ -194,10 +282,16 @@ def xy2df(df, header):
     *df* and return. The record *header* is necessary to carry out the
     coordinate transformation.
     """
-    obs = df2stream(df, header)
-    geo = get_geo_from_obs(obs)
-    return df.assign(B_X=geo.select(channel='X').traces[0].data,
-                     B_Y=geo.select(channel='Y').traces[0].data)
+    d0 = decbas2radians(declination_base(header, df.index[0].to_pydatetime()))
+    h = df['B_H'].values
+    if 'B_E' in df.columns:
+        e = df['B_E'].values
+    else:
+        # D is converted to radians as in df2stream
+        e = obs_d2e(h, NP.radians(df['B_D'].values))
+    X, Y = obs2geo(h, e, d0=d0)
+    return df.assign(B_X=X,
+                     B_Y=Y)
 
 
 def he2df(df, header):
@@ -208,17 +302,13 @@ def he2df(df, header):
     necessary to carry out the coordinate transformation.
     """
     if ('B_F' not in df.columns):
-        # The USGS geomag-algorithms module requires the magnetic
-        # field magnitude B_F to transform from XY to HE --- add the
-        # B_F column if it is not present
-        values = zip(df['B_X'].values,
-                     df['B_Y'].values,
-                     df['B_Z'].values)
-        df = df.assign(B_F=[NP.linalg.norm([x, y, z]) for x, y, z in values])
-    geo = df2stream(df, header)
-    obs = get_obs_from_geo(geo)
-    return df.assign(B_H=obs.select(channel='H').traces[0].data,
-                     B_E=obs.select(channel='E').traces[0].data)
+        # add the magnetic field magnitude B_F column if it is not
+        # present
+        df = df.assign(B_F=NP.linalg.norm(df[['B_X', 'B_Y', 'B_Z']].values, axis=1))
+    d0 = decbas2radians(declination_base(header, df.index[0].to_pydatetime()))
+    h, e = geo2obs(df['B_X'].values, df['B_Y'].values, d0=d0)
+    return df.assign(B_H=h,
+                     B_E=e)
 
 
 def add_columns(df, header, xy, he):
@@ -243,21 +333,47 @@ def iaga2hdf(hdf_fname,
              iaga2002_fnames,
              xy=True,
              he=False,
-             key='B_raw'):
+             key='B_raw',
+             processes=cpu_count()):
     """
     Convert data found in IAGA 2002 files *iaga2002_fnames* to an HDF
     record at *hdf_fname*. Write to the HDF record associated with
     *key*. If *he*, store the H (mag north) and E (mag east)
-    components.
+    components. The files are parsed in *processes* worker processes
+    and appended, one at a time, to the HDF record (a table), so that
+    memory use does not depend on the time span (see
+    :func:`iter_iaga`). The declination baseline given by the headers
+    (see :func:`record_decbas`) is used for every file or, if not
+    given by every header, the IGRF declination at the start of the
+    span.
     """
-    df, header = combine_iaga(iaga2002_fnames)
-    df = add_columns(df, header, xy, he)
-    # change header names
-    if 'Geodetic Latitude' in header:
-        header['geodetic_latitude'] = header.pop('Geodetic Latitude')
-    if 'Geodetic Longitude' in header:
-        header['geodetic_longitude'] = header.pop('Geodetic Longitude')
-    write_hdf(hdf_fname, df, key, {k.lower(): v for k, v in header.items()})
+    iaga2002_fnames = list(iaga2002_fnames)
+    # the declination baseline is fixed for the whole record before
+    # any rows are written
+    decbas = record_decbas(iaga2002_fnames)
+    header = None
+    with PD.HDFStore(hdf_fname) as store:
+        if key in store:
+            store.remove(key)
+        for df_i, header in iter_iaga(iaga2002_fnames, processes=processes):
+            if decbas is None:
+                # not given by every header --- use the IGRF
+                # declination at the start of the span for every file
+                decbas = get_dec_tenths_arcminute(header,
+                                                  df_i.index[0].to_pydatetime())
+            store.append(key,
+                         add_columns(df_i, dict(header, decbas=decbas), xy, he),
+                         format='table',
+                         index=False)
+        if header is None:
+            raise ValueError('no IAGA-2002 records found')
+        store.create_table_index(key)
+        # change header names
+        if 'Geodetic Latitude' in header:
+            header['geodetic_latitude'] = header.pop('Geodetic Latitude')
+        if 'Geodetic Longitude' in header:
+            header['geodetic_longitude'] = header.pop('Geodetic Longitude')
+        store.get_storer(key).attrs.header = {k.lower(): v for k, v in header.items()}
     return hdf_fname
 
 
@@ -278,11 +394,16 @@ def main(argv=None):
     parser.add_argument('--he',
                         action='store_true',
                         help='include data in HE coordinate')
+    parser.add_argument('--processes',
+                        type=int,
+                        default=cpu_count(),
+                        help='number of worker processes used to parse the input files')
     args = parser.parse_args(argv[1:])
 
     iaga2hdf(args.hdf_fname,
              args.iaga2002_fnames,
-             he=args.he)
+             he=args.he,
+             processes=args.processes)
 
 
 if __name__ == '__main__':
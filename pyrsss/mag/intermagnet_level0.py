@@ -5,14 +5,15 @@ from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 import sys
 import logging
 import os
-import math
 
 import numpy as NP
-from netCDF4 import Dataset, date2num
+from netCDF4 import Dataset
 
 from repository import get_root, TEMPLATE_MAP, PATH_MAP
 from iaga2002 import parse
 from util import mag_dec
+from frames import minutes2radians, radians2minutes, geo2mag, mag2geo
+from ..util.date import J2000_EPOCH
 
 
 logger = logging.getLogger('intermagnet_level0')
@@ -50,14 +51,13 @@ def check_consistency(header1,
 def convert_HDZ_to_XYZ(H, D, Z):
     """
     Convert *H* (magnitude tangential to Earth's surface [nT]), *D*
-    (declination [arcmin * 10]), and *Z* (downward magnitude [nT])) to
-    *X* (magnitude of the geographic north pole component [nT]), *Y*
-    (magnitude of the east component [nT]), and *Z* [nT].
+    (declination [arcmin]), and *Z* (downward magnitude [nT])) to *X*
+    (magnitude of the geographic north pole component [nT]), *Y*
+    (magnitude of the east component [nT]), and *Z* [nT]. Arguments
+    may be arrays.
     """
-    D_rad = math.radians(arcmin_to_deg(D / 10))
-    return (H * math.cos(D_rad),
-            H * math.sin(D_rad),
-            Z)
+    X, Y = mag2geo(H, minutes2radians(D))
+    return X, Y, Z
 
 
 def arcmin_to_deg(x):
@@ -76,11 +76,10 @@ def deg_to_arcmin(x):
 
 def convert_XYZ_to_HDZ(X, Y, Z):
     """
-    Inverse of :func:`convert_heZ_to_XYZ`.
+    Inverse of :func:`convert_HDZ_to_XYZ`.
     """
-    return (math.hypot(X, Y),
-            deg_to_arcmin(math.degrees(math.atan2(Y, X))) * 10,
-            Z)
+    H, D = geo2mag(X, Y)
+    return H, radians2minutes(D), Z
 
 
 NAME_MAP = {'X': 'magnitude of the geographic north pole component',
@@ -144,13 +143,6 @@ def setup_netcdf_root(root,
     return root
 
 
-def fill_missing(data):
-    """
-    Replace 99999 and 88888 entries with nan.
-    """
-    return [x if x not in [99999, 88888] else float('nan') for x in data]
-
-
 def process_iaga2002(output_nc_fname,
                      input_iaga2002_fnames):
     """
@@ -159,55 +151,42 @@ def process_iaga2002(output_nc_fname,
     *output_nv_fname*.
     """
     last_header = None
-    dt = []
-    X = []
-    Y = []
-    Z = []
-    H = []
-    D = []
-    F = []
+    columns = []
     # gather information
     for iaga2002_fname in input_iaga2002_fnames:
         logger.info('processing {}'.format(iaga2002_fname))
-        header, data_map = parse(iaga2002_fname)
+        header, columns_i = parse(iaga2002_fname, columnar=True)
         if last_header is not None:
             if not check_consistency(header,
                                      last_header):
                 raise RuntimeError('header inconsistency detected')
-        for dt_i, data_i in data_map.items():
-            # accumulate data in lists
-            dt.append(dt_i)
-            data_i = fill_missing(data_i)
-            if header.Reported == 'HDZF':
-                H.append(data_i[0])
-                D.append(data_i[1])
-                Z.append(data_i[2])
-                F.append(data_i[3])
-                # convert to XYZ
-                X_i, Y_i, _ = convert_HDZ_to_XYZ(H[-1], D[-1], Z[-1])
-                X.append(X_i)
-                Y.append(Y_i)
-            elif header.Reported in ['XYZF', 'XYZG']:
-                X.append(data_i[0])
-                Y.append(data_i[1])
-                Z.append(data_i[2])
-                F.append(data_i[3])
-                # convert to heZ
-                H_i, D_i, _ = convert_XYZ_to_HDZ(X[-1], Y[-1], Z[-1])
-                H.append(H_i)
-                D.append(D_i)
-            else:
-                raise RuntimeError('unknown Reported type {}'.format(header.Reported))
+        if header.Reported not in ['HDZF', 'XYZF', 'XYZG']:
+            raise RuntimeError('unknown Reported type {}'.format(header.Reported))
+        columns.append(columns_i)
         last_header = header
+    columns = NP.concatenate(columns)
+    if header.Reported == 'HDZF':
+        H = columns['H']
+        D = deg_to_arcmin(columns['D'])
+        Z = columns['z']
+        # convert to XYZ
+        X, Y, _ = convert_HDZ_to_XYZ(H, D, Z)
+    else:
+        X = columns['x']
+        Y = columns['y']
+        Z = columns['z']
+        # convert to HDZ
+        H, D, _ = convert_XYZ_to_HDZ(X, Y, Z)
+    F = columns['f']
     # write information to netCDF record
     root = Dataset(output_nc_fname, 'w')
     # add header, dimensions, and variables
     setup_netcdf_root(root,
                       header,
-                      len(dt))
-    # write information to file
-    time = [date2num(dt_i, units=root['time'].units, calendar=root['time'].calendar) for dt_i in dt]
-    root['time'][:] = time
+                      len(columns))
+    # write information to file (seconds past J2000, see
+    # setup_netcdf_root)
+    root['time'][:] = (columns['time'] - NP.datetime64(J2000_EPOCH)) / NP.timedelta64(1, 's')
     root['X'][:] = X
     root['Y'][:] = Y
     root['Z'][:] = Z
@@ -10,10 +10,9 @@ from collections import defaultdict, OrderedDict
 
 import pandas as PD
 
-from pyglow.pyglow import Point
-
 from sm2hdf import read_sm_csv
 from sm_stations import STATION_MAP
+from declination import declination
 
 logger = logging.getLogger('pyrsss.mag.sm2iaga')
 
@@ -40,9 +39,7 @@ def ne2xy_converter(stn, dt, nan=True, elevation=None):
     station_info = STATION_MAP[stn.upper()]
     lat = station_info.glat
     lon = station_info.glon
-    point = Point(dt, lat, lon, elevation / 1e3 if elevation else 0)
-    point.run_igrf()
-    dec_deg = point.dec
+    dec_deg = float(declination(lat, lon, elevation / 1e3 if elevation else 0, dt))
     logger.info('using declination angle {:f} (deg) for {}'.format(dec_deg, stn))
     dec_rad = math.radians(dec_deg)
     cos_dec = math.cos(dec_rad)
@@ -0,0 +1,147 @@
+from __future__ import division
+
+import sys
+import time
+import logging
+from bisect import bisect_left, insort
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+import numpy as NP
+import pandas as PD
+
+logger = logging.getLogger('pyrsss.stats.rolling')
+
+
+"""Window lengths covered by :func:`benchmark`."""
+BENCHMARK_WINDOWS = [11, 31, 301, 1801, 3601]
+
+
+def kth_deviation(s, m, h, k):
+    """
+    Return the *k*-th smallest (0 based) absolute deviation from *m*
+    of the values in the sorted list *s*, where *m* = *s*[*h*]. The
+    deviations of the values below and above *m* form two sorted
+    sequences and the search takes O(log len(*s*)) steps.
+    """
+    # A(i) = m - s[h - 1 - i], i < h, and B(j) = s[h + j] - m, j < len(s) - h
+    n = k + 1
+    lo = max(0, n - (len(s) - h))
+    hi = min(n, h)
+    while lo < hi:
+        # take i values from A and n - i values from B
+        i = (lo + hi) // 2
+        if m - s[h - 1 - i] < s[h + n - i - 1] - m:
+            lo = i + 1
+        else:
+            hi = i
+    if lo == 0:
+        return s[h + n - 1] - m
+    elif lo == n:
+        return m - s[h - n]
+    return max(m - s[h - lo], s[h + n - lo - 1] - m)
+
+
+def rolling_median_mad(x, window):
+    """
+    Return the tuple of the rolling median and median absolute
+    deviation (see :func:`stats.mad`) of the array *x* over centered
+    windows of (odd) length *window*. As with the :mod:`pandas`
+    rolling window functions (with `center=True`), the values are not
+    a number where the window is incomplete or includes a not a number
+    value. The window is kept as a sorted list (updated with
+    :mod:`bisect`) so that each step takes O(log *window*) comparisons
+    (plus the list insertion and deletion). The results are identical
+    to those computed with :func:`numpy.median`.
+    """
+    if window % 2 == 0:
+        raise ValueError('window length must be odd')
+    values = NP.asarray(x, dtype=NP.float64).tolist()
+    N = len(values)
+    h = window // 2
+    median = [float('nan')] * N
+    mad = [float('nan')] * N
+    s = []
+    nans = 0
+    for i, x_i in enumerate(values):
+        # add the newest value
+        if x_i != x_i:
+            nans += 1
+        else:
+            insort(s, x_i)
+        if i < window - 1:
+            continue
+        if nans == 0:
+            m = s[h]
+            median[i - h] = m
+            mad[i - h] = kth_deviation(s, m, h, h)
+        # remove the oldest value
+        x_j = values[i - window + 1]
+        if x_j != x_j:
+            nans -= 1
+        else:
+            del s[bisect_left(s, x_j)]
+    return NP.array(median), NP.array(mad)
+
+
+def benchmark(N=86400, windows=BENCHMARK_WINDOWS, seed=0):
+    """
+    Compare :func:`rolling_median_mad` to the :mod:`pandas` rolling
+    window median and `apply` of :func:`stats.robust_std` (the
+    previous implementation of :func:`stats.despike`) for each of
+    *windows* on a synthetic random walk of *N* samples (with spikes
+    and not a number values). Check the results are identical and
+    return the list of tuples window length, pandas time [s], and
+    :func:`rolling_median_mad` time [s].
+    """
+    from stats import robust_std, ROBUST_STD_ALPHA
+    random_state = NP.random.RandomState(seed)
+    x = NP.cumsum(random_state.randn(N))
+    x[random_state.randint(N, size=N // 1000)] += 100 * random_state.randn(N // 1000)
+    x[random_state.randint(N, size=10)] = NP.nan
+    series = PD.Series(x)
+    results = []
+    for window in windows:
+        t1 = time.time()
+        rolling = series.rolling(window, center=True)
+        median1 = rolling.median().values
+        std1 = rolling.apply(robust_std, raw=True).values
+        t2 = time.time()
+        median2, mad2 = rolling_median_mad(x, window)
+        std2 = ROBUST_STD_ALPHA * mad2
+        t3 = time.time()
+        NP.testing.assert_array_equal(median1, median2)
+        NP.testing.assert_array_equal(std1, std2)
+        logger.info('window={} pandas={:.3f} (s) rolling_median_mad={:.3f} (s)'.format(window,
+                                                                                       t2 - t1,
+                                                                                       t3 - t2))
+        results.append((window, t2 - t1, t3 - t2))
+    return results
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    parser = ArgumentParser('Benchmark the rolling median and MAD against the pandas rolling window implementation.',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--N',
+                        type=int,
+                        default=86400,
+                        help='number of samples')
+    parser.add_argument('--windows',
+                        type=int,
+                        nargs='+',
+                        default=BENCHMARK_WINDOWS,
+                        help='window lengths')
+    args = parser.parse_args(argv[1:])
+
+    for window, t_pandas, t_rolling in benchmark(N=args.N, windows=args.windows):
+        print('{:5d}  {:8.3f}  {:8.3f}  {:6.1f}x'.format(window,
+                                                         t_pandas,
+                                                         t_rolling,
+                                                         t_pandas / t_rolling))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -7,6 +7,14 @@ from collections import Iterable
 
 import scipy.stats
 import numpy as NP
+import pandas as PD
+
+from rolling import rolling_median_mad
+
+
+"""Ratio of the standard deviation to the median absolute deviation
+for normally distributed samples."""
+ROBUST_STD_ALPHA = 1/scipy.stats.norm.ppf(0.75)
 
 
 def mad(l):
@@ -18,7 +26,7 @@ def mad(l):
     return NP.median(NP.abs(l - median)), median
 
 
-def robust_std(l, alpha=1/scipy.stats.norm.ppf(0.75)):
+def robust_std(l, alpha=ROBUST_STD_ALPHA):
     """
     Compute a robust estimate of the standard deviation for the list
     of values *l* (by default, for normally distributed samples ---
@@ -29,22 +37,32 @@ def robust_std(l, alpha=1/scipy.stats.norm.ppf(0.75)):
 
 def despike(df, window=31, l=6):
     """
-    Remove outliers from the columns of :class:`DataFrame` by
-    comparing the absolute deviation from the windowed median to the
+    Remove outliers from the columns of :class:`DataFrame` (or the
+    :class:`Series`) *df* by comparing the absolute deviation from the windowed median to the
     windowed robust standard deviation (see :func:`robust_std`). Use a
     centered window of length *window* (must be odd). Replace values
     that are *l* robust standard deviations from the absolute
     difference from the median with the median.
 
+    The windowed median and robust standard deviation are computed
+    with :func:`rolling.rolling_median_mad` (O(N log *window*)) and
+    are identical to those of the :mod:`pandas` rolling window
+    median and `apply` of :func:`robust_std`.
+
     Reference: Hampel F. R., "The influence curve and its role in
     robust estimation," Journal of the American Statistical
     Association, 69, 382-393, 1974.
     """
     if window % 2 == 0:
         raise ValueError('window length must be odd')
-    df_rolling = df.rolling(window, center=True)
-    df_rolling_median = df_rolling.median()
-    df_robust_std = df_rolling.apply(robust_std)
+    if isinstance(df, PD.Series):
+        return despike(df.to_frame(), window=window, l=l).iloc[:, 0].rename(df.name)
+    df_rolling_median = PD.DataFrame(index=df.index, columns=df.columns, dtype=NP.float64)
+    df_robust_std = PD.DataFrame(index=df.index, columns=df.columns, dtype=NP.float64)
+    for column in df.columns:
+        median, mad = rolling_median_mad(df[column].values, window)
+        df_rolling_median[column] = median
+        df_robust_std[column] = ROBUST_STD_ALPHA * mad
     I = (df - df_rolling_median).abs() > l * df_robust_std
     df_despike = df.copy()
     df_despike[I] = df_rolling_median
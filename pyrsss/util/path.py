@@ -47,6 +47,43 @@ class SmartTempDir(TempDirectory):
             super(SmartTempDir, self).__exit__(type, value, traceback)
 
 
+class AtomicOutput(object):
+    def __init__(self, fname):
+        """
+        Context manager that returns a temporary file name in the
+        directory of *fname*. The temporary file is renamed to *fname*
+        when the block exits without exception and removed otherwise,
+        i.e., *fname* is never left partially written.
+        """
+        self.fname = fname
+
+    def __enter__(self):
+        path, basename = os.path.split(os.path.abspath(self.fname))
+        fid, self.temp_fname = tempfile.mkstemp(prefix='.' + basename + '.',
+                                                suffix='.tmp',
+                                                dir=path)
+        os.close(fid)
+        return self.temp_fname
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            # mkstemp creates the file with mode 0600 --- give it the
+            # permissions of a file created with open
+            os.chmod(self.temp_fname, 0o666 & ~get_umask())
+            os.rename(self.temp_fname, self.fname)
+        elif os.path.exists(self.temp_fname):
+            os.remove(self.temp_fname)
+
+
+def get_umask():
+    """
+    Return the file mode creation mask of the process.
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
 def touch_path(path):
     """
     If *path* does not exist, create it. Returns *path*.